@@ -4,36 +4,38 @@ from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, Union
 from UtilityFunctions.llm_client import LLMClient
+from UtilityFunctions.run_logging import setup_run_logging
 import pandas as pd
 
 class OutputManager:
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], output_dir: Union[str, Path, None] = None):
+        """output_dir attaches to an existing run directory, e.g. for work queue workers, instead of creating a new one."""
         self.config = config
-        if self.config['output']['mode'] == 'debug':
+        if output_dir is not None:
+            self.folder = Path(output_dir).name
+        elif self.config['output']['mode'] == 'debug':
             self.folder = "debug"
         else:
             self.folder = datetime.now().strftime("%Y%m%d_%H%M%S") + '_' + self.config['output']['name']
-        self.output_dir = self._setup_output_dir()
+        self.output_dir = self._setup_output_dir(output_dir)
         self.execution_dir = self.output_dir  # Default to output_dir
         self._setup_logging()
 
-    def _setup_output_dir(self) -> Path:
-        base_dir = Path(self.config["output"]["base_dir"])
-        output_dir = base_dir / self.folder
+    def _setup_output_dir(self, output_dir: Union[str, Path, None] = None) -> Path:
+        if output_dir is not None:
+            output_dir = Path(output_dir)
+        else:
+            output_dir = Path(self.config["output"]["base_dir"]) / self.folder
         output_dir.mkdir(parents=True, exist_ok=True)
         return output_dir
 
     def _setup_logging(self):
-        log_file = self.output_dir / "processor.log"
         log_config = self.config.get("logging", {})
-
-        logging.basicConfig(
-            level=getattr(logging, log_config.get("level", "INFO")),
-            format=log_config.get("format", "%(asctime)s - %(name)s - %(levelname)s - %(message)s"),
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler()
-            ]
+        setup_run_logging(
+            self.output_dir / "processor.log",
+            __name__,
+            log_config.get("level", "INFO"),
+            log_config.get("format", "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
         )
         self.logger = logging.getLogger(__name__)
         self.logger.info(f"Output directory created at: {self.output_dir}")
@@ -58,9 +60,10 @@ class OutputManager:
             return str(self.output_dir / f"survey_flow.{self.config['output']['visualization']['format']}")
         return None
 
-    def save_json(self, data: Dict[str, Any], file_name: str):
+    def save_json(self, data: Dict[str, Any], file_name: str, directory: Union[str, Path, None] = None):
+        """directory overrides execution_dir, for executions that run concurrently."""
         if ".json" not in file_name: file_name += ".json"
-        output_path = self.execution_dir / file_name  # Use execution_dir instead of output_dir
+        output_path = Path(directory or self.execution_dir) / file_name  # Use execution_dir instead of output_dir
         with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
         self.logger.info(f"Data saved to: {output_path}")
@@ -73,13 +76,17 @@ class OutputManager:
         self.logger.info(f"Data saved to: {output_path}")
         return output_path
 
-def load_config(config_path: str = "./Config/config.json"):
+def load_config(config_path: str = "./Config/config.json", output_dir: Union[str, Path, None] = None, llm_client: LLMClient = None):
+    """llm_client from an earlier run is moved to the new output directory and reused if the config is unchanged."""
     with open(config_path, 'r', encoding='utf-8') as f:
         config = json.load(f)
     from Config.config import OutputManager
-    output_manager = OutputManager(config)
+    output_manager = OutputManager(config, output_dir)
     logger = logging.getLogger(__name__)
-    llm_client = LLMClient(config_path, output_manager.output_dir)
+    if llm_client is not None and llm_client.config == config:
+        llm_client.set_output_dir(output_manager.output_dir)
+    else:
+        llm_client = LLMClient(config_path, output_manager.output_dir)
     return config, llm_client, logger, output_manager
 
 def load(process, config, path = './Data/Output/debug/', *args):
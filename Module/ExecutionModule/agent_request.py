@@ -0,0 +1,58 @@
+import json
+from UtilityFunctions import json_processing
+
+SEGMENT_FORMAT_PART = """CRITICAL: Your response must contain ONLY valid JSON format, nothing else. Do not include any explanations, reasoning, or additional text before or after the JSON. The output format should be in JSON, with each value structured as "question number": answer. Do not place ```json at the beginning or end. If you are asked to reason before/after answering a question, please put your reason and answer to the question in nested keys, like this: "question number": { "reason": "XXX", "answer": "XXX" }. But if you are not asked to give a reason, just put the answer in the value of the question number key and do not give the reason. Start your response directly with { and end with }. No other text is allowed."""
+
+FULL_FORMAT_PART = """
+        CRITICAL: Your response must contain ONLY valid JSON format, nothing else.
+        Do not include any explanations, reasoning, or additional text before or after the JSON.
+        The output format should be in JSON, with each value structured as "question number": answer.
+        Do not place ```json at the beginning or end.
+        If you are asked to reason before/after answering a question, please put your reason and answer to the question in nested keys, like this: "question number": { "reason": "XXX", "answer": "XXX" }.
+        But if you are not asked to give a reason, just put the answer in the value of the question number key and do not give the reason, like "question number": "XXX".
+        You should follow the order of questions strictly in to express question number keys, like "1" is the number of the first question.
+        Start your response directly with { and end with }. No other text is allowed."""
+
+def profile_prompt(sample_profile):
+    return f"You act as a survey participant with the following profile: {sample_profile}\n"
+
+def get_prompt_layout(config):
+    """Prompt layout from user_preference.execution.prompt_layout: "cache" or the "default" profile-first layout."""
+    return "cache" if json_processing.get_json_nested_value(config, "user_preference.execution.prompt_layout") == "cache" else "default"
+
+def build_agent_request(execution_order, questions, sample_profile, format_part, prompt_layout="default"):
+    """
+    Keyword arguments for LLMClient.generate/agenerate.
+    The default layout puts the agent profile in the system prompt. The cache layout keeps the static
+    instructions and questionnaire first, passed as cache_prefix, and the agent profile last, so every
+    request for the same questions shares one cacheable prefix.
+    """
+    if prompt_layout == "cache":
+        return {
+            "prompt": profile_prompt(sample_profile),
+            "system_prompt": format_part,
+            "cache_prefix": f"""{execution_order}\n{questions}"""
+        }
+    return {
+        "prompt": f"""{execution_order}\n{questions}""",
+        "system_prompt": profile_prompt(sample_profile) + format_part
+    }
+
+def parse_agent_answer(answer_text, logger, label, sample_profile):
+    """Parse an LLM answer into a dict. Returns (answer_dict, error) where error is None on success."""
+    try:
+        answer_dict = json.loads(answer_text)
+        logger.info(f"{label}: Successfully parsed JSON with {len(answer_dict)} answers")
+        return answer_dict, None
+    except json.JSONDecodeError as e:
+        logger.error(f"{label}: Invalid JSON format: {e}")
+        logger.error(f"{label}: Raw response: {answer_text}")
+        logger.error(f"{label}: Sample profile: {sample_profile}")
+        return {}, e
+
+def answer_sort_key(key):
+    """Numeric ordering for agent and question ids: "2" before "10", "3-2" before "3-10". Other keys sort last, as text."""
+    try:
+        return (0, tuple(int(part) for part in str(key).split("-")), "")
+    except ValueError:
+        return (1, (), str(key))
@@ -0,0 +1,152 @@
+import re
+from UtilityFunctions import json_processing
+from Module.ExecutionModule.agent_request import SEGMENT_FORMAT_PART, build_agent_request, parse_agent_answer, answer_sort_key
+
+DEFAULT_REPAIR_ATTEMPTS = 2
+
+REPAIR_NOTE = "Some of your previous answers were missing or invalid. Answer only the following questions, using the exact options or scale given."
+
+def get_repair_attempts(config):
+    """
+    Follow-up requests allowed per agent request for missing or invalid answers, from user_preference.execution.repair
+    (enable, max_attempts). Returns 0 when repair is disabled.
+    """
+    settings = json_processing.get_json_nested_value(config, "user_preference.execution.repair")
+    if not isinstance(settings, dict):
+        settings = {}
+    if settings.get("enable", True) is not True:
+        return 0
+    return max(0, int(settings.get("max_attempts", DEFAULT_REPAIR_ATTEMPTS)))
+
+def normalize_option(value):
+    return str(value).strip().casefold()
+
+def option_matches(value, options):
+    """Whether value is one of the options as a whole, ignoring case and surrounding whitespace."""
+    value = normalize_option(value)
+    return bool(value) and value in {normalize_option(option) for option in options}
+
+def answer_candidates(value):
+    """
+    Readings of an answer to validate: the value as given and, for a value given with a reason
+    ({"reason", "answer"} or a [reason, answer] list, for any question type), its answer part.
+    A list is kept as given too, since multiple choice answers are lists of options.
+    """
+    if isinstance(value, dict) and "answer" in value:
+        return [value["answer"]]
+    if isinstance(value, list) and value:
+        return [value, value[-1]]
+    return [value]
+
+def is_valid_answer(question_data, value):
+    """Check one answer against the question's options or scale. Types without either only need a non-empty answer."""
+    return any(is_valid_value(question_data, candidate) for candidate in answer_candidates(value))
+
+def is_valid_value(question_data, value):
+    question_type = question_data.get("type")
+    if value is None or value == "" or value == [] or value == {}:
+        return False
+
+    if question_type == "single_choice" and question_data.get("options"):
+        return option_matches(value, question_data["options"])
+
+    if question_type == "multiple_choice" and question_data.get("options") and "table_structure" not in question_data:
+        values = value if isinstance(value, list) else [part for part in re.split(r"[,;|]", str(value)) if part.strip()]
+        return bool(values) and all(option_matches(part, question_data["options"]) for part in values)
+
+    if question_type == "rating" and question_data.get("scale"):
+        number = re.search(r"-?\d+(?:\.\d+)?", str(value))
+        if number is None:
+            return False
+        try:
+            low, high = sorted(float(bound) for bound in question_data["scale"][:2])
+        except (TypeError, ValueError):
+            # Labelled scales ("Strongly disagree", ...) cannot be checked numerically
+            return True
+        return low <= float(number.group()) <= high
+
+    return True
+
+def find_repair_targets(processed_data, expected_ids, answer_dict):
+    """Expected question ids that are missing from answer_dict or whose answer fails validation."""
+    # Table questions may be answered per dimension ("3-1", "3-2"), which counts as answering question 3
+    answered_prefixes = {str(key).split("-")[0] for key in answer_dict}
+    targets = []
+    for question_id in expected_ids:
+        question_id = str(question_id)
+        if question_id in answer_dict:
+            if not is_valid_answer(processed_data.get(question_id, {}), answer_dict[question_id]):
+                targets.append(question_id)
+        elif question_id not in answered_prefixes:
+            targets.append(question_id)
+    return targets
+
+def accept_if_valid(llm_client, request, processed_data, expected_ids, answer_dict, parse_error):
+    """Let the response cache keep the response to request only if it parsed into valid answers to every expected question."""
+    if parse_error is None and isinstance(answer_dict, dict) and not find_repair_targets(processed_data, expected_ids, answer_dict):
+        llm_client.accept_response(**request)
+
+def build_repair_request(compiled_survey, execution_order, sample_profile, targets, prompt_layout):
+    questions = f"{REPAIR_NOTE}\n{compiled_survey.segment_text(targets)}"
+    return build_agent_request(execution_order, questions, sample_profile, SEGMENT_FORMAT_PART, prompt_layout)
+
+def merge_repair(answer_dict, repair_dict, targets):
+    for question_id in targets:
+        if question_id in repair_dict:
+            answer_dict[question_id] = repair_dict[question_id]
+        else:
+            answer_dict.update({key: value for key, value in repair_dict.items() if str(key).split("-")[0] == question_id})
+
+def record_repair_outcome(processed_data, expected_ids, answer_dict, agent_errors, asked, label, logger):
+    if not asked:
+        return
+    remaining = find_repair_targets(processed_data, expected_ids, answer_dict)
+    agent_errors.append(f"Re-asked missing or invalid answers for questions {sorted(asked, key=answer_sort_key)}")
+    if remaining:
+        agent_errors.append(f"Missing or invalid answers after re-asking: questions {remaining}")
+        logger.warning(f"{label}: Answers still missing or invalid after re-asking: {remaining}")
+
+def repair_answer(llm_client, logger, processed_data, compiled_survey, execution_order, sample_profile, expected_ids, answer_dict, agent_errors, label, attempts, prompt_layout="default"):
+    """
+    Re-ask only the expected questions that are missing or invalid in answer_dict, up to `attempts` follow-up requests.
+    answer_dict is updated in place and returned.
+    """
+    if not isinstance(answer_dict, dict):
+        answer_dict = {}
+    asked = set()
+    for _ in range(attempts):
+        targets = find_repair_targets(processed_data, expected_ids, answer_dict)
+        if not targets:
+            break
+        logger.info(f"{label}: Re-asking questions {targets}")
+        asked.update(targets)
+        repair_request = build_repair_request(compiled_survey, execution_order, sample_profile, targets, prompt_layout)
+        repair_text = llm_client.generate(**repair_request)
+        repair_dict, parse_error = parse_agent_answer(repair_text, logger, f"{label} repair", sample_profile)
+        accept_if_valid(llm_client, repair_request, processed_data, targets, repair_dict, parse_error)
+        if parse_error is None and isinstance(repair_dict, dict):
+            merge_repair(answer_dict, repair_dict, targets)
+
+    record_repair_outcome(processed_data, expected_ids, answer_dict, agent_errors, asked, label, logger)
+    return answer_dict
+
+async def arepair_answer(llm_client, logger, processed_data, compiled_survey, execution_order, sample_profile, expected_ids, answer_dict, agent_errors, label, attempts, prompt_layout="default"):
+    """Asynchronous version of repair_answer."""
+    if not isinstance(answer_dict, dict):
+        answer_dict = {}
+    asked = set()
+    for _ in range(attempts):
+        targets = find_repair_targets(processed_data, expected_ids, answer_dict)
+        if not targets:
+            break
+        logger.info(f"{label}: Re-asking questions {targets}")
+        asked.update(targets)
+        repair_request = build_repair_request(compiled_survey, execution_order, sample_profile, targets, prompt_layout)
+        repair_text = await llm_client.agenerate(**repair_request)
+        repair_dict, parse_error = parse_agent_answer(repair_text, logger, f"{label} repair", sample_profile)
+        accept_if_valid(llm_client, repair_request, processed_data, targets, repair_dict, parse_error)
+        if parse_error is None and isinstance(repair_dict, dict):
+            merge_repair(answer_dict, repair_dict, targets)
+
+    record_repair_outcome(processed_data, expected_ids, answer_dict, agent_errors, asked, label, logger)
+    return answer_dict
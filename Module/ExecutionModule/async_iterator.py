@@ -0,0 +1,290 @@
+import asyncio
+from UtilityFunctions import json_processing
+from Module.ExecutionModule.compiled_survey import get_compiled_survey
+from Module.ExecutionModule.iterator import (
+    ExecutionState,
+    FULL_FORMAT_PART,
+    SEGMENT_FORMAT_PART,
+    select_segment,
+    is_last_segment,
+    finalize_answers,
+    format_agent_profile,
+    profile_prompt,
+    get_prompt_layout,
+    build_agent_request,
+    parse_agent_answer,
+    mark_stopped
+)
+from Module.ExecutionModule.segment_scheduler import SegmentDAG
+from Module.ExecutionModule.progress import answer_publisher, report_agents, report_segment, finish_progress
+from Module.ExecutionModule.answer_repair import get_repair_attempts, arepair_answer, accept_if_valid
+
+DEFAULT_CONCURRENCY = 1
+DEFAULT_SEGMENT_FANOUT = 2
+
+def get_parallel_segments(config):
+    """Whether segments that do not depend on a branch answer are dispatched together (user_preference.execution.parallel_segments)."""
+    return json_processing.get_json_nested_value(config, "user_preference.execution.parallel_segments") is True
+
+def get_segment_fanout(config):
+    """
+    Segment requests one agent keeps in flight with parallel_segments (user_preference.execution.segment_fanout),
+    so at most concurrency * segment_fanout requests are in flight in total.
+    """
+    fanout = json_processing.get_json_nested_value(config, "user_preference.execution.segment_fanout")
+    if fanout == "not found" or not fanout:
+        return DEFAULT_SEGMENT_FANOUT
+    return max(1, int(fanout))
+
+def get_concurrency(config):
+    """Number of agents kept in flight at once, read from user_preference.execution.concurrency."""
+    concurrency = json_processing.get_json_nested_value(config, "user_preference.execution.concurrency")
+    if concurrency == "not found" or not concurrency:
+        return DEFAULT_CONCURRENCY
+    return max(1, int(concurrency))
+
+def get_streaming(config):
+    """Whether agent requests are streamed and cut off once all their questions are answered (user_preference.execution.streaming)."""
+    return json_processing.get_json_nested_value(config, "user_preference.execution.streaming") is True
+
+async def request_answer(config, llm_client, request, expected_keys, progress_file, agent_id):
+    """Send one agent request; when streaming, each answer is published as it arrives and the stream ends early."""
+    if get_streaming(config):
+        return await llm_client.astream_generate(**request, expected_keys=expected_keys, on_answer=answer_publisher(progress_file, agent_id + 1))
+    return await llm_client.agenerate(**request)
+
+async def gather_agents(coroutines):
+    """Run agent coroutines together; if one fails, cancel the others before re-raising."""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def questionnaire_iterator_async(config_set, processed_data, execution_order, sample_space, sample_space_size, sample_dimensions, upload = False, progress_file=None, multi_modal=False, concurrency=DEFAULT_CONCURRENCY, journal=None, semaphore=None, execution_dir=None):
+    config, llm_client, logger, output_manager = config_set
+    output_dir = config_set[3].output_dir
+    # Agents already recorded in the journal (resumed execution) are kept and skipped
+    answers, errors = journal.load() if journal else ({}, {})
+    completed = len(answers)
+    report_agents(progress_file, completed)
+    prompt_layout = get_prompt_layout(config)
+
+    compiled_survey = get_compiled_survey(processed_data, json_processing.get_json_nested_value(config, "llm_settings.max_tokens"))
+    questions = compiled_survey.full_text
+    repair_attempts = 0 if multi_modal else get_repair_attempts(config)
+    # Concurrent executions pass one shared semaphore so that `concurrency` bounds all of them together
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+
+    async def run_agent(agent_id):
+        nonlocal completed
+
+        async with semaphore:
+            if ExecutionState.get_drain() or agent_id + 1 in answers:
+                return
+
+            sample_profile = format_agent_profile(sample_space, agent_id, sample_dimensions, upload)
+            errors[agent_id + 1] = []
+
+            with llm_client.call_context(agent_id=agent_id + 1):
+                profile_part = profile_prompt(sample_profile)
+                if multi_modal:
+                    answer_text = await asyncio.to_thread(
+                        llm_client.generate_multimodal,
+                        json_processing.get_json_nested_value(config, "user_preference.survey_path"),
+                        prompt=profile_part + FULL_FORMAT_PART,
+                    )
+                else:
+                    request = build_agent_request(execution_order, questions, sample_profile, FULL_FORMAT_PART, prompt_layout)
+                    answer_text = await request_answer(config, llm_client, request, compiled_survey.expected_ids, progress_file, agent_id)
+
+                answer_dict, parse_error = parse_agent_answer(answer_text, logger, f"Agent {agent_id + 1}", sample_profile)
+                if parse_error is not None:
+                    errors[agent_id + 1].append(f"JSON parsing error: {str(parse_error)}")
+                if not multi_modal:
+                    accept_if_valid(llm_client, request, processed_data, compiled_survey.expected_ids, answer_dict, parse_error)
+                if repair_attempts:
+                    answer_dict = await arepair_answer(
+                        llm_client, logger, processed_data, compiled_survey, execution_order, sample_profile,
+                        compiled_survey.expected_ids, answer_dict, errors[agent_id + 1], f"Agent {agent_id + 1}", repair_attempts, prompt_layout
+                    )
+
+            answers[agent_id + 1] = answer_dict
+            if journal: journal.append(agent_id + 1, answer_dict, errors[agent_id + 1])
+
+        completed += 1
+        report_agents(progress_file, completed, agent_id + 1, errors[agent_id + 1])
+
+    await gather_agents(run_agent(agent_id) for agent_id in range(sample_space_size))
+
+    answers = finalize_answers(answers)
+    errors = dict(sorted(errors.items()))
+
+    if ExecutionState.get_stop():
+        mark_stopped(output_dir)
+        finish_progress(progress_file, stopped=True)
+        return answers, errors
+
+    finish_progress(progress_file)
+
+    output_manager.save_json(answers, 'answers.json', execution_dir)
+    output_manager.save_json(errors, 'execution_errors.json', execution_dir)
+
+    return answers, errors
+
+async def ask_segment(config_set, processed_data, segment, execution_order, sample_profile, agent_id, agent_errors, multi_modal=False, progress_file=None):
+    """Send one segment of questions for one agent and return the parsed answers."""
+    config, llm_client, logger, output_manager = config_set
+    compiled_survey = get_compiled_survey(processed_data, json_processing.get_json_nested_value(config, "llm_settings.max_tokens"))
+    questions, _, expected_keys = compiled_survey.segment(segment[2])
+
+    with llm_client.call_context(agent_id=agent_id + 1, segment=segment[0]):
+        profile_part = profile_prompt(sample_profile)
+        if multi_modal:
+            answer_text = await asyncio.to_thread(
+                llm_client.generate_multimodal,
+                json_processing.get_json_nested_value(config, "user_preference.survey_path"),
+                prompt=profile_part + SEGMENT_FORMAT_PART,
+            )
+        else:
+            request = build_agent_request(execution_order, questions, sample_profile, SEGMENT_FORMAT_PART, get_prompt_layout(config))
+            answer_text = await request_answer(config, llm_client, request, expected_keys, progress_file, agent_id)
+
+        answer_dict, parse_error = parse_agent_answer(answer_text, logger, f"Agent {agent_id + 1} segment {segment[0]}", sample_profile)
+        if parse_error is not None:
+            agent_errors.append(f"JSON parsing error at segment starting with question {segment[0]}: {str(parse_error)}")
+        if not multi_modal:
+            accept_if_valid(llm_client, request, processed_data, expected_keys, answer_dict, parse_error)
+
+        repair_attempts = 0 if multi_modal else get_repair_attempts(config)
+        if repair_attempts:
+            answer_dict = await arepair_answer(
+                llm_client, logger, processed_data, compiled_survey, execution_order, sample_profile, expected_keys,
+                answer_dict, agent_errors, f"Agent {agent_id + 1} segment {segment[0]}", repair_attempts, get_prompt_layout(config)
+            )
+
+    report_segment(progress_file, agent_id + 1, segment[0])
+    return answer_dict
+
+async def run_segment_chain(config_set, processed_data, question_segments, execution_order, sample_profile, agent_id, agent_errors, multi_modal=False, progress_file=None):
+    """
+    Walk one agent through its segment chain. Segments stay sequential because jump logic depends on earlier answers.
+    Returns the agent's answers, or None if the execution was stopped midway.
+    """
+    config, llm_client, logger, output_manager = config_set
+    survey_size = len(processed_data)
+    answer = {}
+    current_question = 1
+
+    while current_question <= survey_size:
+        # repeat the stop-check for every segment, not just every agent
+        if ExecutionState.get_stop():
+            return None
+
+        segment = select_segment(question_segments, current_question, answer, agent_errors, logger)
+        if segment is None: break
+
+        answer_dict = await ask_segment(config_set, processed_data, segment, execution_order, sample_profile, agent_id, agent_errors, multi_modal, progress_file)
+        answer.update(answer_dict)
+
+        if is_last_segment(segment, current_question): break
+        current_question = segment[2][-1]
+
+    return answer
+
+async def run_segment_dag(config_set, processed_data, segment_dag, execution_order, sample_profile, agent_id, agent_errors, multi_modal=False, progress_file=None):
+    """
+    Dependency-aware version of run_segment_chain: every segment up to the next branch point is requested at once,
+    and only the segment chosen at a branch point waits for the answer it depends on. At most segment_fanout of
+    these requests are in flight at once.
+    Returns the agent's answers, or None if the execution was stopped midway.
+    """
+    config, llm_client, logger, output_manager = config_set
+    answer = {}
+    segment = segment_dag.select(1, answer, agent_errors, logger)
+    fanout = asyncio.Semaphore(get_segment_fanout(config))
+
+    async def ask_limited(run_segment):
+        async with fanout:
+            return await ask_segment(config_set, processed_data, run_segment, execution_order, sample_profile, agent_id, agent_errors, multi_modal, progress_file)
+
+    while segment is not None:
+        if ExecutionState.get_stop():
+            return None
+
+        run, branch_question = segment_dag.run_from(segment)
+        answer_dicts = await asyncio.gather(*(ask_limited(run_segment) for run_segment in run))
+        for answer_dict in answer_dicts:
+            answer.update(answer_dict)
+
+        if branch_question is None: break
+        segment = segment_dag.select(branch_question, answer, agent_errors, logger)
+
+    return answer
+
+async def questionnaire_iterator_segment_async(config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, upload = False, progress_file=None, multi_modal=False, concurrency=DEFAULT_CONCURRENCY, journal=None, semaphore=None, execution_dir=None):
+    """
+    Worker-pool version of questionnaire_iterator_segment: up to `concurrency` agents are in flight,
+    and the worker slot holding an agent runs that agent's whole segment chain before taking the next one.
+    With parallel_segments enabled, segments within an agent's chain that do not follow a branch point are
+    requested concurrently as well, up to segment_fanout per agent. semaphore and execution_dir are set when several executions share the loop.
+    """
+    config, llm_client, logger, output_manager = config_set
+    output_dir = config_set[3].output_dir
+    # Agents already recorded in the journal (resumed execution) are kept and skipped
+    answers, errors = journal.load() if journal else ({}, {})
+    completed = len(answers)
+    report_agents(progress_file, completed)
+
+    # Concurrent executions pass one shared semaphore so that `concurrency` bounds all of them together
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+    segment_dag = SegmentDAG(question_segments, len(processed_data)) if get_parallel_segments(config) else None
+
+    async def run_agent(agent_id):
+        nonlocal completed
+
+        async with semaphore:
+            if ExecutionState.get_drain() or agent_id + 1 in answers:
+                return
+
+            sample_profile = format_agent_profile(sample_space, agent_id, sample_dimensions, upload)
+            errors[agent_id + 1] = []
+
+            if segment_dag is not None:
+                answer = await run_segment_dag(
+                    config_set, processed_data, segment_dag, execution_order,
+                    sample_profile, agent_id, errors[agent_id + 1], multi_modal, progress_file
+                )
+            else:
+                answer = await run_segment_chain(
+                    config_set, processed_data, question_segments, execution_order,
+                    sample_profile, agent_id, errors[agent_id + 1], multi_modal, progress_file
+                )
+            if answer is None:
+                return
+
+            answers[agent_id + 1] = answer
+            if journal: journal.append(agent_id + 1, answer, errors[agent_id + 1])
+
+        completed += 1
+        report_agents(progress_file, completed, agent_id + 1, errors[agent_id + 1])
+
+    await gather_agents(run_agent(agent_id) for agent_id in range(sample_space_size))
+
+    answers = finalize_answers(answers)
+    errors = dict(sorted(errors.items()))
+
+    if ExecutionState.get_stop():
+        mark_stopped(output_dir)
+        finish_progress(progress_file, stopped=True)
+        return answers, errors
+
+    finish_progress(progress_file)
+
+    output_manager.save_json(answers, 'answers.json', execution_dir)
+    output_manager.save_json(errors, 'execution_errors.json', execution_dir)
+
+    return answers, errors
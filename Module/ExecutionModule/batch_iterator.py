@@ -0,0 +1,271 @@
+import time
+from UtilityFunctions import json_processing
+from UtilityFunctions.batch_client import create_batch_backend, MAX_BATCH_REQUESTS, BATCH_PENDING, BATCH_FAILED
+from Module.ExecutionModule.compiled_survey import get_compiled_survey
+from Module.ExecutionModule.iterator import (
+    ExecutionState,
+    FULL_FORMAT_PART,
+    SEGMENT_FORMAT_PART,
+    finalize_answers,
+    format_agent_profile,
+    get_prompt_layout,
+    build_agent_request,
+    parse_agent_answer,
+    mark_stopped
+)
+from Module.ExecutionModule.segment_scheduler import SegmentDAG
+from Module.ExecutionModule.progress import report_agents, report_segment, finish_progress
+from Module.ExecutionModule.answer_repair import get_repair_attempts, find_repair_targets, build_repair_request, merge_repair, record_repair_outcome
+
+DEFAULT_POLL_INTERVAL = 30
+
+def get_batch_settings(config):
+    """
+    Batch execution settings from user_preference.execution.batch:
+    enable (bool), backend ("provider" or "local") and poll_interval (seconds).
+    """
+    settings = json_processing.get_json_nested_value(config, "user_preference.execution.batch")
+    if not isinstance(settings, dict):
+        settings = {}
+    return {
+        "enable": settings.get("enable", False) is True,
+        "backend": settings.get("backend", "provider"),
+        "poll_interval": settings.get("poll_interval", DEFAULT_POLL_INTERVAL)
+    }
+
+def wait_for_stop_or_timeout(seconds):
+    """Sleep for up to `seconds`, waking early when the execution is stopped."""
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if ExecutionState.get_stop():
+            return True
+        time.sleep(min(1, deadline - time.monotonic()))
+    return ExecutionState.get_stop()
+
+def run_batch_round(backend, requests, poll_interval, logger):
+    """
+    Submit one round of requests (split to respect provider batch limits), poll until every batch ends
+    and return custom_id -> (response_text, error). Returns None if the execution was stopped while waiting.
+    """
+    batch_ids = []
+    for start in range(0, len(requests), MAX_BATCH_REQUESTS):
+        batch_id = backend.submit(requests[start:start + MAX_BATCH_REQUESTS])
+        logger.info(f"Submitted batch {batch_id} with {len(requests[start:start + MAX_BATCH_REQUESTS])} requests")
+        batch_ids.append(batch_id)
+
+    pending = list(batch_ids)
+    failed = set()
+    while True:
+        still_pending = []
+        for batch_id in pending:
+            status = backend.poll(batch_id)
+            if status == BATCH_PENDING:
+                still_pending.append(batch_id)
+            elif status == BATCH_FAILED:
+                logger.error(f"Batch {batch_id} failed")
+                failed.add(batch_id)
+        pending = still_pending
+
+        if not pending:
+            break
+
+        if wait_for_stop_or_timeout(poll_interval):
+            for batch_id in pending:
+                backend.cancel(batch_id)
+            return None
+
+    results = {}
+    for batch_id in batch_ids:
+        if batch_id not in failed:
+            results.update(backend.results(batch_id))
+    return results
+
+def ingest_result(llm_client, logger, results, custom_id, label, sample_profile, agent_errors, error_context):
+    """Turn one batch result into an answer dict, recording request and JSON errors like the synchronous iterators."""
+    response_text, error = results.get(custom_id, (None, "No result returned for request"))
+    if response_text is None:
+        logger.error(f"{label}: Batch request failed: {error}")
+        agent_errors.append(f"Batch request failed{error_context}: {error}")
+        return {}
+
+    answer_dict, parse_error = parse_agent_answer(llm_client._extract_json_from_response(response_text), logger, label, sample_profile)
+    if parse_error is not None:
+        agent_errors.append(f"JSON parsing error{error_context}: {str(parse_error)}")
+    return answer_dict
+
+def repair_batch_answers(backend, poll_interval, llm_client, logger, processed_data, compiled_survey, execution_order, prompt_layout, attempts, items):
+    """
+    Re-ask the missing or invalid answers of a batch round in follow-up batch rounds, up to `attempts` rounds.
+    items maps a request's custom_id to (answer_dict, expected_ids, sample_profile, agent_errors, label);
+    answer dicts are updated in place. Returns False if the execution was stopped while waiting.
+    """
+    asked = {custom_id: set() for custom_id in items}
+    for attempt in range(attempts):
+        requests = []
+        round_targets = {}
+        for custom_id, (answer_dict, expected_ids, sample_profile, agent_errors, label) in items.items():
+            targets = find_repair_targets(processed_data, expected_ids, answer_dict)
+            if not targets:
+                continue
+            logger.info(f"{label}: Re-asking questions {targets}")
+            asked[custom_id].update(targets)
+            round_targets[custom_id] = targets
+            requests.append({
+                "custom_id": f"{custom_id}-repair-{attempt + 1}",
+                **build_repair_request(compiled_survey, execution_order, sample_profile, targets, prompt_layout)
+            })
+        if not requests:
+            break
+
+        logger.info(f"Batch repair round {attempt + 1}: {len(requests)} requests")
+        results = run_batch_round(backend, requests, poll_interval, logger)
+        if results is None:
+            return False
+
+        for custom_id, targets in round_targets.items():
+            answer_dict, expected_ids, sample_profile, agent_errors, label = items[custom_id]
+            response_text, error = results.get(f"{custom_id}-repair-{attempt + 1}", (None, "No result returned for request"))
+            if response_text is None:
+                logger.error(f"{label} repair: Batch request failed: {error}")
+                continue
+            repair_dict, parse_error = parse_agent_answer(llm_client._extract_json_from_response(response_text), logger, f"{label} repair", sample_profile)
+            if parse_error is None and isinstance(repair_dict, dict):
+                merge_repair(answer_dict, repair_dict, targets)
+
+    for custom_id, (answer_dict, expected_ids, sample_profile, agent_errors, label) in items.items():
+        record_repair_outcome(processed_data, expected_ids, answer_dict, agent_errors, asked[custom_id], label, logger)
+    return True
+
+def questionnaire_iterator_batch(config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, upload = False, progress_file=None, segmentation=False, backend=None, journal=None):
+    """
+    Execute every agent through a provider batch endpoint (or the local stand-in) instead of synchronous calls.
+    Without segmentation there is a single round. With segmentation each round covers one segment depth:
+    every agent's segments up to its next branch point, after which jump logic picks the next round's segments.
+    Missing or invalid answers of a round are re-asked in follow-up batch rounds before the round's answers are used.
+    """
+    config, llm_client, logger, output_manager = config_set
+    output_dir = config_set[3].output_dir
+    settings = get_batch_settings(config)
+    max_tokens = json_processing.get_json_nested_value(config, "llm_settings.max_tokens")
+    prompt_layout = get_prompt_layout(config)
+    compiled_survey = get_compiled_survey(processed_data, max_tokens, question_segments if segmentation else None)
+    repair_attempts = get_repair_attempts(config)
+
+    if backend is None:
+        backend = create_batch_backend(llm_client, output_manager.execution_dir / "batch", settings["backend"])
+
+    # Agents already recorded in the journal (resumed execution) are kept and skipped
+    done_answers, done_errors = journal.load() if journal else ({}, {})
+    pending_agents = [agent_id for agent_id in range(sample_space_size) if agent_id + 1 not in done_answers]
+
+    profiles = {agent_id: format_agent_profile(sample_space, agent_id, sample_dimensions, upload) for agent_id in pending_agents}
+    answers = {agent_id + 1: {} for agent_id in pending_agents}
+    errors = {agent_id + 1: [] for agent_id in pending_agents}
+
+    def finish_agent(agent_id):
+        if journal: journal.append(agent_id + 1, answers[agent_id + 1], errors[agent_id + 1])
+        done_answers[agent_id + 1] = answers[agent_id + 1]
+        done_errors[agent_id + 1] = errors[agent_id + 1]
+        report_agents(progress_file, len(done_answers), agent_id + 1, errors[agent_id + 1])
+
+    report_agents(progress_file, len(done_answers))
+
+    if not segmentation:
+        questions = compiled_survey.full_text
+        requests = [{
+            "custom_id": f"agent-{agent_id + 1}",
+            **build_agent_request(execution_order, questions, profiles[agent_id], FULL_FORMAT_PART, prompt_layout)
+        } for agent_id in pending_agents]
+
+        results = run_batch_round(backend, requests, settings["poll_interval"], logger) if requests else {}
+        if results is None:
+            mark_stopped(output_dir)
+            finish_progress(progress_file, stopped=True)
+            return finalize_answers(done_answers), done_errors
+
+        for agent_id in pending_agents:
+            answer_dict = ingest_result(llm_client, logger, results, f"agent-{agent_id + 1}", f"Agent {agent_id + 1}", profiles[agent_id], errors[agent_id + 1], "")
+            answers[agent_id + 1] = answer_dict if isinstance(answer_dict, dict) else {}
+
+        repair_items = {
+            f"agent-{agent_id + 1}": (answers[agent_id + 1], compiled_survey.expected_ids, profiles[agent_id], errors[agent_id + 1], f"Agent {agent_id + 1}")
+            for agent_id in pending_agents
+        }
+        if repair_attempts and not repair_batch_answers(backend, settings["poll_interval"], llm_client, logger, processed_data, compiled_survey, execution_order, prompt_layout, repair_attempts, repair_items):
+            mark_stopped(output_dir)
+            finish_progress(progress_file, stopped=True)
+            return finalize_answers(done_answers), done_errors
+
+        for agent_id in pending_agents:
+            finish_agent(agent_id)
+
+    else:
+        segment_dag = SegmentDAG(question_segments, len(processed_data))
+        next_segment = {agent_id: segment_dag.select(1, {}, errors[agent_id + 1], logger) for agent_id in pending_agents}
+        for agent_id, segment in next_segment.items():
+            if segment is None: finish_agent(agent_id)
+        round_number = 0
+
+        while any(segment is not None for segment in next_segment.values()):
+            round_number += 1
+            round_requests = []
+            round_plan = {}
+
+            for agent_id, segment in next_segment.items():
+                if segment is None:
+                    continue
+                run, branch_question = segment_dag.run_from(segment)
+                round_plan[agent_id] = (run, branch_question)
+                for part, run_segment in enumerate(run):
+                    round_requests.append({
+                        "custom_id": f"agent-{agent_id + 1}-round-{round_number}-part-{part}",
+                        **build_agent_request(
+                            execution_order, compiled_survey.segment_text(run_segment[2]),
+                            profiles[agent_id], SEGMENT_FORMAT_PART, prompt_layout
+                        )
+                    })
+
+            logger.info(f"Batch round {round_number}: {len(round_requests)} requests for {len(round_plan)} agents")
+            results = run_batch_round(backend, round_requests, settings["poll_interval"], logger)
+            if results is None:
+                mark_stopped(output_dir)
+                finish_progress(progress_file, stopped=True)
+                return finalize_answers(done_answers), done_errors
+
+            round_answers = {}
+            for agent_id, (run, branch_question) in round_plan.items():
+                for part, run_segment in enumerate(run):
+                    custom_id = f"agent-{agent_id + 1}-round-{round_number}-part-{part}"
+                    answer_dict = ingest_result(
+                        llm_client, logger, results, custom_id,
+                        f"Agent {agent_id + 1} segment {run_segment[0]}", profiles[agent_id], errors[agent_id + 1],
+                        f" at segment starting with question {run_segment[0]}"
+                    )
+                    round_answers[custom_id] = (
+                        answer_dict if isinstance(answer_dict, dict) else {}, compiled_survey.segment_questions(run_segment[2]),
+                        profiles[agent_id], errors[agent_id + 1], f"Agent {agent_id + 1} segment {run_segment[0]}"
+                    )
+
+            # Branch answers are repaired before they are used to route the next round
+            if repair_attempts and not repair_batch_answers(backend, settings["poll_interval"], llm_client, logger, processed_data, compiled_survey, execution_order, prompt_layout, repair_attempts, round_answers):
+                mark_stopped(output_dir)
+                finish_progress(progress_file, stopped=True)
+                return finalize_answers(done_answers), done_errors
+
+            for agent_id, (run, branch_question) in round_plan.items():
+                for part, run_segment in enumerate(run):
+                    answers[agent_id + 1].update(round_answers[f"agent-{agent_id + 1}-round-{round_number}-part-{part}"][0])
+                    report_segment(progress_file, agent_id + 1, run_segment[0])
+
+                next_segment[agent_id] = None if branch_question is None else segment_dag.select(branch_question, answers[agent_id + 1], errors[agent_id + 1], logger)
+                if next_segment[agent_id] is None: finish_agent(agent_id)
+
+    answers = finalize_answers(done_answers)
+    errors = dict(sorted(done_errors.items()))
+
+    finish_progress(progress_file)
+
+    output_manager.save_json(answers, 'answers.json')
+    output_manager.save_json(errors, 'execution_errors.json')
+
+    return answers, errors
@@ -0,0 +1,149 @@
+import threading
+from contextlib import contextmanager
+
+from UtilityFunctions import json_processing
+from Module.ExecutionModule.iterator import ExecutionState
+from Module.ExecutionModule.progress import progress_bus
+
+SOFT_ACTIONS = ("throttle", "downgrade", "drain")
+DEFAULT_SOFT_THRESHOLD = 0.8
+DEFAULT_THROTTLE_SECONDS = 2.0
+
+OK = "ok"
+SOFT = "soft"
+HARD = "hard"
+
+
+def get_budget_settings(config):
+    """
+    Budget ceiling settings from user_preference.execution.budget:
+    enable (bool), max_usd and max_tokens (0 = no limit of that kind), soft_threshold (fraction of the ceiling),
+    soft_action ("throttle", "downgrade" or "drain"), throttle_seconds and fallback_model (for "downgrade").
+    """
+    settings = json_processing.get_json_nested_value(config, "user_preference.execution.budget")
+    if not isinstance(settings, dict):
+        settings = {}
+    soft_action = settings.get("soft_action", "throttle")
+    return {
+        "enable": settings.get("enable", False) is True,
+        "max_usd": float(settings.get("max_usd") or 0),
+        "max_tokens": int(settings.get("max_tokens") or 0),
+        "soft_threshold": float(settings.get("soft_threshold", DEFAULT_SOFT_THRESHOLD)),
+        "soft_action": soft_action if soft_action in SOFT_ACTIONS else "throttle",
+        "throttle_seconds": float(settings.get("throttle_seconds", DEFAULT_THROTTLE_SECONDS)),
+        "fallback_model": settings.get("fallback_model")
+    }
+
+
+class BudgetGuard:
+    """
+    Enforces a token and/or USD ceiling on a run. It is an LLMClient usage listener, so it is checked on every
+    response at the cost of a few additions under a lock. At soft_threshold of the ceiling the soft action is
+    applied once: throttle (pause before every request), downgrade (switch to fallback_model) or drain (finish
+    the agents in flight, start no new ones and save the answers collected). At the ceiling the execution is stopped through ExecutionState;
+    finished agents are already in the execution journals, so the run can be resumed with a higher budget.
+    Requests in flight when the ceiling is reached still complete, so the final spend can exceed it slightly.
+    """
+
+    def __init__(self, settings, ledger, llm_client, logger):
+        self.settings = settings
+        self.ledger = ledger
+        self.llm_client = llm_client
+        self.logger = logger
+        self.spent_usd = 0.0
+        self.spent_tokens = 0
+        self.state = OK
+        self.original_model = llm_client.model
+        self._lock = threading.Lock()
+
+    def usage_fraction(self):
+        fractions = []
+        if self.settings["max_usd"]:
+            fractions.append(self.spent_usd / self.settings["max_usd"])
+        if self.settings["max_tokens"]:
+            fractions.append(self.spent_tokens / self.settings["max_tokens"])
+        return max(fractions, default=0.0)
+
+    def record(self, model, record, context=None):
+        """LLMClient usage listener."""
+        cost = self.ledger.price(model, record, (context or {}).get("batch", False)) if self.settings["max_usd"] else None
+        with self._lock:
+            self.spent_usd += cost or 0.0
+            self.spent_tokens += record.get("input_tokens", 0) + record.get("output_tokens", 0)
+            fraction = self.usage_fraction()
+            if fraction >= 1 and self.state != HARD:
+                self.state = state = HARD
+            elif fraction >= self.settings["soft_threshold"] and self.state == OK:
+                self.state = state = SOFT
+            else:
+                return
+
+        if state == HARD:
+            self._stop()
+        else:
+            self._soft_action()
+
+    def _soft_action(self):
+        action = self.settings["soft_action"]
+        if action == "downgrade" and self.settings["fallback_model"]:
+            self.llm_client.set_model(self.settings["fallback_model"])
+        elif action == "drain":
+            ExecutionState.set_drain()
+        else:
+            action = "throttle"
+            self.llm_client.request_delay = self.settings["throttle_seconds"]
+        self.logger.warning(f"Budget at {self.usage_fraction():.0%} of its ceiling, applying soft action: {action}")
+        self._publish(action)
+
+    def _stop(self):
+        ExecutionState.set_stop()
+        self.logger.warning(f"Budget ceiling reached (${self.spent_usd:.4f}, {self.spent_tokens} tokens), stopping execution")
+        self._publish("stop")
+
+    def _publish(self, action):
+        progress_bus.publish({"type": "budget", "action": action, **self.snapshot()})
+
+    def restore(self):
+        """Undo soft actions on the shared client once the run is over."""
+        if self.llm_client.model != self.original_model:
+            self.llm_client.set_model(self.original_model)
+        self.llm_client.request_delay = 0.0
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "spent_usd": self.spent_usd,
+            "spent_tokens": self.spent_tokens,
+            "max_usd": self.settings["max_usd"],
+            "max_tokens": self.settings["max_tokens"],
+            "usage_fraction": self.usage_fraction()
+        }
+
+
+_current_guard = None
+
+def current_budget_guard():
+    """Budget guard of the run in progress in this process, or None."""
+    return _current_guard
+
+@contextmanager
+def guard_budget(config_set, ledger):
+    """Enforce the configured budget on every request made by the run's client while the context is open."""
+    global _current_guard
+    config, llm_client, logger, output_manager = config_set
+    settings = get_budget_settings(config)
+    _current_guard = None
+    if not settings["enable"] or not (settings["max_usd"] or settings["max_tokens"]):
+        yield None
+        return
+
+    guard = BudgetGuard(settings, ledger, llm_client, logger)
+    llm_client.add_usage_listener(guard.record)
+    _current_guard = guard
+    try:
+        yield guard
+    finally:
+        llm_client.remove_usage_listener(guard.record)
+        if _current_guard is guard:
+            _current_guard = None
+        guard.restore()
@@ -0,0 +1,60 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+
+class ExecutionJournal:
+    """
+    Append-only JSONL journal of finished agents for one execution directory.
+    Every agent is written (and fsynced) as soon as it completes, so a crash, provider outage or stop
+    keeps all finished agents, and a resumed execution can skip them.
+    """
+
+    FILE_NAME = "answers_journal.jsonl"
+
+    def __init__(self, execution_dir):
+        self.path = Path(execution_dir) / self.FILE_NAME
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Start a fresh journal, discarding agents recorded by a previous run of this execution."""
+        with self._lock:
+            self.path.unlink(missing_ok=True)
+
+    def append(self, agent_id, answer, agent_errors):
+        line = json.dumps({"agent_id": agent_id, "answer": answer, "errors": agent_errors}, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def load(self):
+        """Return (answers, errors) keyed by agent id for every agent in the journal."""
+        answers = {}
+        errors = {}
+        if not self.path.exists():
+            return answers, errors
+
+        valid_lines = []
+        truncated = False
+        with self._lock:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash while appending can leave the last line truncated; that agent simply runs again
+                        truncated = True
+                        continue
+                    valid_lines.append(line if line.endswith("\n") else line + "\n")
+                    answers[entry["agent_id"]] = entry["answer"]
+                    errors[entry["agent_id"]] = entry["errors"]
+
+            if truncated:
+                # Drop the broken line so that new entries are not appended onto it
+                with open(self.path, 'w', encoding='utf-8') as f:
+                    f.writelines(valid_lines)
+
+        return answers, errors
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+from Module.ExecutionModule.format_questionnaire import format_single_question
+
+
+class CompiledSurvey:
+    """
+    Questionnaire rendered once per processed_data: the text and expected output length of every question,
+    the full questionnaire, and every segment from split_question_segments. Segments that were not compiled
+    up front are rendered on first use and kept, so each question list is only rendered once.
+    """
+
+    def __init__(self, processed_data, output_max_token=256, question_segments=None):
+        self.output_max_token = output_max_token
+        self.question_ids = [str(question_id) for question_id in range(1, len(processed_data) + 1)]
+        # Ids an agent is expected to answer, as keyed in processed_data (which need not be contiguous)
+        self.expected_ids = [str(question_id) for question_id in processed_data]
+        self._processed_data = processed_data
+        self._questions = {}
+        self._segments = {}
+        self._lock = threading.Lock()
+
+        for question_id in self.question_ids:
+            self._question(question_id)
+        self.full_text = "".join(self._questions[question_id][0] + "\n" for question_id in self.question_ids)
+        self.full_output_length = sum(self._questions[question_id][1] for question_id in self.question_ids)
+
+        self.segment_count = 1
+        if question_segments:
+            self.add_segments(question_segments)
+
+    def add_segments(self, question_segments):
+        self.segment_count = len(question_segments)
+        for segment in question_segments:
+            self.segment(segment[2])
+
+    def _question(self, question_id):
+        question_id = str(question_id)
+        if question_id not in self._questions:
+            self._questions[question_id] = format_single_question(self._processed_data, question_id, self.output_max_token)
+        return self._questions[question_id]
+
+    def segment(self, question_ids):
+        """(text, output_length, answerable question ids) for a segment's question list, as format_range_question renders it."""
+        key = tuple(str(question_id) for question_id in question_ids)
+        compiled = self._segments.get(key)
+        if compiled is None:
+            with self._lock:
+                parts = [self._question(question_id) for question_id in key]
+                compiled = (
+                    "".join(text + "\n" for text, _ in parts),
+                    sum(length for _, length in parts),
+                    [question_id for question_id in key if question_id in self._processed_data]
+                )
+                self._segments[key] = compiled
+        return compiled
+
+    def segment_text(self, question_ids):
+        return self.segment(question_ids)[0]
+
+    def segment_questions(self, question_ids):
+        return self.segment(question_ids)[2]
+
+
+MAX_COMPILED_SURVEYS = 4
+
+_compiled_surveys = OrderedDict()
+_compiled_surveys_lock = threading.Lock()
+
+def get_compiled_survey(processed_data, output_max_token=256, question_segments=None):
+    """
+    CompiledSurvey for this processed_data object, built on first use and shared afterwards.
+    Lookups are by object identity, so callers that rebuild processed_data get a fresh compilation.
+    The most recently used MAX_COMPILED_SURVEYS compilations are kept, so callers with different
+    output_max_token values do not evict each other.
+    """
+    if output_max_token == "not found" or not output_max_token:
+        output_max_token = 256
+    key = (id(processed_data), output_max_token)
+    with _compiled_surveys_lock:
+        entry = _compiled_surveys.get(key)
+        if entry is None or entry[0] is not processed_data:
+            # Keeping processed_data in the entry stops its id from being reused while the entry is cached
+            entry = (processed_data, CompiledSurvey(processed_data, output_max_token, question_segments))
+            _compiled_surveys[key] = entry
+            while len(_compiled_surveys) > MAX_COMPILED_SURVEYS:
+                _compiled_surveys.popitem(last=False)
+        elif question_segments:
+            entry[1].add_segments(question_segments)
+        _compiled_surveys.move_to_end(key)
+        return entry[1]
@@ -1,7 +1,7 @@
 import json
 import difflib
 import re
-from Module.ExecutionModule.format_questionnaire import format_full_question
+from Module.ExecutionModule.compiled_survey import get_compiled_survey
 from Module.ExecutionModule.smart_model_matcher import (
     get_claude_api_model_name,
     get_openai_encoding_for_model,
@@ -195,7 +195,8 @@ def token_consumption_estimation(processed_data, question_segments, sample_space
     Returns:
         tuple: (input_token_estimation, output_token_estimation)
     """
-    full_question_list, full_output_length = format_full_question(processed_data, output_max_token)
+    compiled_survey = get_compiled_survey(processed_data, output_max_token)
+    full_question_list, full_output_length = compiled_survey.full_text, compiled_survey.full_output_length
 
     # Estimate system prompts based on typical survey system prompts
     system_prompt = f"""You are an AI assistant helping with survey responses. You will receive a survey questionnaire and a respondent profile. Please answer each question based on the profile characteristics provided.
@@ -285,6 +286,59 @@ Please format your responses as JSON with question IDs as keys."""
     return input_token_estimation, output_token_estimation
 
 
+PRICING_FILE = './Config/api_cost_1000.json'
+COST_ESTIMATE_FILE = 'cost_estimate.json'
+
+
+def load_pricing(logger=None) -> Optional[Dict[str, Dict[str, float]]]:
+    """
+    Load the per-1k-token prices from Config/api_cost_1000.json.
+
+    Returns:
+        dict: Prices keyed by model name, or None if the file is missing or invalid
+    """
+    try:
+        with open(PRICING_FILE, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        if logger: logger.error(f"Pricing configuration file not found: {PRICING_FILE}")
+    except json.JSONDecodeError:
+        if logger: logger.error("Invalid JSON in pricing configuration file")
+    return None
+
+
+def match_pricing_model(model_name: str, pricing: Dict[str, Dict[str, float]]) -> Optional[str]:
+    """
+    Find the pricing entry for a model name: exact (case-insensitive) match first, then the closest fuzzy match.
+
+    Returns:
+        str: The matching key of pricing, or None if no entry is close enough
+    """
+    # Normalize model name for better matching
+    normalized_model_name = model_name.lower().strip()
+
+    # Try exact match first
+    for price_model in pricing.keys():
+        if normalized_model_name == price_model.lower():
+            return price_model
+
+    # If no exact match, try fuzzy matching
+    closest_matches = difflib.get_close_matches(
+        normalized_model_name,
+        [k.lower() for k in pricing.keys()],
+        n=1,
+        cutoff=0.6  # Increased cutoff for better accuracy
+    )
+
+    if closest_matches:
+        # Find the original key that matches the lowercase version
+        for price_model in pricing.keys():
+            if price_model.lower() == closest_matches[0]:
+                return price_model
+
+    return None
+
+
 def cost_estimation(config_set, processed_data, question_segments, sample_space_size, sample_profile_0, output_max_token = 256):
     """
     Calculate the estimated cost for LLM API calls.
@@ -312,43 +366,11 @@ def cost_estimation(config_set, processed_data, question_segments, sample_space_
         processed_data, question_segments, sample_space_size, sample_profile_0, output_max_token, model_name, llm_client
     )
 
-    # Load pricing data from JSON
-    try:
-        with open('./Config/api_cost_1000.json', 'r') as file:
-            pricing = json.load(file)
-    except FileNotFoundError:
-        logger.error("Pricing configuration file not found: ./Config/api_cost_1000.json")
-        return -1
-    except json.JSONDecodeError:
-        logger.error("Invalid JSON in pricing configuration file")
+    pricing = load_pricing(logger)
+    if pricing is None:
         return -1
 
-    # Normalize model name for better matching
-    normalized_model_name = model_name.lower().strip()
-
-    # Try exact match first
-    matched_model = None
-    for price_model in pricing.keys():
-        if normalized_model_name == price_model.lower():
-            matched_model = price_model
-            break
-
-    # If no exact match, try fuzzy matching
-    if not matched_model:
-        closest_matches = difflib.get_close_matches(
-            normalized_model_name,
-            [k.lower() for k in pricing.keys()],
-            n=1,
-            cutoff=0.6  # Increased cutoff for better accuracy
-        )
-
-        if closest_matches:
-            # Find the original key that matches the lowercase version
-            for price_model in pricing.keys():
-                if price_model.lower() == closest_matches[0]:
-                    matched_model = price_model
-                    break
-
+    matched_model = match_pricing_model(model_name, pricing)
     if not matched_model:
         logger.error(f"Model pricing not found for '{model_name}'. Available models: {list(pricing.keys())}")
         return -1
@@ -375,6 +397,18 @@ def cost_estimation(config_set, processed_data, question_segments, sample_space_
             f"  - Total cost for {sample_space_size} agents: ${total_cost:.6f}"
         )
 
+        # Kept with the run so the cost ledger can report estimate versus actual per model
+        output_manager.save_json({
+            "model": model_name,
+            "matched_model": matched_model,
+            "agents": sample_space_size,
+            "input_tokens": input_token_estimation,
+            "output_tokens": output_token_estimation,
+            "input_cost": input_cost,
+            "output_cost": output_cost,
+            "total_cost": total_cost
+        }, COST_ESTIMATE_FILE, output_manager.output_dir)
+
         return total_cost
 
     except (TypeError, ValueError) as e:
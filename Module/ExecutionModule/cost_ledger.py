@@ -0,0 +1,168 @@
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from Module.ExecutionModule.cost_estimation import load_pricing, match_pricing_model, COST_ESTIMATE_FILE
+
+COST_LEDGER_FILE = "cost_ledger.json"
+
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cached_tokens", "cache_write_tokens")
+
+# Cache prices of pricing entries without "cached_input" / "cache_write", as multiples of the input price, by model family:
+# Anthropic cache reads cost 0.1x and 5-minute cache writes 1.25x; OpenAI cached input costs at most 0.5x and has no write charge
+CACHE_PRICE_FACTORS = {"claude": (0.1, 1.25)}
+DEFAULT_CACHE_PRICE_FACTORS = (0.5, 1.0)
+
+# Both providers bill batch requests at half the price; a pricing entry may override the factor with "batch_price_factor"
+DEFAULT_BATCH_PRICE_FACTOR = 0.5
+
+
+def empty_entry():
+    return {"requests": 0, **{field: 0 for field in TOKEN_FIELDS}, "cost": 0.0, "unpriced_requests": 0}
+
+def relative_error(actual, estimated):
+    return (actual - estimated) / estimated if estimated else None
+
+
+class CostLedger:
+    """
+    Actual spend of one run, accumulated from the usage of every response and priced with Config/api_cost_1000.json.
+    Input tokens are split into uncached, cached and cache-write tokens, priced with the entry's "cached_input" and
+    "cache_write" keys or, for entries without them, the provider's usual multiples of the input price.
+    Requests made through a batch endpoint (call context batch=True) are charged at the batch price.
+    With the cost_estimate.json written by cost_estimation, the ledger reports estimate versus actual per model.
+    """
+
+    def __init__(self, pricing=None, estimate=None):
+        self.pricing = pricing or {}
+        self.estimate = estimate
+        self.started_at = datetime.now().isoformat()
+        self.total = empty_entry()
+        self.models = {}
+        self.executions = {}
+        self.agents = {}
+        self._prices = {}
+        self._lock = threading.Lock()
+
+    def prices(self, model):
+        """Price entry of a model (matched like cost_estimation does), or None if the model is not in the pricing file."""
+        if model not in self._prices:
+            matched_model = match_pricing_model(model, self.pricing) if model else None
+            prices = self.pricing[matched_model] if matched_model else None
+            if prices is not None and "input" in prices:
+                cached_factor, write_factor = CACHE_PRICE_FACTORS.get(matched_model.split("-")[0], DEFAULT_CACHE_PRICE_FACTORS)
+                prices = {"cached_input": prices["input"] * cached_factor, "cache_write": prices["input"] * write_factor, **prices}
+            self._prices[model] = prices
+        return self._prices[model]
+
+    def price(self, model, record, batch=False):
+        prices = self.prices(model)
+        if prices is None or "input" not in prices:
+            return None
+        factor = prices.get("batch_price_factor", DEFAULT_BATCH_PRICE_FACTOR) if batch else 1
+        cached = record.get("cached_tokens", 0)
+        cache_write = record.get("cache_write_tokens", 0)
+        uncached = record.get("input_tokens", 0) - cached - cache_write
+        return factor * (
+            uncached * prices["input"]
+            + cached * prices["cached_input"]
+            + cache_write * prices["cache_write"]
+            + record.get("output_tokens", 0) * prices.get("output", 0)
+        ) / 1000
+
+    def record(self, model, record, context=None):
+        """LLMClient usage listener: add the usage of one response, attributed to its model and execution."""
+        context = context or {}
+        cost = self.price(model, record, context.get("batch", False))
+        execution = context.get("execution") or "unassigned"
+        with self._lock:
+            for entry in (self.total, self.models.setdefault(model, empty_entry()), self.executions.setdefault(execution, empty_entry())):
+                entry["requests"] += 1
+                for field in TOKEN_FIELDS:
+                    entry[field] += record.get(field, 0)
+                if cost is None:
+                    entry["unpriced_requests"] += 1
+                else:
+                    entry["cost"] += cost
+
+    def set_agents(self, execution, agents):
+        """Agents answered by an execution; the estimate is scaled to the agents actually run."""
+        with self._lock:
+            self.agents[execution] = agents
+
+    def reconciliation(self):
+        """Estimate versus actual tokens and cost for the model the estimate was made for, scaled to the agents run."""
+        if not self.estimate or not self.estimate.get("agents"):
+            return {}
+        agents = sum(self.agents.values())
+        if not agents:
+            return {}
+        scale = agents / self.estimate["agents"]
+
+        reconciliation = {}
+        for model, actual in self.models.items():
+            if model != self.estimate.get("model") and match_pricing_model(model, self.pricing) != self.estimate.get("matched_model"):
+                continue
+            estimated = {
+                "input_tokens": self.estimate["input_tokens"] * scale,
+                "output_tokens": self.estimate["output_tokens"] * scale,
+                "cost": self.estimate["total_cost"] * scale
+            }
+            reconciliation[model] = {
+                "agents": agents,
+                **{f"estimated_{key}": value for key, value in estimated.items()},
+                **{f"actual_{key}": actual[key] for key in estimated},
+                **{f"{key}_error": relative_error(actual[key], value) for key, value in estimated.items()}
+            }
+        return reconciliation
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "total": dict(self.total),
+                "models": {model: dict(entry) for model, entry in self.models.items()},
+                "executions": {execution: dict(entry) for execution, entry in self.executions.items()},
+                "agents": dict(self.agents),
+                "estimate": self.estimate,
+                "reconciliation": self.reconciliation()
+            }
+
+
+_current_ledger = None
+
+def current_cost_ledger():
+    """Ledger of the run in progress in this process, or None."""
+    return _current_ledger
+
+def load_cost_estimate(output_dir):
+    try:
+        with open(output_dir / COST_ESTIMATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+@contextmanager
+def track_cost(config_set):
+    """Record the actual cost of every request made by the run's client while the context is open, then write cost_ledger.json."""
+    global _current_ledger
+    config, llm_client, logger, output_manager = config_set
+    ledger = CostLedger(load_pricing(logger), load_cost_estimate(output_manager.output_dir))
+    llm_client.add_usage_listener(ledger.record)
+    _current_ledger = ledger
+    try:
+        yield ledger
+    finally:
+        llm_client.remove_usage_listener(ledger.record)
+        snapshot = ledger.snapshot()
+        try:
+            output_manager.save_json(snapshot, COST_LEDGER_FILE, output_manager.output_dir)
+        finally:
+            # Once the run ends its cost is served from cost_ledger.json, which is per run directory
+            if _current_ledger is ledger:
+                _current_ledger = None
+        logger.info(f"Actual cost: ${snapshot['total']['cost']:.6f} over {snapshot['total']['requests']} requests")
+        for model, entry in snapshot["reconciliation"].items():
+            if entry["cost_error"] is not None:
+                logger.info(f"Cost estimate error for {model}: {entry['cost_error']:+.1%}")
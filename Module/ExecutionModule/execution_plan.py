@@ -0,0 +1,38 @@
+from UtilityFunctions import json_processing
+
+
+def get_deduplication_settings(config):
+    """
+    Deduplicated execution settings from user_preference.execution:
+    deduplicate (bool) and samples_per_profile, the k used for min(count, k) when sampling is enabled.
+    """
+    deduplicate = json_processing.get_json_nested_value(config, "user_preference.execution.deduplicate") is True
+    samples_per_profile = json_processing.get_json_nested_value(config, "user_preference.execution.samples_per_profile")
+    if samples_per_profile == "not found" or not samples_per_profile:
+        samples_per_profile = 1
+
+    temperature = json_processing.get_json_nested_value(config, "llm_settings.temperature")
+    sampling = temperature != "not found" and bool(temperature) and float(temperature) > 0
+
+    return deduplicate, int(samples_per_profile), sampling
+
+
+def build_execution_plan(sample_space, samples_per_profile=1, sampling=False):
+    """
+    Expand the deduplicated sample space ([profile_id, values, count] entries) into the agents that are actually run.
+    Each distinct profile runs once, or min(count, samples_per_profile) times when sampling is enabled,
+    and every run carries weight count / runs so the weights of a profile still add up to its count.
+    Returns (agents, weights) where agents keep the [profile_id, values, weight] shape and weights is keyed by agent id.
+    """
+    agents = []
+    weights = {}
+
+    for profile_id, values, count in sample_space:
+        count = int(count)
+        runs = min(count, samples_per_profile) if sampling else 1
+        runs = max(runs, 1)
+        for _ in range(runs):
+            agents.append([profile_id, values, count / runs])
+            weights[len(agents)] = count / runs
+
+    return agents, weights
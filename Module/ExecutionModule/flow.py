@@ -1,10 +1,120 @@
+import asyncio
 import json
 
-from Module.ExecutionModule.iterator import questionnaire_iterator_segment, questionnaire_iterator
+from Module.ExecutionModule.iterator import ExecutionState, questionnaire_iterator_segment, questionnaire_iterator
+from Module.ExecutionModule.async_iterator import questionnaire_iterator_async, questionnaire_iterator_segment_async, get_concurrency
+from Module.ExecutionModule.packed_iterator import questionnaire_iterator_packed, get_pack_size
+from Module.ExecutionModule.batch_iterator import questionnaire_iterator_batch, get_batch_settings
+from Module.ExecutionModule.checkpoint import ExecutionJournal
+from Module.ExecutionModule.execution_plan import get_deduplication_settings, build_execution_plan
+from Module.ExecutionModule.progress import start_progress, reset_progress
+from Module.ExecutionModule.cost_ledger import track_cost
+from Module.ExecutionModule.budget_guard import guard_budget
+from UtilityFunctions.llm_client import close_async_clients
 
 
-def questionnaire_execute_iterator(config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, segmentation=True, upload=False, multi_modal=False):
+def usage_report(usage):
+    """Per-execution token usage with prompt cache misses and the hit rate."""
+    usage = dict(usage)
+    usage["cache_miss_tokens"] = usage["input_tokens"] - usage["cached_tokens"]
+    usage["cache_hit_rate"] = usage["cached_tokens"] / usage["input_tokens"] if usage["input_tokens"] else 0
+    return usage
+
+def prepare_execution(output_manager, execution_num, weights, resume):
+    """
+    Create execution_N with its weights and journal. Returns (execution_dir, progress_file, journal).
+    Progress is published in memory while the execution runs; progress.json is only written when it ends.
+    """
+    execution_dir = output_manager.output_dir / f"execution_{execution_num}"
+    execution_dir.mkdir(exist_ok=True)
+
+    execution_progress_file = execution_dir / "progress.json"
+    execution_progress_file.unlink(missing_ok=True)
+
+    if weights is not None:
+        output_manager.save_json(weights, 'weights.json', execution_dir)
+    else:
+        (execution_dir / 'weights.json').unlink(missing_ok=True)
+
+    journal = ExecutionJournal(execution_dir)
+    if not resume:
+        journal.reset()
+
+    return execution_dir, execution_progress_file, journal
+
+def finish_execution(config_set, execution_num, execution_dir, usage):
+    usage = usage_report(usage)
+    config_set[3].save_json(usage, 'usage.json', execution_dir)
+    config_set[2].info(
+        f"Execution {execution_num} prompt cache: {usage['cached_tokens']} hit / {usage['cache_miss_tokens']} miss input tokens"
+    )
+
+async def run_executions_async(config_set, executions, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, segmentation, upload, multi_modal, concurrency, pack_size=1):
+    """
+    Run independent executions (replicates) together in one event loop. All of them draw agents from one
+    semaphore of size `concurrency`, and requests go through the client's shared rate limiter.
+    With pack_size > 1 (non-segmented surveys) each slot answers a pack of agents in one request.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_execution(execution_num, execution_dir, execution_progress_file, journal):
+        with config_set[1].track_usage() as usage, config_set[1].call_context(execution=execution_dir.name):
+            start_progress(execution_progress_file, sample_space_size, usage)
+            if segmentation:
+                answers, errors = await questionnaire_iterator_segment_async(
+                    config_set, processed_data, question_segments, execution_order,
+                    sample_space, sample_space_size, sample_dimensions, upload,
+                    execution_progress_file, multi_modal, concurrency, journal, semaphore, execution_dir
+                )
+            elif pack_size > 1:
+                answers, errors = await questionnaire_iterator_packed(
+                    config_set, processed_data, execution_order,
+                    sample_space, sample_space_size, sample_dimensions, upload,
+                    execution_progress_file, pack_size, concurrency, journal, semaphore, execution_dir
+                )
+            else:
+                answers, errors = await questionnaire_iterator_async(
+                    config_set, processed_data, execution_order,
+                    sample_space, sample_space_size, sample_dimensions, upload,
+                    execution_progress_file, multi_modal, concurrency, journal, semaphore, execution_dir
+                )
+        finish_execution(config_set, execution_num, execution_dir, usage)
+        return answers, errors
+
+    try:
+        return await asyncio.gather(*(run_execution(*execution) for execution in executions))
+    finally:
+        # The pooled async clients are bound to this loop, which asyncio.run closes on return
+        await close_async_clients()
+
+def questionnaire_execute_iterator(config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, segmentation=True, upload=False, multi_modal=False, resume=False):
+    """
+    Run every execution listed in sample_settings.json. Finished agents are journaled per execution;
+    with resume=True agents already in an execution's journal are not run again.
+    In concurrent mode the executions run together over a shared worker pool, otherwise one after another.
+    The actual cost of the run is tracked live and written to cost_ledger.json when it ends or stops,
+    and the configured budget ceiling (if any) is enforced on every request.
+    """
+    with track_cost(config_set) as ledger, guard_budget(config_set, ledger):
+        return run_executions(
+            config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size,
+            sample_dimensions, segmentation, upload, multi_modal, resume, ledger
+        )
+
+def run_executions(config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, segmentation=True, upload=False, multi_modal=False, resume=False, ledger=None):
     output_dir = config_set[3].output_dir
+    concurrency = get_concurrency(config_set[0])
+    # Batch endpoints take text requests only, so multimodal surveys always run synchronously
+    use_batch = get_batch_settings(config_set[0])["enable"] and not multi_modal
+    # Packing applies to whole-questionnaire text requests only
+    pack_size = get_pack_size(config_set[0]) if not (segmentation or multi_modal or use_batch) else 1
+
+    # Deduplicated mode runs each distinct profile once (or min(count, k) times when sampling) and weights it by its count
+    deduplicate, samples_per_profile, sampling = get_deduplication_settings(config_set[0])
+    weights = None
+    if deduplicate:
+        sample_space, weights = build_execution_plan(sample_space[:sample_space_size], samples_per_profile, sampling)
+        sample_space_size = len(sample_space)
 
     # Read number of executions from sample_settings.json
     try:
@@ -16,32 +126,52 @@ def questionnaire_execute_iterator(config_set, processed_data, question_segments
 
     all_answers = {}
     all_errors = {}
+    reset_progress()
+
+    if (concurrency > 1 or pack_size > 1) and not use_batch:
+        executions = [(execution_num, *prepare_execution(config_set[3], execution_num, weights, resume)) for execution_num in range(1, num_executions + 1)]
+        results = asyncio.run(run_executions_async(
+            config_set, executions, processed_data, question_segments, execution_order,
+            sample_space, sample_space_size, sample_dimensions, segmentation, upload, multi_modal, concurrency, pack_size
+        ))
+        for execution_num, (answers, errors) in zip(range(1, num_executions + 1), results):
+            if ledger: ledger.set_agents(f"execution_{execution_num}", len(answers))
+            all_answers[execution_num] = answers
+            all_errors[execution_num] = errors
+        return all_answers, all_errors
 
     for execution_num in range(1, num_executions + 1):
-        # Create execution-specific directory
-        execution_dir = output_dir / f"execution_{execution_num}"
-        execution_dir.mkdir(exist_ok=True)
+        # A drained run (budget soft limit) keeps the executions it finished and starts no new ones
+        if ExecutionState.get_drain():
+            config_set[2].warning(f"Execution drained, executions {execution_num} to {num_executions} were not started")
+            break
+        execution_dir, execution_progress_file, journal = prepare_execution(config_set[3], execution_num, weights, resume)
 
         # Update output manager's directory for this execution
         config_set[3].set_execution_dir(execution_dir)
 
-        # Create execution-specific progress file
-        execution_progress_file = execution_dir / "progress.json"
-        with open(execution_progress_file, 'w') as f:
-           json.dump({'progress': 0}, f)
-
-        if segmentation:
-            answers, errors = questionnaire_iterator_segment(
-                config_set, processed_data, question_segments, execution_order,
-                sample_space, sample_space_size, sample_dimensions, upload,
-                execution_progress_file, multi_modal
-            )
-        else:
-            answers, errors = questionnaire_iterator(
-                config_set, processed_data, execution_order,
-                sample_space, sample_space_size, sample_dimensions, upload,
-                execution_progress_file, multi_modal
-            )
+        with config_set[1].track_usage() as usage, config_set[1].call_context(execution=execution_dir.name):
+            start_progress(execution_progress_file, sample_space_size, usage)
+            if use_batch:
+                answers, errors = questionnaire_iterator_batch(
+                    config_set, processed_data, question_segments, execution_order,
+                    sample_space, sample_space_size, sample_dimensions, upload,
+                    execution_progress_file, segmentation, journal=journal
+                )
+            elif segmentation:
+                answers, errors = questionnaire_iterator_segment(
+                    config_set, processed_data, question_segments, execution_order,
+                    sample_space, sample_space_size, sample_dimensions, upload,
+                    execution_progress_file, multi_modal, journal
+                )
+            else:
+                answers, errors = questionnaire_iterator(
+                    config_set, processed_data, execution_order,
+                    sample_space, sample_space_size, sample_dimensions, upload,
+                    execution_progress_file, multi_modal, journal
+                )
+        finish_execution(config_set, execution_num, execution_dir, usage)
+        if ledger: ledger.set_agents(execution_dir.name, len(answers))
 
         all_answers[execution_num] = answers
         all_errors[execution_num] = errors
@@ -87,21 +87,11 @@ def format_single_question(processed_data, question_id, output_max_token = 256):
     return formatted_question, formatted_output_length
 
 def format_full_question(processed_data, output_max_token = 256):
-    full_question_list = ""
-    full_output_length = 0
+    formatted_questions = [format_single_question(processed_data, question_id, output_max_token) for question_id in range(1, len(processed_data) + 1)]
+    full_question_list = "".join(formatted_question + '\n' for formatted_question, _ in formatted_questions)
+    full_output_length = sum(formatted_output_length for _, formatted_output_length in formatted_questions)
 
-    for question_id in range(1, len(processed_data) + 1):
-        formatted_question, formatted_output_length = format_single_question(processed_data, question_id, output_max_token)
-        full_question_list += formatted_question + '\n'
-        full_output_length += formatted_output_length
-    
     return full_question_list, full_output_length
 
 def format_range_question(processed_data, question_ids, output_max_token = 256):
-    full_question_list = ""
-
-    for question_id in question_ids:
-        formatted_question = format_single_question(processed_data, question_id, output_max_token)[0]
-        full_question_list += formatted_question + '\n'
-    
-    return full_question_list
+    return "".join(format_single_question(processed_data, question_id, output_max_token)[0] + '\n' for question_id in question_ids)
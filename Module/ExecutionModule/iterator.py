@@ -1,225 +1,239 @@
 import json
 from UtilityFunctions import json_processing
-from Module.ExecutionModule.format_questionnaire import format_range_question, format_full_question
+from Module.ExecutionModule.compiled_survey import get_compiled_survey
+from Module.ExecutionModule.segment_router import get_segment_router
+from Module.ExecutionModule.agent_request import (
+    SEGMENT_FORMAT_PART,
+    FULL_FORMAT_PART,
+    profile_prompt,
+    get_prompt_layout,
+    build_agent_request,
+    parse_agent_answer,
+    answer_sort_key
+)
+from Module.ExecutionModule.answer_repair import get_repair_attempts, repair_answer, accept_if_valid
+from Module.ExecutionModule.progress import report_agents, report_segment, finish_progress
 import Module.SampleGenerationModule.flow
 
 class ExecutionState:
     stop = False
+    # Draining lets agents already in flight finish but starts no new ones (budget guard soft stop)
+    drain = False
     @classmethod
     def reset(cls):
         cls.stop = False
+        cls.drain = False
 
     @classmethod
     def set_stop(cls):
         cls.stop = True
 
+    @classmethod
+    def set_drain(cls):
+        cls.drain = True
+
     @classmethod
     def get_stop(cls):
+        """Whether the execution was stopped: agents in flight are abandoned and answers.json is not written."""
         return cls.stop
 
-def find_all_by_first_element(nested_list, target):
-    matches = []
-    for sublist in nested_list:
-        if sublist[0] == target:
-            matches.append(sublist)
-    return matches
-
-def fuzzy_match(condition_list, answer):
-    if answer == None: return None, 2
-
-    processed_conditions = [cond[1].strip().lower() for cond in condition_list]
-    processed_answer = answer.strip().lower()
-
-    if processed_answer in processed_conditions:
-        matched_index = processed_conditions.index(processed_answer)
-        return condition_list[matched_index], 0
-
-    for cond in processed_conditions:
-        if processed_answer in cond or cond in processed_answer:
-            matched_index = processed_conditions.index(cond)
-            return condition_list[matched_index], 1
-
-    return None, 2
-
-def merge_dicts_in_lexicographical_order(dict1, dict2):
-    merged_dict = {**dict1, **dict2}
-    sorted_dict = dict(sorted(merged_dict.items()))
-    return sorted_dict
-
-def questionnaire_iterator_segment(config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, upload = False, progress_file=None, multi_modal=False):
+    @classmethod
+    def get_drain(cls):
+        """Whether no new agent may start (stopped or draining). A drained execution still saves the answers it has."""
+        return cls.stop or cls.drain
+
+def format_agent_profile(sample_space, agent_id, sample_dimensions, upload = False):
+    if not upload:
+        return Module.SampleGenerationModule.flow.format_single_profile(sample_space[agent_id], sample_dimensions)
+
+    # For upload mode, sample_space[agent_id] is [id, profile_string, count]
+    # We need the profile_string part (index 1)
+    if isinstance(sample_space[agent_id], list) and len(sample_space[agent_id]) > 1:
+        return str(sample_space[agent_id][1])
+    return str(sample_space[agent_id])
+
+def mark_stopped(output_dir):
+    with open(output_dir / "stop.json", 'w') as f:
+        json.dump({'stopped': True}, f)
+
+def select_segment(question_segments, current_question, answer, agent_errors, logger):
+    """
+    Pick the segment that starts at current_question, using the routing index built once per segment list.
+    Returns None when no segment starts at current_question, i.e. the agent reached the end of the survey.
+    """
+    return get_segment_router(question_segments).select(current_question, answer, agent_errors, logger)
+
+def is_last_segment(segment, current_question):
+    return segment[2][-1] != 1 and segment[2][-1] == current_question
+
+def finalize_answers(answers):
+    """
+    Order accumulated answers once, when they are written: agents by id and each agent's questions numerically.
+    While running, answers are only added to plain dicts (dict.update / assignment), never copied or re-sorted.
+    """
+    return {
+        agent_id: dict(sorted(answer.items(), key=lambda item: answer_sort_key(item[0]))) if isinstance(answer, dict) else answer
+        for agent_id, answer in sorted(answers.items(), key=lambda item: answer_sort_key(item[0]))
+    }
+
+def answer_agent_segments(config_set, processed_data, compiled_survey, question_segments, execution_order, sample_profile, agent_id, agent_errors, multi_modal=False, prompt_layout="default", repair_attempts=0, progress_file=None):
+    """
+    Walk one agent (agent_id is 0-based) through the survey segment by segment, following the branch answers.
+    Returns the agent's answers, or None if the execution was stopped before the agent finished.
+    """
     config, llm_client, logger, output_manager = config_set
-    output_dir = config_set[3].output_dir
     survey_size = len(processed_data)
-    answers = {}
-    errors = {}
-
-    for agent_id in range(sample_space_size):
-        # Update progress
-        if progress_file:
-            progress = agent_id  * 100 / sample_space_size
-            with open(progress_file, 'w') as f:
-                json.dump({'progress': progress}, f)
+    answer = {}
+    current_question = 1
 
+    while current_question <= survey_size:
+        # repeat the stop-check for every segment, not just every agent
         if ExecutionState.get_stop():
-            with open(output_dir / "stop.json", 'w') as f:
-                json.dump({'stopped': True}, f)
-                return answers, errors
+            return None
 
+        segment = select_segment(question_segments, current_question, answer, agent_errors, logger)
+        if segment is None: break
 
-        if not upload:
-            sample_profile = Module.SampleGenerationModule.flow.format_single_profile(sample_space[agent_id], sample_dimensions)
-        else:
-            # For upload mode, sample_space[agent_id] is [id, profile_string, count]
-            # We need the profile_string part (index 1)
-            if isinstance(sample_space[agent_id], list) and len(sample_space[agent_id]) > 1:
-                sample_profile = str(sample_space[agent_id][1])
-            else:
-                sample_profile = str(sample_space[agent_id])
-
-        answer = {}
-        current_question = 1
-        errors[agent_id + 1] = []
+        questions = compiled_survey.segment_text(segment[2])
 
-        while current_question <= survey_size:
-            # repeat the stop-check for every segment, not just every agent
-            if ExecutionState.get_stop():
-                with open(output_dir / "stop.json", 'w') as f:
-                    json.dump({'stopped': True}, f)
-                    return answers, errors
+        with llm_client.call_context(agent_id=agent_id + 1, segment=current_question):
+            profile_part = profile_prompt(sample_profile)
+            if multi_modal:
+                answer_text = llm_client.generate_multimodal(
+                    json_processing.get_json_nested_value(config, "user_preference.survey_path"),
+                    prompt=profile_part + SEGMENT_FORMAT_PART,
+                )
+            else:
+                request = build_agent_request(execution_order, questions, sample_profile, SEGMENT_FORMAT_PART, prompt_layout)
+                answer_text = llm_client.generate(**request)
+
+            answer_dict, parse_error = parse_agent_answer(answer_text, logger, f"Agent {agent_id + 1} segment {current_question}", sample_profile)
+            if parse_error is not None:
+                agent_errors.append(f"JSON parsing error at segment starting with question {current_question}: {str(parse_error)}")
+            if not multi_modal:
+                accept_if_valid(llm_client, request, processed_data, compiled_survey.segment_questions(segment[2]), answer_dict, parse_error)
+            if repair_attempts:
+                answer_dict = repair_answer(
+                    llm_client, logger, processed_data, compiled_survey, execution_order, sample_profile,
+                    compiled_survey.segment_questions(segment[2]), answer_dict, agent_errors,
+                    f"Agent {agent_id + 1} segment {current_question}", repair_attempts, prompt_layout
+                )
 
-            question_segment = find_all_by_first_element(question_segments, current_question)
+            answer.update(answer_dict)
+            report_segment(progress_file, agent_id + 1, current_question)
 
-            if len(question_segment) == 1:
-                segment = question_segment[0]
-                questions = format_range_question(processed_data, segment[2], json_processing.get_json_nested_value(config, "llm_settings.max_tokens"))
+        if is_last_segment(segment, current_question): break
+        current_question = segment[2][-1]
 
-            elif len(question_segment) > 1:
-                segment, match_status = fuzzy_match(question_segment, answer.get(str(current_question)))
+    return answer
 
-                if match_status == 1:
-                    errors[agent_id + 1].append(f"Jump condition imperfect match at question {str(current_question)}")
-                elif match_status == 2:
-                    errors[agent_id + 1].append(f"Jump condition not match at question {str(current_question)}")
-                    logger.error(f"Jump condition not match.")
-                    segment = question_segment[0]
+def answer_agent(config_set, processed_data, compiled_survey, execution_order, sample_profile, agent_id, agent_errors, multi_modal=False, prompt_layout="default", repair_attempts=0):
+    """Ask one agent (agent_id is 0-based) the whole questionnaire in one request and return its answers."""
+    config, llm_client, logger, output_manager = config_set
 
-                questions = format_range_question(processed_data, segment[2], json_processing.get_json_nested_value(config, "llm_settings.max_tokens"))
+    with llm_client.call_context(agent_id=agent_id + 1):
+        profile_part = profile_prompt(sample_profile)
+        if multi_modal:
+            answer_text = llm_client.generate_multimodal(
+                json_processing.get_json_nested_value(config, "user_preference.survey_path"),
+                prompt=profile_part + FULL_FORMAT_PART,
+            )
+        else:
+            request = build_agent_request(execution_order, compiled_survey.full_text, sample_profile, FULL_FORMAT_PART, prompt_layout)
+            answer_text = llm_client.generate(**request)
+
+        answer_dict, parse_error = parse_agent_answer(answer_text, logger, f"Agent {agent_id + 1}", sample_profile)
+        if parse_error is not None:
+            agent_errors.append(f"JSON parsing error: {str(parse_error)}")
+        if not multi_modal:
+            accept_if_valid(llm_client, request, processed_data, compiled_survey.expected_ids, answer_dict, parse_error)
+        if repair_attempts:
+            answer_dict = repair_answer(
+                llm_client, logger, processed_data, compiled_survey, execution_order, sample_profile,
+                compiled_survey.expected_ids, answer_dict, agent_errors, f"Agent {agent_id + 1}", repair_attempts, prompt_layout
+            )
+    return answer_dict
 
-            elif len(question_segment) == 0:
-                logger.error(f"Question not found.")
+def questionnaire_iterator_segment(config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, upload = False, progress_file=None, multi_modal=False, journal=None):
+    config, llm_client, logger, output_manager = config_set
+    output_dir = config_set[3].output_dir
+    prompt_layout = get_prompt_layout(config)
+    compiled_survey = get_compiled_survey(processed_data, json_processing.get_json_nested_value(config, "llm_settings.max_tokens"), question_segments)
+    # Missing or invalid answers are re-asked with text follow-ups, which multimodal surveys cannot use
+    repair_attempts = 0 if multi_modal else get_repair_attempts(config)
+    # Agents already recorded in the journal (resumed execution) are kept and skipped
+    answers, errors = journal.load() if journal else ({}, {})
 
-            profile_part = f"You act as a survey participant with the following profile: {sample_profile}\n"
-            format_part = """CRITICAL: Your response must contain ONLY valid JSON format, nothing else. Do not include any explanations, reasoning, or additional text before or after the JSON. The output format should be in JSON, with each value structured as "question number": answer. Do not place ```json at the beginning or end. If you are asked to reason before/after answering a question, please put your reason and answer to the question in nested keys, like this: "question number": { "reason": "XXX", "answer": "XXX" }. But if you are not asked to give a reason, just put the answer in the value of the question number key and do not give the reason. Start your response directly with { and end with }. No other text is allowed."""
-            if multi_modal:
-                answer_text = llm_client.generate_multimodal(
-                    json_processing.get_json_nested_value(config, "user_preference.survey_path"),
-                    prompt=profile_part + format_part,
-                )
-            else:
-                answer_text = llm_client.generate(
-                    prompt=f"""{execution_order}\n{questions}""",
-                    system_prompt=profile_part + format_part
-                )
+    report_agents(progress_file, len(answers))
 
+    for agent_id in range(sample_space_size):
+        if ExecutionState.get_stop():
+            mark_stopped(output_dir)
+            finish_progress(progress_file, stopped=True)
+            return finalize_answers(answers), errors
+        if ExecutionState.get_drain(): break
 
-            try:
-                answer_dict = json.loads(answer_text)
-                logger.info(f"Agent {agent_id + 1} segment {current_question}: Successfully parsed JSON with {len(answer_dict)} answers")
-            except json.JSONDecodeError as e:
-                logger.error(f"Agent {agent_id + 1} segment {current_question}: Invalid JSON format: {e}")
-                logger.error(f"Agent {agent_id + 1} segment {current_question}: Raw response: {answer_text}")
-                logger.error(f"Agent {agent_id + 1} segment {current_question}: Sample profile: {sample_profile}")
-                errors[agent_id + 1].append(f"JSON parsing error at segment starting with question {current_question}: {str(e)}")
-                answer_dict = {}
+        if agent_id + 1 in answers: continue
 
-            answer = merge_dicts_in_lexicographical_order(answer, answer_dict)
+        sample_profile = format_agent_profile(sample_space, agent_id, sample_dimensions, upload)
+        errors[agent_id + 1] = []
 
-            if segment[2][-1] != 1 and segment[2][-1] == current_question: break
-            current_question = segment[2][-1]
+        answer = answer_agent_segments(
+            config_set, processed_data, compiled_survey, question_segments, execution_order, sample_profile,
+            agent_id, errors[agent_id + 1], multi_modal, prompt_layout, repair_attempts, progress_file
+        )
+        if answer is None:
+            mark_stopped(output_dir)
+            finish_progress(progress_file, stopped=True)
+            return finalize_answers(answers), errors
 
-        answers = merge_dicts_in_lexicographical_order(answers, {agent_id + 1: answer})
+        answers[agent_id + 1] = answer
+        if journal: journal.append(agent_id + 1, answer, errors[agent_id + 1])
+        report_agents(progress_file, len(answers), agent_id + 1, errors[agent_id + 1])
 
-    # Set final progress to 100%
-    if progress_file:
-        with open(progress_file, 'w') as f:
-            json.dump({'progress': 100}, f)
+    finish_progress(progress_file)
 
+    answers = finalize_answers(answers)
     output_manager.save_json(answers, 'answers.json')
     output_manager.save_json(errors, 'execution_errors.json')
 
     return answers, errors
 
-def questionnaire_iterator(config_set, processed_data, execution_order, sample_space, sample_space_size, sample_dimensions, upload = False, progress_file=None, multi_modal=False):
+def questionnaire_iterator(config_set, processed_data, execution_order, sample_space, sample_space_size, sample_dimensions, upload = False, progress_file=None, multi_modal=False, journal=None):
     config, llm_client, logger, output_manager = config_set
     output_dir = config_set[3].output_dir
-    answers = {}
-    errors = {}
+    prompt_layout = get_prompt_layout(config)
+    compiled_survey = get_compiled_survey(processed_data, json_processing.get_json_nested_value(config, "llm_settings.max_tokens"))
+    repair_attempts = 0 if multi_modal else get_repair_attempts(config)
+    # Agents already recorded in the journal (resumed execution) are kept and skipped
+    answers, errors = journal.load() if journal else ({}, {})
 
-    for agent_id in range(sample_space_size):
-        # Update progress
-        if progress_file:
-            progress = agent_id  * 100 / sample_space_size
-            with open(progress_file, 'w') as f:
-                json.dump({'progress': progress}, f)
+    report_agents(progress_file, len(answers))
 
+    for agent_id in range(sample_space_size):
         if ExecutionState.get_stop():
-            with open(output_dir / "stop.json", 'w') as f:
-                json.dump({'stopped': True}, f)
-                return answers, errors
+            mark_stopped(output_dir)
+            finish_progress(progress_file, stopped=True)
+            return finalize_answers(answers), errors
+        if ExecutionState.get_drain(): break
 
+        if agent_id + 1 in answers: continue
 
-        if not upload:
-            sample_profile = Module.SampleGenerationModule.flow.format_single_profile(sample_space[agent_id], sample_dimensions)
-        else:
-            # For upload mode, sample_space[agent_id] is [id, profile_string, count]
-            # We need the profile_string part (index 1)
-            if isinstance(sample_space[agent_id], list) and len(sample_space[agent_id]) > 1:
-                sample_profile = str(sample_space[agent_id][1])
-            else:
-                sample_profile = str(sample_space[agent_id])
-
+        sample_profile = format_agent_profile(sample_space, agent_id, sample_dimensions, upload)
         errors[agent_id + 1] = []
 
-        questions = format_full_question(processed_data, json_processing.get_json_nested_value(config, "llm_settings.max_tokens"))[0]
-
-        profile_part = f"You act as a survey participant with the following profile: {sample_profile}\n"
-        format_part = """
-        CRITICAL: Your response must contain ONLY valid JSON format, nothing else.
-        Do not include any explanations, reasoning, or additional text before or after the JSON.
-        The output format should be in JSON, with each value structured as "question number": answer.
-        Do not place ```json at the beginning or end.
-        If you are asked to reason before/after answering a question, please put your reason and answer to the question in nested keys, like this: "question number": { "reason": "XXX", "answer": "XXX" }.
-        But if you are not asked to give a reason, just put the answer in the value of the question number key and do not give the reason, like "question number": "XXX".
-        You should follow the order of questions strictly in to express question number keys, like "1" is the number of the first question.
-        Start your response directly with { and end with }. No other text is allowed."""
-        if multi_modal:
-            answer_text = llm_client.generate_multimodal(
-                json_processing.get_json_nested_value(config, "user_preference.survey_path"),
-                prompt=profile_part + format_part,
-            )
-        else:
-            answer_text = llm_client.generate(
-                prompt=f"""{execution_order}\n{questions}""",
-                system_prompt=profile_part + format_part
-            )
-
-        try:
-            answer_dict = json.loads(answer_text)
-            logger.info(f"Agent {agent_id + 1}: Successfully parsed JSON with {len(answer_dict)} answers")
-        except json.JSONDecodeError as e:
-            logger.error(f"Agent {agent_id + 1}: Invalid JSON format: {e}")
-            logger.error(f"Agent {agent_id + 1}: Raw response: {answer_text}")
-            logger.error(f"Agent {agent_id + 1}: Sample profile: {sample_profile}")
-            errors[agent_id + 1].append(f"JSON parsing error: {str(e)}")
-            answer_dict = {}
+        answer_dict = answer_agent(
+            config_set, processed_data, compiled_survey, execution_order, sample_profile,
+            agent_id, errors[agent_id + 1], multi_modal, prompt_layout, repair_attempts
+        )
 
-        answers = merge_dicts_in_lexicographical_order(answers, {agent_id + 1: answer_dict})
+        answers[agent_id + 1] = answer_dict
+        if journal: journal.append(agent_id + 1, answer_dict, errors[agent_id + 1])
+        report_agents(progress_file, len(answers), agent_id + 1, errors[agent_id + 1])
 
-    # Set final progress to 100%
-    if progress_file:
-        with open(progress_file, 'w') as f:
-            json.dump({'progress': 100}, f)
+    finish_progress(progress_file)
 
+    answers = finalize_answers(answers)
     output_manager.save_json(answers, 'answers.json')
     output_manager.save_json(errors, 'execution_errors.json')
 
@@ -0,0 +1,130 @@
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from Module.ExecutionModule.iterator import ExecutionState
+from Module.ExecutionModule.progress import progress_bus
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+STOPPED = "stopped"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class ExecutionJob:
+    def __init__(self, description=None):
+        self.job_id = uuid.uuid4().hex
+        self.description = description
+        self.status = QUEUED
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.future = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "description": self.description,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error
+        }
+
+
+class ExecutionJobRunner:
+    """
+    Runs questionnaire executions in a background thread pool so HTTP requests return at once with a job id.
+    Executions share ExecutionState and the output directory, so only one job may be queued or running at a time.
+    Cancelling a running job uses the same cooperative stop as the stop button; the job then ends as "stopped".
+    """
+
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="execution-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def active_job(self):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status in ACTIVE_STATUSES:
+                    return job
+        return None
+
+    def submit(self, function, description=None, prepare=None):
+        """
+        Queue function() as a new job and return it, or None if another job is still active.
+        The function's return value becomes the job result. The check, the reset of the shared ExecutionState
+        and prepare() (e.g. clearing the run's stop file) happen under one lock, so two concurrent submits cannot
+        both start and a rejected submit cannot un-stop the job that is running.
+        """
+        with self._lock:
+            if any(job.status in ACTIVE_STATUSES for job in self._jobs.values()):
+                return None
+            ExecutionState.reset()
+            if prepare is not None:
+                prepare()
+            job = ExecutionJob(description)
+            self._jobs[job.job_id] = job
+            job.future = self._executor.submit(self._run, job, function)
+        self._publish(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def cancel(self, job_id):
+        """Cancel a queued job outright, or ask a running one to stop. Returns the job, or None if it is unknown."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.status == QUEUED and job.future.cancel():
+            self._finish(job, CANCELLED)
+        elif job.status == RUNNING:
+            ExecutionState.set_stop()
+        return job
+
+    def shutdown(self):
+        """Stop the running job and wait for the pool, e.g. when the server exits."""
+        if self.active_job() is not None:
+            ExecutionState.set_stop()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _run(self, job, function):
+        job.status = RUNNING
+        job.started_at = datetime.now().isoformat()
+        self._publish(job)
+        try:
+            job.result = function()
+        except Exception as e:
+            job.error = str(e)
+            print(f"Execution job {job.job_id} failed: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+            self._finish(job, FAILED)
+            return
+        self._finish(job, STOPPED if ExecutionState.get_stop() else SUCCEEDED)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = datetime.now().isoformat()
+        self._publish(job)
+
+    def _publish(self, job):
+        progress_bus.publish({"type": "job", **job.to_dict()})
+
+
+job_runner = ExecutionJobRunner()
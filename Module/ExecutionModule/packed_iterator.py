@@ -0,0 +1,182 @@
+import asyncio
+import json
+from UtilityFunctions import json_processing
+from Module.ExecutionModule.compiled_survey import get_compiled_survey
+from Module.ExecutionModule.iterator import (
+    ExecutionState,
+    finalize_answers,
+    FULL_FORMAT_PART,
+    format_agent_profile,
+    get_prompt_layout,
+    build_agent_request,
+    parse_agent_answer,
+    mark_stopped
+)
+from Module.ExecutionModule.async_iterator import DEFAULT_CONCURRENCY, gather_agents
+from Module.ExecutionModule.answer_repair import get_repair_attempts, arepair_answer, accept_if_valid, find_repair_targets
+from Module.ExecutionModule.progress import report_agents, finish_progress
+
+PACKED_FORMAT_PART = """
+        You answer the questionnaire separately for every survey participant listed, each one answering only from their own profile.
+        CRITICAL: Your response must contain ONLY valid JSON format, nothing else.
+        Do not include any explanations, reasoning, or additional text before or after the JSON.
+        The output format should be in JSON, with one key per participant id, and each value structured as "question number": answer for that participant, like {"3": {"1": "XXX", "2": "XXX"}, "4": {"1": "XXX", "2": "XXX"}}.
+        Do not place ```json at the beginning or end.
+        If you are asked to reason before/after answering a question, please put your reason and answer to the question in nested keys, like this: "question number": { "reason": "XXX", "answer": "XXX" }.
+        But if you are not asked to give a reason, just put the answer in the value of the question number key and do not give the reason, like "question number": "XXX".
+        You should follow the order of questions strictly in to express question number keys, like "1" is the number of the first question.
+        Start your response directly with { and end with }. No other text is allowed."""
+
+DEFAULT_PACK_MAX_TOKENS = 4096
+
+def get_pack_max_tokens(config):
+    """
+    Output tokens a packed request may ask for, from user_preference.execution.pack_max_tokens. Keep it within the
+    model's output limit: packs are shrunk so that max_tokens per agent times the pack size stays under it.
+    """
+    pack_max_tokens = json_processing.get_json_nested_value(config, "user_preference.execution.pack_max_tokens")
+    if pack_max_tokens == "not found" or not pack_max_tokens:
+        return DEFAULT_PACK_MAX_TOKENS
+    return int(pack_max_tokens)
+
+def get_pack_size(config):
+    """Number of agents answered per request in packed mode, read from user_preference.execution.pack_size (1 disables packing)."""
+    pack_size = json_processing.get_json_nested_value(config, "user_preference.execution.pack_size")
+    if pack_size == "not found" or not pack_size:
+        return 1
+    return max(1, int(pack_size))
+
+def packed_profiles_prompt(packed_profiles):
+    participants = "\n".join(f"Participant {agent_label}: {sample_profile}" for agent_label, sample_profile in packed_profiles)
+    return f"You act as each of the following survey participants:\n{participants}\n"
+
+def build_packed_request(execution_order, questions, packed_profiles, prompt_layout="default"):
+    """Keyword arguments for LLMClient.agenerate answering several profiles at once, laid out like build_agent_request."""
+    if prompt_layout == "cache":
+        return {
+            "prompt": packed_profiles_prompt(packed_profiles),
+            "system_prompt": PACKED_FORMAT_PART,
+            "cache_prefix": f"""{execution_order}\n{questions}"""
+        }
+    return {
+        "prompt": f"""{execution_order}\n{questions}""",
+        "system_prompt": packed_profiles_prompt(packed_profiles) + PACKED_FORMAT_PART
+    }
+
+def unpack_answers(answer_text, agent_labels, logger):
+    """
+    Split a packed response into per-agent answers. Returns {agent_label: answer_dict} for every agent whose
+    part of the response is a non-empty JSON object; agents that are missing or malformed are left out.
+    """
+    try:
+        packed = json.loads(answer_text)
+    except json.JSONDecodeError as e:
+        logger.error(f"Packed agents {agent_labels}: Invalid JSON format: {e}")
+        return {}
+    if not isinstance(packed, dict):
+        return {}
+
+    unpacked = {}
+    for agent_label in agent_labels:
+        answer_dict = packed.get(str(agent_label))
+        if isinstance(answer_dict, dict) and answer_dict:
+            unpacked[agent_label] = answer_dict
+    return unpacked
+
+async def questionnaire_iterator_packed(config_set, processed_data, execution_order, sample_space, sample_space_size, sample_dimensions, upload = False, progress_file=None, pack_size=1, concurrency=DEFAULT_CONCURRENCY, journal=None, semaphore=None, execution_dir=None):
+    """
+    Packed version of questionnaire_iterator_async: pack_size agents share one request, so the questionnaire is sent
+    once per pack instead of once per agent. Agents missing from a malformed packed response are asked again one by one.
+    """
+    config, llm_client, logger, output_manager = config_set
+    output_dir = config_set[3].output_dir
+    # Agents already recorded in the journal (resumed execution) are kept and skipped
+    answers, errors = journal.load() if journal else ({}, {})
+    completed = len(answers)
+    report_agents(progress_file, completed)
+    prompt_layout = get_prompt_layout(config)
+    max_tokens = json_processing.get_json_nested_value(config, "llm_settings.max_tokens")
+
+    compiled_survey = get_compiled_survey(processed_data, max_tokens)
+    questions = compiled_survey.full_text
+    repair_attempts = get_repair_attempts(config)
+    semaphore = semaphore or asyncio.Semaphore(concurrency)
+
+    # Every agent in a pack needs its own output allowance, which must fit in one response
+    fitting_pack_size = max(1, get_pack_max_tokens(config) // llm_client.max_tokens)
+    if pack_size > fitting_pack_size:
+        logger.warning(f"Pack size {pack_size} needs more than {get_pack_max_tokens(config)} output tokens, packing {fitting_pack_size} agents per request")
+        pack_size = fitting_pack_size
+
+    pending_agents = [agent_id for agent_id in range(sample_space_size) if agent_id + 1 not in answers]
+    packs = [pending_agents[start:start + pack_size] for start in range(0, len(pending_agents), pack_size)]
+
+    def finish_agent(agent_id, answer_dict):
+        nonlocal completed
+        answers[agent_id + 1] = answer_dict
+        if journal: journal.append(agent_id + 1, answer_dict, errors[agent_id + 1])
+        completed += 1
+        report_agents(progress_file, completed, agent_id + 1, errors[agent_id + 1])
+
+    async def run_pack(pack):
+        async with semaphore:
+            if ExecutionState.get_drain():
+                return
+
+            profiles = {agent_id: format_agent_profile(sample_space, agent_id, sample_dimensions, upload) for agent_id in pack}
+            for agent_id in pack:
+                errors[agent_id + 1] = []
+
+            request = {
+                **build_packed_request(execution_order, questions, [(agent_id + 1, profiles[agent_id]) for agent_id in pack], prompt_layout),
+                "force_max_tokens": llm_client.max_tokens * len(pack)
+            }
+            # The shared request is tagged with the pack's first agent, and with the whole pack
+            with llm_client.call_context(agent_id=pack[0] + 1, pack=[agent_id + 1 for agent_id in pack]):
+                answer_text = await llm_client.agenerate(**request)
+                unpacked = unpack_answers(answer_text, [agent_id + 1 for agent_id in pack], logger)
+                # The packed response is only cached when every agent in it has valid answers
+                if len(unpacked) == len(pack) and not any(find_repair_targets(processed_data, compiled_survey.expected_ids, answer_dict) for answer_dict in unpacked.values()):
+                    llm_client.accept_response(**request)
+
+            for agent_id in pack:
+                if agent_id + 1 not in unpacked and ExecutionState.get_stop():
+                    return
+
+                with llm_client.call_context(agent_id=agent_id + 1):
+                    if agent_id + 1 in unpacked:
+                        answer_dict = unpacked[agent_id + 1]
+                    else:
+                        # Fall back to a single-agent request for agents the packed response did not answer properly
+                        logger.warning(f"Agent {agent_id + 1}: Packed response malformed, asking individually")
+                        errors[agent_id + 1].append("Packed response malformed, answered individually")
+                        single_request = build_agent_request(execution_order, questions, profiles[agent_id], FULL_FORMAT_PART, prompt_layout)
+                        single_text = await llm_client.agenerate(**single_request)
+                        answer_dict, parse_error = parse_agent_answer(single_text, logger, f"Agent {agent_id + 1}", profiles[agent_id])
+                        if parse_error is not None:
+                            errors[agent_id + 1].append(f"JSON parsing error: {str(parse_error)}")
+                        accept_if_valid(llm_client, single_request, processed_data, compiled_survey.expected_ids, answer_dict, parse_error)
+
+                    if repair_attempts:
+                        answer_dict = await arepair_answer(
+                            llm_client, logger, processed_data, compiled_survey, execution_order, profiles[agent_id],
+                            compiled_survey.expected_ids, answer_dict, errors[agent_id + 1], f"Agent {agent_id + 1}", repair_attempts, prompt_layout
+                        )
+                finish_agent(agent_id, answer_dict)
+
+    await gather_agents(run_pack(pack) for pack in packs)
+
+    answers = finalize_answers(answers)
+    errors = dict(sorted(errors.items()))
+
+    if ExecutionState.get_stop():
+        mark_stopped(output_dir)
+        finish_progress(progress_file, stopped=True)
+        return answers, errors
+
+    finish_progress(progress_file)
+
+    output_manager.save_json(answers, 'answers.json', execution_dir)
+    output_manager.save_json(errors, 'execution_errors.json', execution_dir)
+
+    return answers, errors
@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+from pathlib import Path
+
+
+class ProgressBus:
+    """
+    In-process publish/subscribe channel for execution events, such as answers arriving from a streamed response.
+    Subscribers are plain callables; a failing subscriber never interrupts the execution that published the event.
+    """
+
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                pass
+
+
+progress_bus = ProgressBus()
+
+def execution_name(progress_file):
+    """Executions are identified by their directory name (execution_N), taken from the progress file path."""
+    return Path(progress_file).parent.name if progress_file else None
+
+def answer_publisher(progress_file, agent_id):
+    """on_answer callback for LLMClient.astream_generate that publishes each answer of one agent."""
+    execution = execution_name(progress_file)
+
+    def publish(question, answer):
+        progress_bus.publish({"type": "answer", "execution": execution, "agent_id": agent_id, "question": question, "answer": answer})
+
+    return publish
+
+
+class ExecutionProgress:
+    """
+    In-memory progress of one execution: agents and segments done, token usage, errors and an ETA.
+    usage is the live totals dict from LLMClient.track_usage, so token counts are read without extra bookkeeping.
+    """
+
+    def __init__(self, execution, total_agents, usage=None):
+        self.execution = execution
+        self.total_agents = total_agents
+        self.usage = usage if usage is not None else {}
+        self.agents_done = 0
+        # Agents restored from the journal on resume do not count towards the ETA rate
+        self.resumed_agents = None
+        self.segments_done = 0
+        self.errors = 0
+        self.status = "running"
+        self.started_at = time.monotonic()
+
+    def eta_seconds(self):
+        if self.status != "running":
+            return 0
+        run_agents = self.agents_done - (self.resumed_agents or 0)
+        if run_agents <= 0:
+            return None
+        elapsed = time.monotonic() - self.started_at
+        return round(elapsed / run_agents * (self.total_agents - self.agents_done), 1)
+
+    def snapshot(self):
+        input_tokens = self.usage.get("input_tokens", 0)
+        output_tokens = self.usage.get("output_tokens", 0)
+        progress = 100 if self.status == "finished" else (self.agents_done * 100 / self.total_agents if self.total_agents else 0)
+        return {
+            "execution": self.execution,
+            "status": self.status,
+            "progress": progress,
+            "agents_done": self.agents_done,
+            "total_agents": self.total_agents,
+            "segments_done": self.segments_done,
+            "errors": self.errors,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "tokens": input_tokens + output_tokens,
+            "eta_seconds": self.eta_seconds()
+        }
+
+
+_executions = {}
+_executions_lock = threading.Lock()
+
+def _publish_progress(tracker, event_type):
+    progress_bus.publish({"type": event_type, **tracker.snapshot()})
+
+def reset_progress():
+    """Forget the executions of a previous run."""
+    with _executions_lock:
+        _executions.clear()
+
+def start_progress(progress_file, total_agents, usage=None):
+    """Register an execution that is about to run and announce it."""
+    tracker = ExecutionProgress(execution_name(progress_file), total_agents, usage)
+    with _executions_lock:
+        _executions[tracker.execution] = tracker
+    _publish_progress(tracker, "started")
+    return tracker
+
+def get_progress(execution):
+    """Current snapshot of an execution (by execution_N name), or None if it has not run in this process."""
+    with _executions_lock:
+        tracker = _executions.get(execution)
+    return tracker.snapshot() if tracker else None
+
+def all_progress():
+    with _executions_lock:
+        trackers = list(_executions.values())
+    return [tracker.snapshot() for tracker in trackers]
+
+def _tracker(progress_file):
+    with _executions_lock:
+        return _executions.get(execution_name(progress_file))
+
+def report_agents(progress_file, agents_done, agent_id=None, agent_errors=None):
+    """Publish the number of agents done; an agent that just finished with errors also gets an error event."""
+    tracker = _tracker(progress_file)
+    if tracker is None:
+        return
+    if tracker.resumed_agents is None:
+        tracker.resumed_agents = agents_done if agent_id is None else agents_done - 1
+    tracker.agents_done = agents_done
+    if agent_errors:
+        tracker.errors += len(agent_errors)
+        progress_bus.publish({"type": "error", "execution": tracker.execution, "agent_id": agent_id, "errors": list(agent_errors)})
+    _publish_progress(tracker, "progress")
+
+def report_segment(progress_file, agent_id, question):
+    """Publish one answered segment (identified by its first question) of one agent."""
+    tracker = _tracker(progress_file)
+    if tracker is None:
+        return
+    tracker.segments_done += 1
+    progress_bus.publish({
+        "type": "segment", "execution": tracker.execution, "agent_id": agent_id,
+        "question": question, "segments_done": tracker.segments_done
+    })
+
+def finish_progress(progress_file, stopped=False):
+    """
+    Publish the end of an execution. progress.json is written once here, so the final state of an execution
+    survives a server restart without rewriting the file for every agent.
+    """
+    tracker = _tracker(progress_file)
+    if tracker is None:
+        return
+    tracker.status = "stopped" if stopped else "finished"
+    snapshot = tracker.snapshot()
+    if progress_file:
+        with open(progress_file, 'w') as f:
+            json.dump(snapshot, f)
+    progress_bus.publish({"type": tracker.status, **snapshot})
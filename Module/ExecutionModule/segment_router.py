@@ -0,0 +1,108 @@
+import threading
+
+EXACT_MATCH = 0
+PARTIAL_MATCH = 1
+NO_MATCH = 2
+
+
+def normalize_condition(value):
+    return str(value).strip().lower()
+
+def answer_values(answer):
+    """
+    The strings a jump condition is matched against. Answers given with a reason ({"reason", "answer"})
+    use their answer, and list answers (multiple choice, [reason, answer]) try every element.
+    """
+    if answer is None:
+        return []
+    if isinstance(answer, dict):
+        return answer_values(answer.get("answer"))
+    if isinstance(answer, (list, tuple)):
+        return [value for item in answer for value in answer_values(item)]
+    return [normalize_condition(answer)]
+
+
+class SegmentRouter:
+    """
+    Routing index over the segment list produced by split_question_segments, built once per survey.
+    Segments are indexed by their start question, and at each branch point the normalised jump conditions
+    are kept in a dict for exact lookups plus an ordered list for the substring fallback.
+    """
+
+    def __init__(self, question_segments):
+        self.question_segments = question_segments
+        self.segments_by_start = {}
+        for segment in question_segments:
+            self.segments_by_start.setdefault(str(segment[0]), []).append(segment)
+
+        self._exact_conditions = {}
+        self._conditions = {}
+        for start, candidates in self.segments_by_start.items():
+            if len(candidates) < 2:
+                continue
+            conditions = [(normalize_condition(segment[1] or ""), segment) for segment in candidates]
+            exact = {}
+            for condition, segment in conditions:
+                exact.setdefault(condition, segment)
+            self._exact_conditions[start] = exact
+            self._conditions[start] = conditions
+
+    def candidates(self, question):
+        return self.segments_by_start.get(str(question), [])
+
+    def is_branch_point(self, question):
+        return len(self.candidates(question)) > 1
+
+    def match(self, question, answer):
+        """Segment whose jump condition matches the answer at a branch point, as (segment, match status)."""
+        values = answer_values(answer)
+        exact = self._exact_conditions.get(str(question), {})
+        for value in values:
+            if value in exact:
+                return exact[value], EXACT_MATCH
+
+        for value in values:
+            for condition, segment in self._conditions.get(str(question), []):
+                if value in condition or condition in value:
+                    return segment, PARTIAL_MATCH
+
+        return None, NO_MATCH
+
+    def select(self, current_question, answer, agent_errors, logger):
+        """
+        Pick the segment that starts at current_question. When several segments start there (a branch point),
+        the agent's answer to current_question decides which one is followed.
+        Returns None when no segment starts at current_question, i.e. the agent reached the end of the survey.
+        """
+        candidates = self.candidates(current_question)
+        if len(candidates) == 0:
+            logger.error(f"Question not found.")
+            return None
+
+        if len(candidates) == 1:
+            return candidates[0]
+
+        segment, match_status = self.match(current_question, answer.get(str(current_question)))
+
+        if match_status == PARTIAL_MATCH:
+            agent_errors.append(f"Jump condition imperfect match at question {str(current_question)}")
+        elif match_status == NO_MATCH:
+            agent_errors.append(f"Jump condition not match at question {str(current_question)}")
+            logger.error(f"Jump condition not match.")
+            segment = candidates[0]
+
+        return segment
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+def get_segment_router(question_segments):
+    """SegmentRouter for this segment list, built on first use and looked up by object identity afterwards."""
+    with _routers_lock:
+        entry = _routers.get(id(question_segments))
+        if entry is None or entry[0] is not question_segments:
+            entry = (question_segments, SegmentRouter(question_segments))
+            _routers.clear()
+            _routers[id(question_segments)] = entry
+        return entry[1]
@@ -0,0 +1,55 @@
+from Module.ExecutionModule.iterator import is_last_segment
+from Module.ExecutionModule.segment_router import SegmentRouter
+
+
+class SegmentDAG(SegmentRouter):
+    """
+    Dependency view of the segment list produced by SurveyFlowVisualizer.split_question_segments.
+
+    A segment only has to wait for an answer when it starts at a real branch point, i.e. when several
+    segments start at the same question and the agent's answer to that question picks one of them.
+    Every other segment (e.g. the chunks _add_segment cuts out of a long linear run) only carries the
+    profile and its own questions, so a whole run of them can be dispatched at once.
+    """
+
+    def __init__(self, question_segments, survey_size):
+        super().__init__(question_segments)
+        self.survey_size = survey_size
+        self._runs = {}
+
+    def _within_survey(self, question):
+        try:
+            return int(question) <= self.survey_size
+        except (TypeError, ValueError):
+            return False
+
+    def run_from(self, segment):
+        """
+        Segments that can be dispatched together with `segment`: it and every segment that follows it without
+        a branch decision. Returns (segments, branch_question), where branch_question is the question whose
+        answer selects the next run, or None when the run reaches the end of the survey.
+        """
+        key = id(segment)
+        if key not in self._runs:
+            self._runs[key] = self._compile_run(segment)
+        return self._runs[key]
+
+    def _compile_run(self, segment):
+        run = [segment]
+        current = segment
+
+        while True:
+            next_question = current[2][-1]
+            if is_last_segment(current, current[0]) or not self._within_survey(next_question):
+                return run, None
+
+            candidates = self.candidates(next_question)
+            if len(candidates) == 0:
+                return run, None
+            if len(candidates) > 1:
+                return run, next_question
+
+            current = candidates[0]
+            if any(current is seen for seen in run):
+                return run, None
+            run.append(current)
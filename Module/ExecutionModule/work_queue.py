@@ -0,0 +1,296 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from UtilityFunctions import json_processing
+from Module.ExecutionModule.compiled_survey import get_compiled_survey
+from Module.ExecutionModule.iterator import (
+    ExecutionState,
+    answer_agent,
+    answer_agent_segments,
+    finalize_answers,
+    format_agent_profile,
+    get_prompt_layout
+)
+from Module.ExecutionModule.answer_repair import get_repair_attempts
+from Module.ExecutionModule.execution_plan import get_deduplication_settings, build_execution_plan
+from Module.ExecutionModule.flow import prepare_execution
+from Module.PreprocessingModule.flow import preprocess_survey_load
+
+DEFAULT_LEASE_SECONDS = 900
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+
+MANIFEST_FILE = "work_manifest.json"
+
+
+def get_lease_seconds(config):
+    """How long a worker holds an agent before other workers may claim it again (user_preference.execution.work_queue.lease_seconds)."""
+    lease_seconds = json_processing.get_json_nested_value(config, "user_preference.execution.work_queue.lease_seconds")
+    if lease_seconds == "not found" or not lease_seconds:
+        return DEFAULT_LEASE_SECONDS
+    return max(1, int(lease_seconds))
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    Durable queue of the agents of one execution, stored in a SQLite file in the execution directory.
+    Workers in any process (or machine sharing the filesystem) claim agents under a time-limited lease.
+    An agent whose lease expires, because its worker died, is handed out again; the first result
+    recorded for an agent wins, so a late duplicate only costs the extra request.
+    """
+
+    FILE_NAME = "work_queue.sqlite"
+
+    def __init__(self, execution_dir):
+        self.path = Path(execution_dir) / self.FILE_NAME
+        self._lock = threading.Lock()
+
+        # Transactions are managed explicitly so that a claim is one BEGIN IMMEDIATE ... COMMIT across processes
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS agents ("
+            "agent_id INTEGER PRIMARY KEY, status TEXT NOT NULL, worker TEXT, lease_expires REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, answer TEXT, errors TEXT, finished_at REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS agents_status ON agents (status, agent_id)")
+
+    def enqueue(self, agent_ids, reset=False):
+        """Add agents (1-based ids) as pending. reset=True first drops everything a previous run recorded."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            if reset:
+                self._connection.execute("DELETE FROM agents")
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO agents (agent_id, status) VALUES (?, ?)",
+                [(agent_id, PENDING) for agent_id in agent_ids]
+            )
+            self._connection.execute("COMMIT")
+
+    def claim(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Lease the next pending (or expired) agent to worker and return its id, or None if there is nothing to claim."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT agent_id FROM agents WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                    "ORDER BY agent_id LIMIT 1",
+                    (PENDING, LEASED, now)
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE agents SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE agent_id = ?",
+                        (LEASED, worker, now + lease_seconds, row[0])
+                    )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return row[0] if row is not None else None
+
+    def complete(self, agent_id, worker, answer, agent_errors):
+        """Record the result of an agent. Returns False if another worker already completed it."""
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE agents SET status = ?, worker = ?, lease_expires = NULL, answer = ?, errors = ?, finished_at = ? "
+                "WHERE agent_id = ? AND status != ?",
+                (DONE, worker, json.dumps(answer, ensure_ascii=False), json.dumps(agent_errors, ensure_ascii=False), time.time(), agent_id, DONE)
+            )
+        return cursor.rowcount == 1
+
+    def seed_done(self, answers, errors):
+        """Mark agents finished elsewhere (e.g. in an in-process run's journal) as done with their recorded results."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(
+                "UPDATE agents SET status = ?, worker = NULL, lease_expires = NULL, answer = ?, errors = ?, finished_at = ? "
+                "WHERE agent_id = ? AND status != ?",
+                [
+                    (DONE, json.dumps(answer, ensure_ascii=False), json.dumps(errors.get(agent_id, []), ensure_ascii=False), time.time(), agent_id, DONE)
+                    for agent_id, answer in answers.items()
+                ]
+            )
+            self._connection.execute("COMMIT")
+
+    def release(self, agent_id, worker):
+        """Give a leased agent back at once, e.g. when its worker stops or fails, instead of waiting for the lease to expire."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE agents SET status = ?, worker = NULL, lease_expires = NULL WHERE agent_id = ? AND status = ? AND worker = ?",
+                (PENDING, agent_id, LEASED, worker)
+            )
+
+    def counts(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM agents GROUP BY status").fetchall()
+        counts = {PENDING: 0, LEASED: 0, DONE: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def results(self):
+        """Return (answers, errors) keyed by agent id for every completed agent."""
+        with self._lock:
+            rows = self._connection.execute("SELECT agent_id, answer, errors FROM agents WHERE status = ?", (DONE,)).fetchall()
+        answers = {agent_id: json.loads(answer) for agent_id, answer, _ in rows}
+        errors = {agent_id: json.loads(agent_errors) for agent_id, _, agent_errors in rows}
+        return answers, errors
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def queued_executions(output_dir):
+    """Execution directories of a run that have been enqueued, in execution order."""
+    execution_dirs = [path.parent for path in Path(output_dir).glob(f"execution_*/{MANIFEST_FILE}")]
+    return sorted(execution_dirs, key=lambda path: int(path.name.split("_")[-1]))
+
+def stop_requested(output_dir):
+    """Workers in other processes honour the stop button through the run's stop.json."""
+    try:
+        with open(Path(output_dir) / "stop.json", 'r') as f:
+            return json.load(f).get("stopped", False) is True
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+
+def to_native(value):
+    """value with numpy scalars and arrays (e.g. sample space rows read through pandas) turned into plain Python values."""
+    return json.loads(json.dumps(value, default=lambda item: item.tolist() if hasattr(item, "tolist") else str(item)))
+
+def enqueue_executions(config_set, processed_data, execution_order, sample_space, sample_space_size, sample_dimensions, num_executions=1, segmentation=True, upload=False, multi_modal=False, resume=False):
+    """
+    Prepare execution_1..N of the run for workers: each gets a manifest with everything needed to answer
+    its agents and a work queue holding them. With resume=True agents already completed stay completed, both those
+    completed by workers and those in the execution's journal (a run started in-process, e.g. from the web UI).
+    Returns the execution directories.
+    """
+    config, llm_client, logger, output_manager = config_set
+
+    deduplicate, samples_per_profile, sampling = get_deduplication_settings(config)
+    weights = None
+    if deduplicate:
+        sample_space, weights = build_execution_plan(sample_space[:sample_space_size], samples_per_profile, sampling)
+        sample_space_size = len(sample_space)
+
+    manifest = {
+        "processed_data": processed_data,
+        "execution_order": execution_order,
+        "sample_space": to_native(sample_space[:sample_space_size]),
+        "sample_dimensions": to_native(sample_dimensions),
+        "segmentation": bool(segmentation),
+        "upload": bool(upload),
+        "multi_modal": bool(multi_modal)
+    }
+
+    execution_dirs = []
+    for execution_num in range(1, num_executions + 1):
+        execution_dir, _, journal = prepare_execution(output_manager, execution_num, weights, resume)
+        output_manager.save_json(manifest, MANIFEST_FILE, execution_dir)
+
+        queue = WorkQueue(execution_dir)
+        queue.enqueue(range(1, sample_space_size + 1), reset=not resume)
+        if resume:
+            queue.seed_done(*journal.load())
+        logger.info(f"Execution {execution_num}: {queue.counts()[PENDING]} agents queued")
+        queue.close()
+        execution_dirs.append(execution_dir)
+
+    return execution_dirs
+
+def run_worker(config_set, worker_id=None, lease_seconds=None):
+    """
+    Drain the work queues of a run: claim an agent, answer it and record the result, until every queue is empty
+    or a stop is requested.
+    Returns the number of agents this worker completed.
+    """
+    config, llm_client, logger, output_manager = config_set
+    output_dir = output_manager.output_dir
+    worker_id = worker_id or default_worker_id()
+    lease_seconds = lease_seconds or get_lease_seconds(config)
+    prompt_layout = get_prompt_layout(config)
+    completed = 0
+
+    for execution_dir in queued_executions(output_dir):
+        with open(execution_dir / MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        processed_data = manifest["processed_data"]
+        multi_modal = manifest["multi_modal"]
+        question_segments = preprocess_survey_load(config, processed_data)[0] if manifest["segmentation"] else None
+        compiled_survey = get_compiled_survey(processed_data, json_processing.get_json_nested_value(config, "llm_settings.max_tokens"), question_segments)
+        repair_attempts = 0 if multi_modal else get_repair_attempts(config)
+
+        queue = WorkQueue(execution_dir)
+        try:
+            with llm_client.call_context(execution=execution_dir.name):
+                while True:
+                    if stop_requested(output_dir):
+                        ExecutionState.set_stop()
+                        logger.info(f"Worker {worker_id}: stop requested")
+                        return completed
+
+                    agent_id = queue.claim(worker_id, lease_seconds)
+                    if agent_id is None:
+                        break
+
+                    sample_profile = format_agent_profile(manifest["sample_space"], agent_id - 1, manifest["sample_dimensions"], manifest["upload"])
+                    agent_errors = []
+                    try:
+                        if question_segments is not None:
+                            answer = answer_agent_segments(
+                                config_set, processed_data, compiled_survey, question_segments, manifest["execution_order"],
+                                sample_profile, agent_id - 1, agent_errors, multi_modal, prompt_layout, repair_attempts
+                            )
+                        else:
+                            answer = answer_agent(
+                                config_set, processed_data, compiled_survey, manifest["execution_order"],
+                                sample_profile, agent_id - 1, agent_errors, multi_modal, prompt_layout, repair_attempts
+                            )
+                    except BaseException:
+                        queue.release(agent_id, worker_id)
+                        raise
+
+                    if answer is None:
+                        queue.release(agent_id, worker_id)
+                        return completed
+
+                    if queue.complete(agent_id, worker_id, answer, agent_errors):
+                        completed += 1
+                    logger.info(f"Worker {worker_id}: {execution_dir.name} agent {agent_id} done")
+        finally:
+            queue.close()
+
+    return completed
+
+def merge_execution(config_set, execution_dir):
+    """
+    Write the standard answers.json and execution_errors.json of an execution from its work queue.
+    Returns (answers, errors), or None while agents are still pending or leased.
+    """
+    config, llm_client, logger, output_manager = config_set
+    queue = WorkQueue(execution_dir)
+    try:
+        counts = queue.counts()
+        if counts[PENDING] or counts[LEASED]:
+            logger.info(f"{Path(execution_dir).name}: {counts[PENDING]} pending and {counts[LEASED]} leased agents, not merged")
+            return None
+        answers, errors = queue.results()
+    finally:
+        queue.close()
+
+    answers = finalize_answers(answers)
+    errors = dict(sorted(errors.items()))
+    output_manager.save_json(answers, 'answers.json', execution_dir)
+    output_manager.save_json(errors, 'execution_errors.json', execution_dir)
+    return answers, errors
@@ -48,6 +48,17 @@ def format_sample_space(sampled_df):
     sample_space_size = len(sample_space)
     return sample_space, sample_space_size
 
+def format_uploaded_sample_space(samples, deduplicate = False):
+    """Build [profile_id, profile_string, count] entries from uploaded profile lines, optionally collapsing repeated lines."""
+    if not deduplicate:
+        return [[id + 1, sample, 1] for id, sample in enumerate(samples)]
+
+    profile_counts = {}
+    for sample in samples:
+        profile_counts[sample] = profile_counts.get(sample, 0) + 1
+
+    return [[id + 1, sample, count] for id, (sample, count) in enumerate(profile_counts.items())]
+
 def format_single_profile(formatted_sample_profile, sample_dimensions):
     profile = ""
 
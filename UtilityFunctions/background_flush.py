@@ -0,0 +1,52 @@
+import atexit
+import logging
+import threading
+import weakref
+
+FLUSH_INTERVAL_SECONDS = 1.0
+
+_stores = weakref.WeakSet()
+_lock = threading.Lock()
+_wake = threading.Event()
+_thread = None
+
+logger = logging.getLogger(__name__)
+
+
+def register(store) -> None:
+    """
+    Call store.flush() from one background thread every FLUSH_INTERVAL_SECONDS and at exit, so that callers
+    on a hot path (e.g. the asyncio event loop) only append to an in-memory buffer instead of committing to disk.
+    Stores are held weakly and drop out once they are no longer used.
+    """
+    global _thread
+    with _lock:
+        _stores.add(store)
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="background-flush", daemon=True)
+            _thread.start()
+
+
+def wake() -> None:
+    """Flush without waiting for the interval, e.g. when a buffer has grown large."""
+    _wake.set()
+
+
+def flush_all() -> None:
+    with _lock:
+        stores = list(_stores)
+    for store in stores:
+        try:
+            store.flush()
+        except Exception as e:
+            logger.warning(f"Background flush failed: {str(e)}")
+
+
+def _run():
+    while True:
+        _wake.wait(FLUSH_INTERVAL_SECONDS)
+        _wake.clear()
+        flush_all()
+
+
+atexit.register(flush_all)
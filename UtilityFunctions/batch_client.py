@@ -0,0 +1,207 @@
+import json
+import os
+import re
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Provider limits are 50,000 (OpenAI) and 100,000 (Anthropic) requests per batch
+MAX_BATCH_REQUESTS = 50000
+
+BATCH_PENDING = "pending"
+BATCH_COMPLETED = "completed"
+BATCH_FAILED = "failed"
+
+
+def custom_id_agent(custom_id: str) -> Optional[int]:
+    """Agent id of a batch request's custom_id ("agent-3", "agent-3-round-2-part-0", ...)."""
+    match = re.match(r"agent-(\d+)", custom_id)
+    return int(match.group(1)) if match else None
+
+
+def write_jsonl(path: Path, records: List[Dict]) -> Path:
+    """Write records to a JSONL file through a temporary file, so readers never see a partial batch."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_jsonl(path: Path) -> List[Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class BatchBackend(ABC):
+    """
+    Submit -> poll -> results interface shared by the provider batch endpoints and the local stand-in.
+    A request is a dict with custom_id, prompt, system_prompt and optionally cache_prefix, mirroring LLMClient.generate.
+    Results map custom_id to (response_text, error); exactly one of the two is None.
+    Provider backends record the usage of every result through LLMClient.record_batch_usage as they read it.
+    """
+
+    def __init__(self, llm_client, batch_dir: Path):
+        self.llm_client = llm_client
+        self.batch_dir = Path(batch_dir)
+        self.batch_dir.mkdir(parents=True, exist_ok=True)
+
+    def _provider_body(self, request: Dict) -> Dict:
+        messages = self.llm_client._build_messages(request["prompt"], request.get("system_prompt"), request.get("cache_prefix"))
+        return self.llm_client._build_request(messages, self.llm_client.max_tokens)
+
+    @abstractmethod
+    def submit(self, requests: List[Dict]) -> str:
+        ...
+
+    @abstractmethod
+    def poll(self, batch_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def results(self, batch_id: str) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        ...
+
+    @abstractmethod
+    def cancel(self, batch_id: str) -> None:
+        ...
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI Batch API: the JSONL file is uploaded with purpose="batch" and run against /v1/chat/completions."""
+
+    def submit(self, requests: List[Dict]) -> str:
+        lines = [
+            {"custom_id": request["custom_id"], "method": "POST", "url": "/v1/chat/completions", "body": self._provider_body(request)}
+            for request in requests
+        ]
+        input_path = write_jsonl(self.batch_dir / f"openai_{uuid.uuid4().hex[:12]}.input.jsonl", lines)
+
+        with open(input_path, "rb") as f:
+            batch_file = self.llm_client.client.files.create(file=f, purpose="batch")
+        batch = self.llm_client.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> str:
+        status = self.llm_client.client.batches.retrieve(batch_id).status
+        if status == "completed":
+            return BATCH_COMPLETED
+        if status in ("failed", "expired", "cancelled"):
+            return BATCH_FAILED
+        return BATCH_PENDING
+
+    def results(self, batch_id: str) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        batch = self.llm_client.client.batches.retrieve(batch_id)
+        results = {}
+
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.llm_client.client.files.content(file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                if entry.get("error") or response.get("status_code") != 200:
+                    results[entry["custom_id"]] = (None, str(entry.get("error") or response.get("body")))
+                else:
+                    results[entry["custom_id"]] = (response["body"]["choices"][0]["message"]["content"], None)
+                    self.llm_client.record_batch_usage(response["body"].get("usage"), custom_id_agent(entry["custom_id"]))
+
+        return results
+
+    def cancel(self, batch_id: str) -> None:
+        self.llm_client.client.batches.cancel(batch_id)
+
+
+class AnthropicBatchBackend(BatchBackend):
+    """Anthropic Message Batches API. The JSONL file is only kept as a record of what was submitted."""
+
+    def submit(self, requests: List[Dict]) -> str:
+        batch_requests = [{"custom_id": request["custom_id"], "params": self._provider_body(request)} for request in requests]
+        write_jsonl(self.batch_dir / f"anthropic_{uuid.uuid4().hex[:12]}.input.jsonl", batch_requests)
+
+        batch = self.llm_client.client.messages.batches.create(requests=batch_requests)
+        return batch.id
+
+    def poll(self, batch_id: str) -> str:
+        batch = self.llm_client.client.messages.batches.retrieve(batch_id)
+        return BATCH_COMPLETED if batch.processing_status == "ended" else BATCH_PENDING
+
+    def results(self, batch_id: str) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        results = {}
+        for entry in self.llm_client.client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = (entry.result.message.content[0].text, None)
+                self.llm_client.record_batch_usage(entry.result.message.usage, custom_id_agent(entry.custom_id))
+            else:
+                results[entry.custom_id] = (None, f"Batch request {entry.result.type}")
+        return results
+
+    def cancel(self, batch_id: str) -> None:
+        self.llm_client.client.messages.batches.cancel(batch_id)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for the provider batch endpoints, so submit -> poll -> ingest can run offline.
+    submit writes <batch_id>.input.jsonl, the first poll answers every request with `responder`
+    and writes <batch_id>.output.jsonl, and results reads that file back.
+    The default responder calls LLMClient.generate, which also makes this usable with endpoints that have no batch API.
+    """
+
+    def __init__(self, llm_client, batch_dir: Path, responder: Optional[Callable[[Dict], str]] = None):
+        super().__init__(llm_client, batch_dir)
+        self.responder = responder or (lambda request: llm_client.generate(
+            prompt=request["prompt"], system_prompt=request.get("system_prompt"), cache_prefix=request.get("cache_prefix")
+        ))
+
+    def _input_path(self, batch_id: str) -> Path:
+        return self.batch_dir / f"{batch_id}.input.jsonl"
+
+    def _output_path(self, batch_id: str) -> Path:
+        return self.batch_dir / f"{batch_id}.output.jsonl"
+
+    def submit(self, requests: List[Dict]) -> str:
+        batch_id = f"local_batch_{uuid.uuid4().hex[:12]}"
+        write_jsonl(self._input_path(batch_id), requests)
+        return batch_id
+
+    def poll(self, batch_id: str) -> str:
+        if self._output_path(batch_id).exists():
+            return BATCH_COMPLETED
+        if not self._input_path(batch_id).exists():
+            return BATCH_FAILED
+
+        outputs = []
+        for request in read_jsonl(self._input_path(batch_id)):
+            try:
+                outputs.append({"custom_id": request["custom_id"], "text": self.responder(request)})
+            except Exception as e:
+                outputs.append({"custom_id": request["custom_id"], "error": str(e)})
+        write_jsonl(self._output_path(batch_id), outputs)
+
+        return BATCH_COMPLETED
+
+    def results(self, batch_id: str) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        return {entry["custom_id"]: (entry.get("text"), entry.get("error")) for entry in read_jsonl(self._output_path(batch_id))}
+
+    def cancel(self, batch_id: str) -> None:
+        self._input_path(batch_id).unlink(missing_ok=True)
+
+
+def create_batch_backend(llm_client, batch_dir: Path, backend: str = "provider", responder=None) -> BatchBackend:
+    if backend == "local":
+        return LocalBatchBackend(llm_client, batch_dir, responder)
+    if llm_client.provider == "openai":
+        return OpenAIBatchBackend(llm_client, batch_dir)
+    if llm_client.provider == "anthropic":
+        return AnthropicBatchBackend(llm_client, batch_dir)
+    raise ValueError(f"Unsupported batch provider: {llm_client.provider}")
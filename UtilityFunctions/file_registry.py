@@ -0,0 +1,104 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+
+def file_digest(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def account_id(api_key: str) -> str:
+    """Stable id of the account an API key belongs to, so uploads are only reused with the key that made them."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+class UploadedFileRegistry:
+    """
+    File ids returned by provider file uploads, keyed by provider, endpoint, account (a hash of the API key, since
+    file ids belong to one organization) and the SHA-256 of the file content,
+    stored in a SQLite file so that a survey is uploaded once and reused by every request of a run and later runs.
+    Entries expire after ttl_hours; expired ids are handed back by pop_expired so their remote files can be deleted.
+    """
+
+    def __init__(self, path: str, ttl_hours: float = 168):
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self._lock = threading.Lock()
+        # Digests of local files, so an unchanged file is not re-read for every request
+        self._digests = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # Registries written before uploads were keyed by account cannot tell whose file ids they hold
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(uploaded_files)").fetchall()]
+        if columns and "account" not in columns:
+            self._connection.execute("DROP TABLE uploaded_files")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS uploaded_files ("
+            "provider TEXT NOT NULL, base_url TEXT NOT NULL, account TEXT NOT NULL, digest TEXT NOT NULL, file_id TEXT NOT NULL, "
+            "file_name TEXT, uploaded_at REAL NOT NULL, PRIMARY KEY (provider, base_url, account, digest))"
+        )
+        self._connection.commit()
+
+    def digest(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            digest = file_digest(file_path)
+            with self._lock:
+                self._digests[key] = digest
+        return digest
+
+    def get(self, provider: str, base_url: str, account: str, digest: str) -> Optional[str]:
+        """File id of an unexpired upload of this content, or None."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT file_id FROM uploaded_files WHERE provider = ? AND base_url = ? AND account = ? AND digest = ? AND uploaded_at > ?",
+                (provider, base_url, account, digest, time.time() - self.ttl)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, provider: str, base_url: str, account: str, digest: str, file_id: str, file_name: Optional[str] = None) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO uploaded_files (provider, base_url, account, digest, file_id, file_name, uploaded_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (provider, base_url, account, digest, file_id, file_name, time.time())
+            )
+            self._connection.commit()
+
+    def remove(self, provider: str, base_url: str, account: str, digest: str) -> None:
+        """Forget an upload, e.g. when the provider no longer knows its file id."""
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM uploaded_files WHERE provider = ? AND base_url = ? AND account = ? AND digest = ?",
+                (provider, base_url, account, digest)
+            )
+            self._connection.commit()
+
+    def pop_expired(self, provider: str, base_url: str, account: str) -> List[Tuple[str, str]]:
+        """Remove and return (digest, file_id) of the expired uploads for one endpoint and account."""
+        with self._lock:
+            cutoff = time.time() - self.ttl
+            rows = self._connection.execute(
+                "SELECT digest, file_id FROM uploaded_files WHERE provider = ? AND base_url = ? AND account = ? AND uploaded_at <= ?",
+                (provider, base_url, account, cutoff)
+            ).fetchall()
+            self._connection.execute(
+                "DELETE FROM uploaded_files WHERE provider = ? AND base_url = ? AND account = ? AND uploaded_at <= ?",
+                (provider, base_url, account, cutoff)
+            )
+            self._connection.commit()
+        return rows
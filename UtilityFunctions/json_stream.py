@@ -0,0 +1,79 @@
+import json
+from typing import Any, List, Tuple
+
+
+class IncrementalJSONObjectParser:
+    """
+    Parses a JSON object that arrives in chunks (a streamed LLM response) and reports each top-level member
+    as soon as its value is complete. Text before the opening brace is ignored, like _extract_json_from_response.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.members = {}
+        self.started = False
+        self.closed = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member_start = 0
+        self._position = 0
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """Add a chunk and return the (key, value) members completed by it."""
+        completed = []
+        if self.closed:
+            return completed
+
+        self.buffer += text
+        while self._position < len(self.buffer):
+            char = self.buffer[self._position]
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self._depth = 1
+                    self._member_start = self._position + 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.extend(self._complete_member(self._position))
+                    self.closed = True
+                    self._position += 1
+                    break
+            elif char == "," and self._depth == 1:
+                completed.extend(self._complete_member(self._position))
+                self._member_start = self._position + 1
+            self._position += 1
+
+        return completed
+
+    def _complete_member(self, end: int) -> List[Tuple[str, Any]]:
+        member = self.buffer[self._member_start:end].strip()
+        if not member:
+            return []
+        try:
+            items = list(json.loads("{" + member + "}").items())
+        except json.JSONDecodeError:
+            return []
+        self.members.update(items)
+        return items
+
+    def has_keys(self, keys) -> bool:
+        return all(str(key) in self.members for key in keys)
+
+    def text(self) -> str:
+        """The object as received so far, without any text the model added after it."""
+        if not self.started:
+            return self.buffer
+        return self.buffer[self.buffer.index("{"):self._position] if self.closed else self.buffer
@@ -1,10 +1,329 @@
+import asyncio
+import contextvars
+import functools
 import json
 import logging
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, List, Optional, Union
 import anthropic
+import httpx
 import openai
 import base64
+import importlib.util
 import os
+import re
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from UtilityFunctions.response_cache import ResponseCache
+from UtilityFunctions.telemetry import TelemetryStore
+from UtilityFunctions.file_registry import UploadedFileRegistry, account_id
+from UtilityFunctions.json_stream import IncrementalJSONObjectParser
+from UtilityFunctions.run_logging import setup_run_logging
+
+RATE_LIMIT_ERRORS = (openai.RateLimitError, anthropic.RateLimitError)
+# 404 / not_found_error responses, e.g. for a file id the provider has deleted
+FILE_NOT_FOUND_ERRORS = (openai.NotFoundError, anthropic.NotFoundError)
+MAX_BACKOFF_SECONDS = 60
+# Responses held for accept_response; the oldest are dropped beyond this
+MAX_UNACCEPTED_RESPONSES = 4096
+
+# Usage totals of the execution running in the current context, see LLMClient.track_usage
+_usage_scope = contextvars.ContextVar("llm_usage_scope", default=None)
+# Execution, agent and segment the current requests are made for, see LLMClient.call_context
+_call_context = contextvars.ContextVar("llm_call_context", default={})
+# Telemetry record of the call in progress in the current context
+_current_call = contextvars.ContextVar("llm_current_call", default=None)
+
+
+def parse_reset_seconds(value) -> Optional[float]:
+    """Parse a retry-after / rate limit reset header: seconds ("2.5"), durations ("6m0s", "20ms") or RFC 3339 timestamps."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit] for number, unit in parts)
+
+    try:
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return max((reset_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except ValueError:
+        return None
+
+
+def usage_value(usage, name: str):
+    """A usage field of an SDK response object or of a raw response body (dict, e.g. a batch result); None when absent."""
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+def recorded_call(kind: str):
+    """Decorator recording each call of an LLMClient generate method (sync or async) in the client's telemetry store."""
+    def decorator(method):
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                with self._telemetry_call(kind):
+                    return await method(self, *args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self._telemetry_call(kind):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TokenBucket:
+    """Per-minute budget refilled continuously. A capacity of None means unlimited until a provider limit header is seen."""
+
+    def __init__(self, per_minute=0):
+        self.capacity = float(per_minute) if per_minute else None
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if self.capacity is None:
+            return 0.0
+        # A single request larger than the whole budget waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        return max(amount - self.level, 0.0) * 60 / self.capacity
+
+    def take(self, amount: float):
+        if self.capacity is not None:
+            self.level -= amount
+
+    def observe(self, limit, remaining):
+        """Adopt the provider's limit when none was configured and never assume more headroom than it reports."""
+        if limit is not None and self.capacity is None:
+            self.capacity = float(limit)
+            self.level = self.capacity
+        if remaining is not None and self.capacity is not None:
+            self.level = min(self.level, float(remaining))
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budget shared by every request to one model.
+    Tokens are pre-charged with an estimate and reconciled once the actual usage is known;
+    provider x-ratelimit-* headers tighten the local view and 429 responses pause all requests for retry-after.
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.settings = (requests_per_minute, tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        """Take one request and `tokens` from the budget if available and return 0, otherwise return the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            wait = max(self.blocked_until - now, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            return 0.0
+
+    def acquire(self, tokens: int):
+        wait = self.reserve(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.reserve(tokens)
+
+    async def acquire_async(self, tokens: int):
+        wait = self.reserve(tokens)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.reserve(tokens)
+
+    def reconcile(self, estimated: int, actual: int):
+        """Give back to the token bucket the difference between the pre-charged estimate and the tokens actually used."""
+        with self._lock:
+            if self.tokens.capacity is not None:
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated - actual)
+
+    def update_from_headers(self, headers):
+        if headers is None:
+            return
+        with self._lock:
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}") or headers.get(f"anthropic-ratelimit-{kind}-limit")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}") or headers.get(f"anthropic-ratelimit-{kind}-remaining")
+                try:
+                    bucket.observe(float(limit) if limit else None, float(remaining) if remaining else None)
+                except ValueError:
+                    continue
+
+    def back_off(self, headers, attempt: int) -> float:
+        """Pause every request after a 429, for retry-after if the provider sent one, otherwise exponentially."""
+        wait = None
+        if headers is not None:
+            retry_after_ms = headers.get("retry-after-ms")
+            wait = float(retry_after_ms) / 1000 if retry_after_ms else parse_reset_seconds(headers.get("retry-after"))
+            if wait is None:
+                wait = parse_reset_seconds(headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset-tokens"))
+        if wait is None:
+            wait = min(2 ** attempt, MAX_BACKOFF_SECONDS)
+
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+        return wait
+
+
+class HedgingPolicy:
+    """
+    When to send a duplicate (hedge) request for a slow call. The threshold is the observed latency percentile
+    of recent requests of the same model and size bucket (estimated tokens rounded up to a power of two), never
+    below min_delay. Hedging starts once min_samples latencies are known, and the hedges sent are capped at
+    max_hedge_ratio of all requests to bound the extra spend.
+    """
+
+    def __init__(self, percentile=95, min_samples=20, min_delay=1.0, max_hedge_ratio=0.05, window=200):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_hedge_ratio = max_hedge_ratio
+        self.window = window
+        self.requests = 0
+        self.hedges = 0
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, estimated_tokens: int):
+        return model, 1 << max(int(estimated_tokens) - 1, 0).bit_length()
+
+    def observe(self, key, seconds: float):
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def threshold(self, key) -> Optional[float]:
+        """Seconds to wait before hedging a request, or None while too few latencies are known."""
+        with self._lock:
+            self.requests += 1
+            latencies = sorted(self._latencies.get(key, ()))
+        if len(latencies) < self.min_samples:
+            return None
+        rank = max(1, -(-len(latencies) * self.percentile // 100))
+        return max(latencies[int(rank) - 1], self.min_delay)
+
+    def allow_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.requests * self.max_hedge_ratio:
+                return False
+            self.hedges += 1
+            return True
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, base_url: str, model: str, requests_per_minute=0, tokens_per_minute=0) -> RateLimiter:
+    """Limiters are process-wide so that every LLMClient created for the same model draws on one budget."""
+    key = (provider, base_url, model)
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None or limiter.settings != (requests_per_minute, tokens_per_minute):
+            limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+            _rate_limiters[key] = limiter
+        return limiter
+
+
+_sdk_clients = {}
+_sdk_clients_lock = threading.Lock()
+# Close tasks of evicted async clients, referenced until they finish
+_closing_clients = set()
+
+
+def _new_sdk_client(provider: str, base_url: str, api_key: str, connection_pool: Dict, is_async: bool):
+    sdk = anthropic if provider == "anthropic" else openai
+    limits = httpx.Limits(
+        max_connections=connection_pool["max_connections"],
+        max_keepalive_connections=connection_pool["max_keepalive_connections"],
+        keepalive_expiry=connection_pool["keepalive_expiry"]
+    )
+    if is_async:
+        http_client = sdk.DefaultAsyncHttpxClient(limits=limits, http2=connection_pool["http2"])
+        client_class = anthropic.AsyncAnthropic if provider == "anthropic" else openai.AsyncOpenAI
+    else:
+        http_client = sdk.DefaultHttpxClient(limits=limits, http2=connection_pool["http2"])
+        client_class = anthropic.Anthropic if provider == "anthropic" else openai.OpenAI
+    return client_class(api_key=api_key, base_url=base_url, http_client=http_client)
+
+
+def get_sdk_client(provider: str, base_url: str, api_key: str, connection_pool: Dict, is_async: bool = False):
+    """
+    SDK clients are process-wide so that every LLMClient created for the same endpoint and key (e.g. one per
+    uploaded survey) keeps using one pool of kept-alive connections instead of opening new ones.
+    Async clients are bound to an event loop, so they are pooled per running loop.
+    """
+    key = (provider, base_url, api_key)
+    loop = None
+    if is_async:
+        loop = asyncio.get_running_loop()
+        key += (id(loop),)
+    settings = tuple(sorted(connection_pool.items()))
+
+    with _sdk_clients_lock:
+        entry = _sdk_clients.get(key)
+        if entry is not None and entry[0] == settings and (loop is None or entry[1]() is loop):
+            return entry[2]
+        evicted = []
+        if loop is not None:
+            # Async clients of event loops that have finished cannot be used again; close what is left of them
+            stale_keys = [k for k, (_, loop_ref, _) in _sdk_clients.items() if loop_ref is not None and (loop_ref() is None or loop_ref().is_closed())]
+            evicted = [_sdk_clients.pop(stale_key)[2] for stale_key in stale_keys]
+        client = _new_sdk_client(provider, base_url, api_key, connection_pool, is_async)
+        _sdk_clients[key] = (settings, weakref.ref(loop) if loop is not None else None, client)
+
+    for stale_client in evicted:
+        task = loop.create_task(_close_async_client(stale_client))
+        _closing_clients.add(task)
+        task.add_done_callback(_closing_clients.discard)
+    return client
+
+
+async def _close_async_client(client) -> None:
+    try:
+        await client.close()
+    except Exception as e:
+        logging.getLogger(__name__).warning(f"Failed to close pooled async client: {str(e)}")
+
+
+async def close_async_clients() -> None:
+    """
+    Close the pooled async clients bound to the running event loop. Call it before the loop finishes (e.g. at the
+    end of the coroutine given to asyncio.run), since their connections can no longer be closed afterwards.
+    """
+    loop = asyncio.get_running_loop()
+    with _sdk_clients_lock:
+        keys = [k for k, (_, loop_ref, _) in _sdk_clients.items() if loop_ref is not None and loop_ref() is loop]
+        clients = [_sdk_clients.pop(k)[2] for k in keys]
+    for client in clients:
+        await _close_async_client(client)
+
+
 class LLMClient:
     def __init__(self, config_path: str = "config.json", output_dir: str = './'):
         self.output_dir = output_dir
@@ -22,16 +341,11 @@ class LLMClient:
 
     def _setup_logging(self):
         log_config = self.config.get("logging", {})
-        log_level = getattr(logging, log_config.get("level", "INFO"))
-        log_file = self.output_dir / "llm_client.log"
-
-        logging.basicConfig(
-            level=log_level,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler()
-            ]
+        setup_run_logging(
+            self.output_dir / "llm_client.log",
+            __name__,
+            log_config.get("level", "INFO"),
+            log_config.get("format", "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
         )
         self.logger = logging.getLogger(__name__)
 
@@ -50,68 +364,744 @@ class LLMClient:
         if self.provider == "anthropic":
             if not self.base_url:
                 self.base_url = "https://api.anthropic.com"
-            self.client = anthropic.Anthropic(api_key=self.api_key, base_url=self.base_url)
         elif self.provider == "openai":
             if not self.base_url:
                 self.base_url = "https://api.openai.com/v1"
-            self.client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
         else:
             raise ValueError(f"Unsupported provider: {self.provider}")
 
+        self._setup_connection_pool()
+        self.client = get_sdk_client(self.provider, self.base_url, self.api_key, self.connection_pool)
+
+        self._usage_lock = threading.Lock()
+        self._line_tokens = functools.lru_cache(maxsize=65536)(self._count_tokens)
+        self.usage_totals = {"input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0}
+        self._usage_listeners = []
+
+        self._setup_response_cache()
+        self._setup_rate_limiter()
+        self._setup_hedging()
+        self._setup_file_registry()
+        self._setup_telemetry()
+
+    def _setup_connection_pool(self):
+        """
+        HTTP connection limits from llm_settings.connection_pool. Unset (0) limits are sized to
+        user_preference.execution.concurrency: every agent in flight keeps a warm connection, with headroom
+        for hedges and retries. http2 needs the optional h2 package and is ignored without it.
+        """
+        settings = self.config.get("llm_settings", {}).get("connection_pool", {})
+        concurrency = self.config.get("user_preference", {}).get("execution", {}).get("concurrency") or 1
+        concurrency = max(1, int(concurrency))
+
+        http2 = settings.get("http2", False) is True
+        if http2 and importlib.util.find_spec("h2") is None:
+            self.logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+
+        self.connection_pool = {
+            "max_connections": settings.get("max_connections") or max(2 * concurrency, 100),
+            "max_keepalive_connections": settings.get("max_keepalive_connections") or max(concurrency, 20),
+            "keepalive_expiry": float(settings.get("keepalive_expiry_seconds", 60)),
+            "http2": http2
+        }
+
+    def _setup_file_registry(self):
+        """
+        Registry of uploaded survey files from the top-level file_registry settings, so generate_multimodal uploads
+        each file once instead of on every call. Uploads older than ttl_hours are uploaded again and, with
+        delete_expired, their remote files are deleted.
+        """
+        settings = self.config.get("file_registry", {})
+        self.file_registry = None
+        self.delete_expired_uploads = settings.get("delete_expired", True) is True
+        self.file_account = account_id(self.api_key)
+        self._upload_lock = threading.Lock()
+        if settings.get("enable", False) is not True:
+            return
+        try:
+            self.file_registry = UploadedFileRegistry(
+                settings.get("path", "Data/Cache/uploaded_files.sqlite"),
+                settings.get("ttl_hours", 168)
+            )
+        except Exception as e:
+            self.logger.warning(f"File registry disabled: {str(e)}")
+
+    def _setup_hedging(self):
+        """
+        Hedged async requests from llm_settings.hedging. A secondary endpoint (base_url, api_key, model) is optional;
+        without one the hedge goes to the primary endpoint. Only non-streaming agenerate requests are hedged: the
+        sync generate and astream_generate always send a single request.
+        """
+        hedging = self.config.get("llm_settings", {}).get("hedging", {})
+        self.hedging = None
+        if hedging.get("enable", False) is not True:
+            return
+        self.hedging = HedgingPolicy(
+            hedging.get("percentile", 95), hedging.get("min_samples", 20),
+            hedging.get("min_delay_seconds", 1.0), hedging.get("max_hedge_ratio", 0.05)
+        )
+        secondary = hedging.get("secondary") or {}
+        self.hedge_endpoint = {
+            "base_url": secondary.get("base_url") or self.base_url,
+            "api_key": secondary.get("api_key") or self.api_key,
+            "model": secondary.get("model") or None
+        }
+
+    def _setup_telemetry(self):
+        """Per-call telemetry store in the run directory, from the top-level telemetry settings."""
+        self.telemetry = None
+        if self.config.get("telemetry", {}).get("enable", False) is not True:
+            return
+        try:
+            self.telemetry = TelemetryStore(os.path.join(self.output_dir, "telemetry.sqlite"))
+        except Exception as e:
+            self.logger.warning(f"Telemetry disabled: {str(e)}")
+
+    def set_output_dir(self, output_dir) -> None:
+        """
+        Move the per-run state (llm_client.log, telemetry, usage totals) to another run directory. This lets one
+        client, with its response cache, learned rate limits and hedging latencies, serve run after run.
+        """
+        if self.telemetry is not None:
+            self.telemetry.close()
+        self.output_dir = output_dir
+        self._setup_logging()
+        self._setup_telemetry()
+        with self._usage_lock:
+            self.usage_totals = {"input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0}
+
+    @staticmethod
+    @contextmanager
+    def call_context(**fields):
+        """Tag every request made in this context (execution, agent_id, segment) for telemetry. Nested contexts add fields."""
+        token = _call_context.set({**_call_context.get(), **fields})
+        try:
+            yield
+        finally:
+            _call_context.reset(token)
+
+    @contextmanager
+    def _telemetry_call(self, kind: str):
+        """Time one generate call and record it, with its usage, queue time and outcome, in the telemetry store."""
+        if self.telemetry is None:
+            yield None
+            return
+
+        context = _call_context.get()
+        call = {
+            "started_at": time.time(), "execution": context.get("execution"), "agent_id": context.get("agent_id"),
+            "segment": context.get("segment"), "provider": self.provider, "model": self.model, "kind": kind,
+            "outcome": "ok", "attempts": 0, "queue_seconds": 0.0,
+            "input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0
+        }
+        token = _current_call.set(call)
+        started = time.monotonic()
+        try:
+            yield call
+        except asyncio.CancelledError:
+            call["outcome"] = "cancelled"
+            raise
+        except Exception as e:
+            call["outcome"] = "error"
+            call["error"] = str(e)[:500]
+            raise
+        finally:
+            _current_call.reset(token)
+            call["total_seconds"] = time.monotonic() - started
+            call["latency_seconds"] = call["total_seconds"] - call["queue_seconds"]
+            call["attempts"] = max(call["attempts"], 1) if call["outcome"] != "cache_hit" else 0
+            try:
+                self.telemetry.record(call)
+            except Exception as e:
+                self.logger.warning(f"Failed to record telemetry: {str(e)}")
+
+    def _acquire(self, estimated: int):
+        """Wait for the throttle delay and the rate limiter, counting the wait as queue time of the current call."""
+        started = time.monotonic()
+        if self.request_delay:
+            time.sleep(self.request_delay)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(estimated)
+        self._count_attempt(time.monotonic() - started)
+
+    async def _acquire_async(self, estimated: int, rate_limiter=None):
+        started = time.monotonic()
+        rate_limiter = rate_limiter or self.rate_limiter
+        if self.request_delay:
+            await asyncio.sleep(self.request_delay)
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async(estimated)
+        self._count_attempt(time.monotonic() - started)
+
+    def _count_attempt(self, queue_seconds: float = 0.0):
+        call = _current_call.get()
+        if call is not None:
+            call["attempts"] += 1
+            call["queue_seconds"] += queue_seconds
+
+    def _setup_rate_limiter(self):
+        """
+        Shared RPM/TPM limiter from llm_settings.rate_limit. Limits of 0 are learned from the provider's
+        rate limit headers; max_retries is the number of retries after a 429 response.
+        """
+        rate_limit = self.config.get("llm_settings", {}).get("rate_limit", {})
+        self.rate_limit_retries = rate_limit.get("max_retries", 5)
+        self.rate_limit_enabled = rate_limit.get("enable", False) is True
+        self.rate_limit_settings = (rate_limit.get("requests_per_minute", 0), rate_limit.get("tokens_per_minute", 0))
+        # Extra pause before every request, set by the budget guard to slow an execution down
+        self.request_delay = 0.0
+        self._select_rate_limiter()
+
+    def _select_rate_limiter(self):
+        self.rate_limiter = None
+        if self.rate_limit_enabled:
+            self.rate_limiter = get_rate_limiter(self.provider, self.base_url, self.model, *self.rate_limit_settings)
+
+    def set_model(self, model: str) -> None:
+        """
+        Send later requests to another model (e.g. the budget guard's fallback). Limits are per model, so the
+        client switches to that model's shared rate limiter; usage is reported with the model of each request.
+        """
+        self.model = model
+        self._line_tokens.cache_clear()
+        self._select_rate_limiter()
+
+    def _setup_response_cache(self):
+        """
+        Persistent response cache from the top-level response_cache settings.
+        bypass skips the cache entirely, refresh ignores stored responses but still records new ones,
+        and deterministic_only limits caching to temperature 0 so sampled answers stay independent.
+        A new response is only stored once the caller accepts it (see accept_response).
+        """
+        cache_settings = self.config.get("response_cache", {})
+        self.response_cache = None
+        # cache key -> response text waiting for accept_response
+        self._unaccepted = {}
+        self._unaccepted_lock = threading.Lock()
+        self.cache_bypass = cache_settings.get("bypass", False) is True
+        self.cache_refresh = cache_settings.get("refresh", False) is True
+
+        if cache_settings.get("enable", False) is not True or self.cache_bypass:
+            return
+        if cache_settings.get("deterministic_only", True) and float(self.temperature or 0) > 0:
+            return
+
+        try:
+            self.response_cache = ResponseCache(
+                cache_settings.get("path", "Data/Cache/llm_responses.sqlite"),
+                cache_settings.get("max_size_mb", 512)
+            )
+        except Exception as e:
+            self.logger.warning(f"Response cache disabled: {str(e)}")
+
+    def _cache_key(self, prompt: str, system_prompt: Optional[str], cache_prefix: Optional[str], max_tokens: int) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        # Replicate executions (and agents sharing a profile) send identical requests. Keying on the execution and agent
+        # keeps each replicate an independent sample rather than a copy of the first; re-running an execution still hits.
+        context = _call_context.get()
+        scope = {"execution": context.get("execution"), "agent_id": context.get("agent_id")}
+        return ResponseCache.make_key(self.provider, self.model, self.temperature, max_tokens, system_prompt, prompt, cache_prefix, scope)
+
+    def _hold_response(self, cache_key: Optional[str], response_text: str) -> None:
+        if cache_key is None:
+            return
+        with self._unaccepted_lock:
+            self._unaccepted[cache_key] = response_text
+            while len(self._unaccepted) > MAX_UNACCEPTED_RESPONSES:
+                del self._unaccepted[next(iter(self._unaccepted))]
+
+    def accept_response(self, prompt: str, system_prompt: Optional[str] = None, force_max_tokens: Optional[int] = None,
+                        cache_prefix: Optional[str] = None, **kwargs) -> None:
+        """
+        Store the response of the generate/agenerate/astream_generate call made with these arguments in the response
+        cache. Callers accept a response once it parses as the answer they expected, so a truncated or malformed answer
+        is never replayed. Call it in the same call_context as the request; cached responses are not stored again.
+        """
+        if self.response_cache is None:
+            return
+        max_tokens = force_max_tokens if force_max_tokens is not None else self.max_tokens
+        cache_key = self._cache_key(prompt, system_prompt, cache_prefix, max_tokens)
+        with self._unaccepted_lock:
+            response_text = self._unaccepted.pop(cache_key, None)
+        if response_text is not None:
+            self.response_cache.set(cache_key, response_text)
+
+    async def _acached_response(self, cache_key: Optional[str]) -> Optional[str]:
+        """_cached_response off the event loop, since the lookup reads SQLite."""
+        if cache_key is None or self.cache_refresh:
+            return None
+        return await asyncio.to_thread(self._cached_response, cache_key)
+
+    def _cached_response(self, cache_key: Optional[str]) -> Optional[str]:
+        if cache_key is None or self.cache_refresh:
+            return None
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            self.logger.info(f"Response cache hit: {cache_key[:12]}")
+            call = _current_call.get()
+            if call is not None:
+                call["outcome"] = "cache_hit"
+        return cached
+
+    @property
+    def async_client(self):
+        """
+        Asyncio counterpart of self.client, used by the concurrent execution mode.
+        The client is bound to the running event loop, so one is pooled per loop.
+        """
+        return get_sdk_client(self.provider, self.base_url, self.api_key, self.connection_pool, is_async=True)
+
+    @property
+    def hedge_async_client(self):
+        """Async client for hedge requests: the secondary endpoint if one is configured, otherwise the primary client."""
+        return get_sdk_client(
+            self.provider, self.hedge_endpoint["base_url"], self.hedge_endpoint["api_key"], self.connection_pool, is_async=True
+        )
+
+    def _build_messages(self, prompt: str, system_prompt: Optional[str] = None, cache_prefix: Optional[str] = None) -> List[Dict]:
+        """
+        cache_prefix is static text shared by many requests (instructions, rendered questionnaire). It is placed
+        before the per-request prompt so that the shared part forms a common prefix: OpenAI caches it automatically
+        and Anthropic caches it through a cache_control breakpoint.
+        """
+        if cache_prefix is None:
+            messages = [{"role": "user", "content": prompt}]
+        elif self.provider == "anthropic":
+            messages = [{"role": "user", "content": [
+                {"type": "text", "text": cache_prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": prompt}
+            ]}]
+        else:
+            messages = [{"role": "user", "content": f"{cache_prefix}\n{prompt}"}]
+
+        if system_prompt:
+            messages.insert(0, {"role": "user" if self.provider=="anthropic" else "system", "content": system_prompt})
+
+        return messages
+
+    def _build_request(self, messages: List[Dict], max_tokens: int) -> Dict:
+        if self.provider == "openai" and "gpt-5" in self.model:
+            return {"model": self.model, "messages": messages, "max_completion_tokens": max_tokens}
+        return {"model": self.model, "messages": messages, "max_tokens": max_tokens, "temperature": self.temperature}
+
+    def _record_usage(self, response, model: Optional[str] = None) -> Dict:
+        """
+        Normalise response.usage into input/output/cached token counts and add it to the running totals.
+        input_tokens includes cached tokens; cached_tokens are prompt cache hits, cache_write_tokens are
+        tokens written to the Anthropic prompt cache.
+        """
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return {}
+        return self._add_usage(self._usage_record(usage), model)
+
+    def _usage_record(self, usage) -> Dict:
+        if self.provider == "anthropic":
+            cached_tokens = usage_value(usage, "cache_read_input_tokens") or 0
+            cache_write_tokens = usage_value(usage, "cache_creation_input_tokens") or 0
+            return {
+                "input_tokens": (usage_value(usage, "input_tokens") or 0) + cached_tokens + cache_write_tokens,
+                "output_tokens": usage_value(usage, "output_tokens") or 0,
+                "cached_tokens": cached_tokens,
+                "cache_write_tokens": cache_write_tokens
+            }
+
+        # Chat Completions report prompt/completion tokens, the Responses API (multimodal) input/output tokens
+        details = usage_value(usage, "prompt_tokens_details") or usage_value(usage, "input_tokens_details")
+        return {
+            "input_tokens": usage_value(usage, "prompt_tokens") or usage_value(usage, "input_tokens") or 0,
+            "output_tokens": usage_value(usage, "completion_tokens") or usage_value(usage, "output_tokens") or 0,
+            "cached_tokens": (usage_value(details, "cached_tokens") or 0) if details else 0,
+            "cache_write_tokens": 0
+        }
+
+    def record_batch_usage(self, usage, agent_id: Optional[int] = None) -> Dict:
+        """
+        Record the usage of one batch result like that of a direct request, for the totals, the usage listeners
+        (cost ledger, budget guard) and telemetry. The call context is marked batch=True so it is priced at the
+        batch discount; its telemetry outcome is "batch", which keeps it out of the latency percentiles.
+        """
+        if not usage:
+            return {}
+        with self.call_context(agent_id=agent_id, batch=True), self._telemetry_call("batch") as call:
+            if call is not None:
+                call["outcome"] = "batch"
+            return self._add_usage(self._usage_record(usage))
+
+    def _add_usage(self, record: Dict, model: Optional[str] = None) -> Dict:
+        """model is the model the request was sent to, when it can differ from self.model (hedge or downgrade)."""
+        scope = _usage_scope.get()
+        call = _current_call.get()
+        with self._usage_lock:
+            for key, value in record.items():
+                self.usage_totals[key] += value
+                if scope is not None:
+                    scope[key] += value
+        if call is not None:
+            for key, value in record.items():
+                call[key] += value
+        for listener in list(self._usage_listeners):
+            try:
+                listener(model or self.model, record, _call_context.get())
+            except Exception as e:
+                self.logger.warning(f"Usage listener failed: {str(e)}")
+
+        self.logger.info(f"Prompt cache: {record['cached_tokens']} of {record['input_tokens']} input tokens cached")
+        return record
+
+    def add_usage_listener(self, callback: Callable) -> None:
+        """callback(model, usage_record, call_context) is called with the usage of every response."""
+        with self._usage_lock:
+            self._usage_listeners.append(callback)
+
+    def remove_usage_listener(self, callback: Callable) -> None:
+        with self._usage_lock:
+            if callback in self._usage_listeners:
+                self._usage_listeners.remove(callback)
+
+    def get_usage(self) -> Dict:
+        """Copy of the token totals recorded so far, including prompt cache hits and misses."""
+        with self._usage_lock:
+            totals = dict(self.usage_totals)
+        totals["cache_miss_tokens"] = totals["input_tokens"] - totals["cached_tokens"]
+        return totals
+
+    def _estimate_tokens(self, messages: List[Dict], max_tokens: int) -> int:
+        """
+        Tokens pre-charged against the TPM budget: the tiktoken count of the prompt plus the output allowance.
+        The prompt is counted line by line with the counts of lines seen before cached, so the instructions and
+        questionnaire shared by every request are encoded once instead of per request. The sum can differ from
+        encoding the whole prompt by a few tokens, which the rate limiter reconciles with the actual usage.
+        """
+        total = max_tokens
+        for message in messages:
+            content = message["content"]
+            for text in [content] if isinstance(content, str) else [block.get("text", "") for block in content]:
+                lines = text.split("\n")
+                total += sum(self._line_tokens(line) for line in lines) + len(lines) - 1
+        return total
+
+    def _count_tokens(self, text: str) -> int:
+        try:
+            from Module.ExecutionModule.smart_model_matcher import get_openai_encoding_for_model
+            return len(get_openai_encoding_for_model(self.model).encode(text))
+        except Exception:
+            return len(text) // 4
+
+    def _completions_api(self, client):
+        return client.messages if self.provider == "anthropic" else client.chat.completions
+
+    def _finish_request(self, raw_response, estimated: int, model: Optional[str] = None, rate_limiter=None):
+        rate_limiter = rate_limiter or self.rate_limiter
+        rate_limiter.update_from_headers(raw_response.headers)
+        response = raw_response.parse()
+        usage = self._record_usage(response, model)
+        rate_limiter.reconcile(estimated, usage.get("input_tokens", 0) + usage.get("output_tokens", 0) if usage else estimated)
+        return response
+
+    def _rate_limited(self, error, estimated: int, attempt: int, rate_limiter=None):
+        """Refund a rejected request and pause the shared limiter, re-raising once the retries are used up."""
+        rate_limiter = rate_limiter or self.rate_limiter
+        rate_limiter.reconcile(estimated, 0)
+        if attempt >= self.rate_limit_retries:
+            raise error
+        wait = rate_limiter.back_off(getattr(getattr(error, "response", None), "headers", None), attempt)
+        self.logger.warning(f"Rate limited by {self.provider} (attempt {attempt + 1}), retrying in {wait:.1f}s")
+
+    def _complete(self, messages: List[Dict], max_tokens: int):
+        """Send one request, paced by the shared rate limiter and retried on 429 responses."""
+        request = self._build_request(messages, max_tokens)
+        api = self._completions_api(self.client)
+        if self.rate_limiter is None:
+            self._acquire(0)
+            response = api.create(**request)
+            self._record_usage(response, request["model"])
+            return response
+
+        estimated = self._estimate_tokens(messages, max_tokens)
+        attempt = 0
+        while True:
+            self._acquire(estimated)
+            try:
+                return self._finish_request(api.with_raw_response.create(**request), estimated, request["model"])
+            except RATE_LIMIT_ERRORS as e:
+                self._rate_limited(e, estimated, attempt)
+                attempt += 1
+
+    async def _acomplete(self, messages: List[Dict], max_tokens: int):
+        if self.hedging is None:
+            return await self._acomplete_once(messages, max_tokens)
+        return await self._acomplete_hedged(messages, max_tokens)
+
+    async def _acomplete_once(self, messages: List[Dict], max_tokens: int, latency_key=None, hedge: bool = False):
+        request = self._build_request(messages, max_tokens)
+        if hedge and self.hedge_endpoint["model"]:
+            request["model"] = self.hedge_endpoint["model"]
+        api = self._completions_api(self.hedge_async_client if hedge else self.async_client)
+        rate_limiter = self._hedge_rate_limiter() if hedge else self.rate_limiter
+        if rate_limiter is None:
+            await self._acquire_async(0)
+            started = time.monotonic()
+            try:
+                response = await api.create(**request)
+            except asyncio.CancelledError:
+                self._cancelled_in_flight(messages, request["model"], latency_key, started, hedge)
+                raise
+            self._observe_latency(latency_key, started)
+            self._record_usage(response, request["model"])
+            return response
+
+        estimated = self._estimate_tokens(messages, max_tokens)
+        attempt = 0
+        while True:
+            await self._acquire_async(estimated, rate_limiter)
+            started = time.monotonic()
+            try:
+                raw_response = await api.with_raw_response.create(**request)
+                self._observe_latency(latency_key, started)
+                return self._finish_request(raw_response, estimated, request["model"], rate_limiter)
+            except RATE_LIMIT_ERRORS as e:
+                self._rate_limited(e, estimated, attempt, rate_limiter)
+                attempt += 1
+            except asyncio.CancelledError:
+                billed = self._cancelled_in_flight(messages, request["model"], latency_key, started, hedge)
+                # Return the output allowance pre-charged for a response that will not come
+                rate_limiter.reconcile(estimated, billed)
+                raise
+
+    def _hedge_rate_limiter(self):
+        """The shared limiter of the hedge endpoint and model, which is the primary's when neither differs."""
+        if self.rate_limiter is None:
+            return None
+        return get_rate_limiter(
+            self.provider, self.hedge_endpoint["base_url"], self.hedge_endpoint["model"] or self.model, *self.rate_limit_settings
+        )
+
+    def _observe_latency(self, latency_key, started: float):
+        if latency_key is not None:
+            self.hedging.observe(latency_key, time.monotonic() - started)
+
+    def _cancelled_in_flight(self, messages: List[Dict], model: str, latency_key, started: float, hedge: bool) -> int:
+        """
+        Account for a request cancelled after it was sent, e.g. the losing side of a hedge. The provider still bills
+        the prompt, so its estimated input tokens are recorded as usage (output generated before the cancel is not
+        reported and is left out). For a cancelled primary the time it had been running is observed as its latency:
+        the real latency is at least that long, and leaving slow primaries out would pull the hedge threshold down.
+        Returns the billed tokens.
+        """
+        if not hedge:
+            self._observe_latency(latency_key, started)
+        self.logger.info(f"Request to {model} cancelled in flight, billing its estimated prompt tokens")
+        billed = self._estimate_tokens(messages, 0)
+        self._add_usage({"input_tokens": billed, "output_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0}, model)
+        return billed
+
+    async def _acomplete_hedged(self, messages: List[Dict], max_tokens: int):
+        """
+        Send the request and, if it is still running after the policy's latency threshold, a duplicate to the hedge
+        endpoint. The first successful response wins and the other request is cancelled; the cancelled request's
+        prompt is still billed (see _cancelled_in_flight).
+        """
+        latency_key = self.hedging.key(self.model, self._estimate_tokens(messages, max_tokens))
+        delay = self.hedging.threshold(latency_key)
+        tasks = {asyncio.ensure_future(self._acomplete_once(messages, max_tokens, latency_key))}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.hedging.allow_hedge():
+                    self.logger.info(f"Request still running after {delay:.1f}s, sending a hedge request")
+                    tasks.add(asyncio.ensure_future(self._acomplete_once(messages, max_tokens, latency_key, hedge=True)))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @contextmanager
+    def track_usage(self):
+        """
+        Collect the usage of every request made in this context (including asyncio tasks and threads started from it)
+        into a separate totals dict, so concurrent executions sharing the client can each report their own usage.
+        """
+        totals = {"input_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0}
+        token = _usage_scope.set(totals)
+        try:
+            yield totals
+        finally:
+            _usage_scope.reset(token)
+
+    def _response_text(self, response) -> str:
+        if self.provider == "anthropic":
+            return response.content[0].text
+        return response.choices[0].message.content
+
+    @recorded_call("generate")
     def generate(self,
                 prompt: str,
                 system_prompt: Optional[str] = None,
-                force_max_tokens: Optional[int] = None) -> str:
+                force_max_tokens: Optional[int] = None,
+                cache_prefix: Optional[str] = None) -> str:
         try:
             if force_max_tokens is not None:
                 self.max_tokens = force_max_tokens
 
-            messages = [{"role": "user", "content": prompt}]
+            cache_key = self._cache_key(prompt, system_prompt, cache_prefix, self.max_tokens)
+            cached = self._cached_response(cache_key)
+            if cached is not None:
+                return cached
 
-            if system_prompt:
-                messages.insert(0, {"role": "user" if self.provider=="anthropic" else "system", "content": system_prompt})
+            messages = self._build_messages(prompt, system_prompt, cache_prefix)
 
             self.logger.info(f"Sending request to {self.provider} with {len(messages)} messages")
             self.logger.info(f"Message sent: {messages}")
 
-            if self.provider == "anthropic":
-                response = self.client.messages.create(
-                    model=self.model,
-                    messages=messages,
-                    max_tokens=self.max_tokens,
-                    temperature=self.temperature
-                )
-                response_text = response.content[0].text
-                self.logger.info(f"Response: {response_text}")
-                cleaned_response = self._extract_json_from_response(response_text)
-                return cleaned_response
-
-            elif self.provider == "openai":
-                if "gpt-5" in self.model:
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages,
-                        max_completion_tokens=self.max_tokens
-                    )
-                else:
-                    response = self.client.chat.completions.create(
-                        model=self.model,
-                        messages=messages,
-                        max_tokens=self.max_tokens,
-                        temperature=self.temperature
-                    )
-                response_text = response.choices[0].message.content
-
-                self.logger.info(f"Response: {response_text}")
-                # Extract JSON from response if it contains extra text
-                cleaned_response = self._extract_json_from_response(response_text)
-
-                return cleaned_response
+            response = self._complete(messages, self.max_tokens)
+            response_text = self._response_text(response)
+            self.logger.info(f"Response: {response_text}")
+            # Extract JSON from response if it contains extra text
+            response_text = self._extract_json_from_response(response_text)
+            self._hold_response(cache_key, response_text)
+            return response_text
 
         except Exception as e:
             self.logger.error(f"Error generating response: {str(e)}")
             raise
 
+    @recorded_call("agenerate")
+    async def agenerate(self,
+                prompt: str,
+                system_prompt: Optional[str] = None,
+                force_max_tokens: Optional[int] = None,
+                cache_prefix: Optional[str] = None) -> str:
+        """
+        Asynchronous version of generate. Unlike generate, force_max_tokens only applies to this call,
+        since many requests share the client concurrently.
+        """
+        try:
+            max_tokens = force_max_tokens if force_max_tokens is not None else self.max_tokens
+            cache_key = self._cache_key(prompt, system_prompt, cache_prefix, max_tokens)
+            cached = await self._acached_response(cache_key)
+            if cached is not None:
+                return cached
+
+            messages = self._build_messages(prompt, system_prompt, cache_prefix)
+
+            self.logger.info(f"Sending async request to {self.provider} with {len(messages)} messages")
+            self.logger.info(f"Message sent: {messages}")
+
+            response = await self._acomplete(messages, max_tokens)
+            response_text = self._response_text(response)
+            self.logger.info(f"Response: {response_text}")
+            response_text = self._extract_json_from_response(response_text)
+            self._hold_response(cache_key, response_text)
+            return response_text
+
+        except Exception as e:
+            self.logger.error(f"Error generating async response: {str(e)}")
+            raise
+
+    @recorded_call("stream")
+    async def astream_generate(self,
+                prompt: str,
+                system_prompt: Optional[str] = None,
+                force_max_tokens: Optional[int] = None,
+                cache_prefix: Optional[str] = None,
+                expected_keys: Optional[List] = None,
+                on_answer: Optional[Callable] = None) -> str:
+        """
+        Streaming version of agenerate. The JSON object is parsed as tokens arrive and on_answer(key, value) is called
+        for each top-level key once its value is complete. When every expected key is present and the object has
+        closed, the stream is cancelled instead of letting the model continue up to max_tokens.
+        """
+        try:
+            max_tokens = force_max_tokens if force_max_tokens is not None else self.max_tokens
+            cache_key = self._cache_key(prompt, system_prompt, cache_prefix, max_tokens)
+            cached = await self._acached_response(cache_key)
+            if cached is not None:
+                if on_answer:
+                    for key, value in IncrementalJSONObjectParser().feed(cached):
+                        on_answer(key, value)
+                return cached
+
+            messages = self._build_messages(prompt, system_prompt, cache_prefix)
+            request = self._build_request(messages, max_tokens)
+            estimated = self._estimate_tokens(messages, max_tokens)
+
+            self.logger.info(f"Sending streaming request to {self.provider} with {len(messages)} messages")
+            self.logger.info(f"Message sent: {messages}")
+
+            attempt = 0
+            while True:
+                await self._acquire_async(estimated)
+                parser = IncrementalJSONObjectParser()
+                try:
+                    usage, cancelled = await self._astream(request, parser, expected_keys, on_answer)
+                    break
+                except RATE_LIMIT_ERRORS as e:
+                    if self.rate_limiter is None or parser.buffer:
+                        raise
+                    self._rate_limited(e, estimated, attempt)
+                    attempt += 1
+
+            if usage is None:
+                # A cancelled stream never reports usage, so count what was sent and received
+                usage = self._add_usage({
+                    "input_tokens": estimated - max_tokens,
+                    "output_tokens": self._count_tokens(parser.buffer),
+                    "cached_tokens": 0,
+                    "cache_write_tokens": 0
+                }, request["model"])
+            if self.rate_limiter is not None:
+                self.rate_limiter.reconcile(estimated, usage["input_tokens"] + usage["output_tokens"])
+
+            response_text = parser.text()
+            self.logger.info(f"Response{' (stream cancelled early)' if cancelled else ''}: {response_text}")
+            response_text = self._extract_json_from_response(response_text)
+            self._hold_response(cache_key, response_text)
+            return response_text
+
+        except Exception as e:
+            self.logger.error(f"Error generating streamed response: {str(e)}")
+            raise
+
+    async def _astream(self, request: Dict, parser: IncrementalJSONObjectParser, expected_keys, on_answer):
+        """Feed the streamed text into parser. Returns (usage or None, whether the stream was cancelled early)."""
+        def consume(text):
+            for key, value in parser.feed(text):
+                if on_answer:
+                    on_answer(key, value)
+            return parser.closed and (expected_keys is None or parser.has_keys(expected_keys))
+
+        if self.provider == "anthropic":
+            async with self.async_client.messages.stream(**request) as stream:
+                async for text in stream.text_stream:
+                    if consume(text):
+                        return None, True
+                return self._record_usage(await stream.get_final_message(), request["model"]), False
+
+        stream = await self.async_client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = self._record_usage(chunk, request["model"])
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if consume(chunk.choices[0].delta.content):
+                        return None, True
+        finally:
+            await stream.close()
+        return usage, False
+
     def _extract_json_from_response(self, response_text: str) -> str:
         """
         Extract JSON content from LLM response that may contain additional explanatory text.
@@ -158,10 +1148,61 @@ class LLMClient:
         self.logger.warning("Could not extract valid JSON from response, returning original text")
         return response_text
 
+    def _upload_file(self, file_path: str) -> str:
+        """Upload a PDF to the provider's file API and return its file id."""
+        if self.provider == "openai":
+            with open(file_path, "rb") as f:
+                file = self.client.files.create(file=f, purpose="user_data")
+        else:
+            with open(file_path, "rb") as f:
+                file = self.client.beta.files.upload(file=(os.path.basename(f.name), f, "application/pdf"))
+        self.logger.info(f"Uploaded {os.path.basename(file_path)} as file {file.id}")
+        return file.id
+
+    def _delete_file(self, file_id: str) -> None:
+        if self.provider == "openai":
+            self.client.files.delete(file_id)
+        else:
+            self.client.beta.files.delete(file_id)
+
+    def _survey_file_id(self, file_path: str):
+        """
+        File id for file_path, reusing an earlier upload of the same content when the registry has one.
+        Returns (file_id, digest); digest is None when the registry is disabled.
+        """
+        if self.file_registry is None:
+            return self._upload_file(file_path), None
+
+        digest = self.file_registry.digest(file_path)
+        file_id = self.file_registry.get(self.provider, self.base_url, self.file_account, digest)
+        if file_id is not None:
+            return file_id, digest
+
+        # Concurrent agents asking for the same file wait for one upload instead of each uploading it
+        with self._upload_lock:
+            file_id = self.file_registry.get(self.provider, self.base_url, self.file_account, digest)
+            if file_id is None:
+                self._cleanup_expired_uploads()
+                file_id = self._upload_file(file_path)
+                self.file_registry.set(self.provider, self.base_url, self.file_account, digest, file_id, os.path.basename(file_path))
+        return file_id, digest
+
+    def _cleanup_expired_uploads(self) -> None:
+        for _, file_id in self.file_registry.pop_expired(self.provider, self.base_url, self.file_account):
+            if not self.delete_expired_uploads:
+                continue
+            try:
+                self._delete_file(file_id)
+                self.logger.info(f"Deleted expired uploaded file {file_id}")
+            except Exception as e:
+                self.logger.warning(f"Could not delete expired uploaded file {file_id}: {str(e)}")
+
+    @recorded_call("multimodal")
     def generate_multimodal(self, file_path: str, prompt: str, system_prompt: Optional[str] = None,) -> str:
         """
-        Upload a file to OpenAI and generate a response using multimodal processing.
-        This method is used for surveys containing images, where the LLM needs to analyze both text and images.
+        Generate a response from an uploaded file and a prompt, for surveys containing images where the LLM needs
+        to analyze both text and images. The file is uploaded once and its file id reused through the file registry;
+        if the provider no longer knows a registered id, the file is uploaded again.
         NOTE ONLY PDF files are supported for multimodal processing.
         """
 
@@ -169,82 +1210,82 @@ class LLMClient:
             raise ValueError("Only PDF files are supported for multimodal processing.")
 
         try:
-            # upload the file to OpenAI
-            if self.provider == "openai":
-                file = self.client.files.create(
-                    file=open(file_path, "rb"),
-                    purpose="user_data",
-                )
-
-                messages = [
+            file_id, digest = self._survey_file_id(file_path)
+            try:
+                response_text = self._generate_with_file(file_id, prompt, system_prompt)
+            except FILE_NOT_FOUND_ERRORS:
+                if digest is None:
+                    raise
+                self.logger.warning(f"Uploaded file {file_id} is no longer available, uploading it again")
+                self.file_registry.remove(self.provider, self.base_url, self.file_account, digest)
+                file_id, digest = self._survey_file_id(file_path)
+                response_text = self._generate_with_file(file_id, prompt, system_prompt)
+
+            self.logger.info("Successfully generated multimodal response...")
+            self.logger.info(f"Response: {response_text}")
+            # Extract JSON from response if it contains extra text
+            return self._extract_json_from_response(response_text)
+
+        except Exception as e:
+            self.logger.error(f"Error in multimodal processing: {str(e)}")
+            raise
+
+    def _generate_with_file(self, file_id: str, prompt: str, system_prompt: Optional[str] = None) -> str:
+        model = self.model
+        if self.provider == "openai":
+            messages = [
+                {
+                    "role": "user",
+                    "content": [
                         {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "input_file",
-                                    "file_id": file.id,
-                                },
-                                {
-                                    "type": "input_text",
-                                    "text": prompt,
-                                },
-                            ],
+                            "type": "input_file",
+                            "file_id": file_id,
                         },
-                    ]
-
-                if system_prompt:
-                    messages.insert(0, {"role": "user", "content": system_prompt})
-
-                # Call the OpenAI multimodal API
-                response = self.client.responses.create(
-                    model=self.model,
-                    input=messages
-                )
-
-                self.logger.info("Successfully generated multimodal response...")
-                self.logger.info(f"Response: {response.output_text}")
-                # Extract JSON from response if it contains extra text
-                cleaned_response = self._extract_json_from_response(response.output_text)
-                return cleaned_response
-            else:
-                 with open(file_path, "rb") as f:
-                    file=self.client.beta.files.upload(file=(os.path.basename(f.name), f, "application/pdf"))
-
-                 messages = [
                         {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "document",
-                                    "source": {
-                                        "type": "file",
-                                        "file_id": file.id
-                                    }
-                                },
-                                {
-                                    "type": "text",
-                                    "text": prompt,
-                                },
-                            ],
+                            "type": "input_text",
+                            "text": prompt,
                         },
-                    ]
+                    ],
+                },
+            ]
 
-                 if system_prompt:
-                    messages.insert(0, {"role": "user", "content": system_prompt})
+            if system_prompt:
+                messages.insert(0, {"role": "user", "content": system_prompt})
 
-                 response = self.client.beta.messages.create(
-                    betas=["files-api-2025-04-14"],
-                    model=self.model,
-                    max_tokens=self.max_tokens,
-                    messages=messages,)
-                 self.logger.info("Successfully generated multimodal response...")
-                 response_text = response.content[0].text
-                 self.logger.info(f"Response: {response_text}")
-                 # Extract JSON from response if it contains extra text
-                 cleaned_response = self._extract_json_from_response(response_text)
+            # Call the OpenAI multimodal API
+            response = self.client.responses.create(
+                model=model,
+                input=messages
+            )
+            self._record_usage(response, model)
+            return response.output_text
 
-                 return cleaned_response
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "document",
+                        "source": {
+                            "type": "file",
+                            "file_id": file_id
+                        }
+                    },
+                    {
+                        "type": "text",
+                        "text": prompt,
+                    },
+                ],
+            },
+        ]
 
-        except Exception as e:
-            self.logger.error(f"Error in multimodal processing: {str(e)}")
-            raise
+        if system_prompt:
+            messages.insert(0, {"role": "user", "content": system_prompt})
+
+        response = self.client.beta.messages.create(
+            betas=["files-api-2025-04-14"],
+            model=model,
+            max_tokens=self.max_tokens,
+            messages=messages,)
+        self._record_usage(response, model)
+        return response.content[0].text
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from UtilityFunctions import background_flush
+
+# Pending writes (new responses or last_access updates) that trigger a flush before the background interval
+FLUSH_SIZE = 500
+
+
+class ResponseCache:
+    """
+    Content-addressed on-disk cache of LLM responses, stored in a single SQLite file.
+    Entries are keyed by a hash of everything that determines the response (provider, model, sampling
+    parameters and prompts) and evicted least-recently-used first once the cache grows past max_size_mb.
+    New responses and the access times of hits are kept in memory and written in batches by the background flush,
+    so callers on the event loop never wait for a commit.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 512):
+        self.path = path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        # key -> last access time not yet written
+        self._touched = {}
+        # key -> (response, created_at) not yet written
+        self._pending = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._connection.commit()
+        self._total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        background_flush.register(self)
+
+    @staticmethod
+    def make_key(provider: str, model: str, temperature, max_tokens, system_prompt: Optional[str], prompt: str, cache_prefix: Optional[str] = None, scope: Optional[dict] = None) -> str:
+        """scope (e.g. the execution and agent a request is made for) keeps otherwise identical requests apart."""
+        payload = json.dumps({
+            "scope": scope or {},
+            "provider": provider,
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "system_prompt": system_prompt,
+            "cache_prefix": cache_prefix,
+            "prompt": prompt
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key][0]
+            row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._touched[key] = time.time()
+            pending = len(self._touched)
+        if pending >= FLUSH_SIZE:
+            background_flush.wake()
+        return row[0]
+
+    def flush(self) -> None:
+        """Write the pending responses and access times in one transaction."""
+        with self._lock:
+            if self._pending or self._touched:
+                self._write_pending()
+                self._write_touched()
+                self._connection.commit()
+
+    def _write_touched(self) -> None:
+        self._connection.executemany(
+            "UPDATE responses SET last_access = ? WHERE key = ?",
+            [(accessed, key) for key, accessed in self._touched.items()]
+        )
+        self._touched.clear()
+
+    def set(self, key: str, response: str) -> None:
+        with self._lock:
+            self._pending[key] = (response, time.time())
+            pending = len(self._pending)
+        if pending >= FLUSH_SIZE:
+            background_flush.wake()
+
+    def _write_pending(self) -> None:
+        for key, (response, created_at) in self._pending.items():
+            size = len(response.encode("utf-8"))
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, created_at, created_at)
+            )
+            self._total_size += size - (previous[0] if previous else 0)
+        self._pending.clear()
+        if self._total_size > self.max_size:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the cache is back under 90% of its size limit."""
+        # Eviction order depends on access times, so write the pending ones first
+        self._write_touched()
+        # Other processes may share the file, so start from the real size rather than the running total
+        self._total_size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = int(self.max_size * 0.9)
+
+        for key, size in self._connection.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall():
+            if self._total_size <= target:
+                break
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_size -= size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+            self._touched.clear()
+            self._pending.clear()
+            self._total_size = 0
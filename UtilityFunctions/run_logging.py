@@ -0,0 +1,44 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Union
+
+DEFAULT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_lock = threading.Lock()
+_console_handler = None
+# Current file handler per logger (Config.config -> processor.log, UtilityFunctions.llm_client -> llm_client.log)
+_file_handlers = {}
+
+
+def setup_run_logging(log_file: Union[str, Path], logger_name: str, level: str = "INFO", fmt: str = DEFAULT_FORMAT) -> None:
+    """
+    Log everything to the console and the messages of logger_name to log_file. The console handler is installed
+    once per process on the root logger; each named logger has one file handler at a time, so loading the config
+    for a new run moves its log to the new run directory instead of stacking handlers (logging.basicConfig is a
+    no-op after the first call).
+    """
+    global _console_handler
+    log_file = Path(log_file)
+    formatter = logging.Formatter(fmt)
+    root = logging.getLogger()
+    logger = logging.getLogger(logger_name)
+
+    with _lock:
+        root.setLevel(getattr(logging, level, logging.INFO))
+        if _console_handler is None:
+            _console_handler = logging.StreamHandler()
+            _console_handler.setFormatter(formatter)
+            root.addHandler(_console_handler)
+
+        current = _file_handlers.get(logger_name)
+        if current is not None:
+            if current.baseFilename == str(log_file.resolve()):
+                return
+            logger.removeHandler(current)
+            current.close()
+
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+        _file_handlers[logger_name] = handler
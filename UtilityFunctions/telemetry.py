@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from UtilityFunctions import background_flush
+
+# Columns of one recorded LLM call, in table order
+CALL_FIELDS = (
+    "started_at", "execution", "agent_id", "segment", "provider", "model", "kind", "outcome", "attempts",
+    "queue_seconds", "latency_seconds", "total_seconds",
+    "input_tokens", "output_tokens", "cached_tokens", "cache_write_tokens", "error"
+)
+
+PERCENTILES = (50, 95, 99)
+
+# Queued calls that trigger a write before the background flush interval
+FLUSH_SIZE = 200
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an ascending list, or None when it is empty."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class TelemetryStore:
+    """
+    Per-run record of every LLM call: timing split into time waiting for the rate limiter (queue) and time
+    in flight (latency), token usage, model, the agent and segment it was made for, and its outcome.
+    Stored in a SQLite file in the run directory, so worker processes of the same run add to one store.
+    Calls are queued in memory and inserted in batches by the background flush, so recording a call never
+    waits for a disk commit; reads flush the queue first.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._closed = False
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS calls ("
+            "id INTEGER PRIMARY KEY, started_at REAL NOT NULL, execution TEXT, agent_id INTEGER, segment INTEGER, "
+            "provider TEXT, model TEXT, kind TEXT, outcome TEXT, attempts INTEGER, "
+            "queue_seconds REAL, latency_seconds REAL, total_seconds REAL, "
+            "input_tokens INTEGER, output_tokens INTEGER, cached_tokens INTEGER, cache_write_tokens INTEGER, error TEXT)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS calls_execution ON calls (execution)")
+        self._connection.commit()
+        background_flush.register(self)
+
+    def record(self, call: Dict) -> None:
+        row = tuple(call.get(field) for field in CALL_FIELDS)
+        with self._pending_lock:
+            self._pending.append(row)
+            pending = len(self._pending)
+        if pending >= FLUSH_SIZE:
+            background_flush.wake()
+
+    def flush(self) -> None:
+        """Insert the queued calls in one transaction."""
+        with self._pending_lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        with self._lock:
+            if self._closed:
+                return
+            self._connection.executemany(
+                f"INSERT INTO calls ({', '.join(CALL_FIELDS)}) VALUES ({', '.join('?' * len(CALL_FIELDS))})",
+                rows
+            )
+            self._connection.commit()
+
+    def calls(self, execution: Optional[str] = None) -> List[Dict]:
+        self.flush()
+        query = f"SELECT {', '.join(CALL_FIELDS)} FROM calls"
+        parameters = ()
+        if execution is not None:
+            query += " WHERE execution = ?"
+            parameters = (execution,)
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY id", parameters).fetchall()
+        return [dict(zip(CALL_FIELDS, row)) for row in rows]
+
+    def summary(self, execution: Optional[str] = None) -> Dict:
+        """Percentile summary of all recorded calls (or those of one execution), overall and per model."""
+        calls = self.calls(execution)
+        models = sorted({call["model"] for call in calls if call["model"]})
+        return {
+            "execution": execution,
+            **self._summarize(calls),
+            "models": {model: self._summarize([call for call in calls if call["model"] == model]) for model in models}
+        }
+
+    @staticmethod
+    def _summarize(calls: List[Dict]) -> Dict:
+        outcomes = {}
+        for call in calls:
+            outcomes[call["outcome"]] = outcomes.get(call["outcome"], 0) + 1
+
+        # Cache hits and failed calls never reached the provider, so they would skew the timing percentiles
+        sent = [call for call in calls if call["outcome"] == "ok"]
+        timings = {}
+        for field in ("queue_seconds", "latency_seconds", "total_seconds"):
+            values = sorted(call[field] for call in sent if call[field] is not None)
+            timings[field] = {f"p{q}": percentile(values, q) for q in PERCENTILES}
+            timings[field]["mean"] = sum(values) / len(values) if values else None
+
+        tokens = {field: sum(call[field] or 0 for call in calls) for field in ("input_tokens", "output_tokens", "cached_tokens", "cache_write_tokens")}
+        agent_tokens = {}
+        for call in calls:
+            if call["agent_id"] is not None:
+                key = (call["execution"], call["agent_id"])
+                agent_tokens[key] = agent_tokens.get(key, 0) + (call["input_tokens"] or 0) + (call["output_tokens"] or 0)
+        per_agent = sorted(agent_tokens.values())
+
+        return {
+            "calls": len(calls),
+            "outcomes": outcomes,
+            "retries": sum(max((call["attempts"] or 1) - 1, 0) for call in calls),
+            **timings,
+            "tokens": tokens,
+            "tokens_per_agent": {
+                "agents": len(per_agent),
+                "mean": sum(per_agent) / len(per_agent) if per_agent else None,
+                **{f"p{q}": percentile(per_agent, q) for q in PERCENTILES}
+            }
+        }
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._closed = True
+            self._connection.close()
@@ -1,15 +1,22 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
 import os
 from werkzeug.utils import secure_filename
 import json
+import queue
 from datetime import datetime
 from pathlib import Path
 import Module.PreprocessingModule.flow
 import Module.SampleGenerationModule.flow
 import Module.ExecutionModule.flow
 from Module.ExecutionModule.cost_estimation import cost_estimation
+from Module.ExecutionModule.compiled_survey import get_compiled_survey
 from Module.ExecutionModule.format_questionnaire import add_few_shot_learning
 from Module.ExecutionModule.iterator import ExecutionState
+from Module.ExecutionModule.progress import progress_bus, get_progress, all_progress
+from Module.ExecutionModule.jobs import job_runner, SUCCEEDED, STOPPED
+from Module.ExecutionModule.cost_ledger import current_cost_ledger, COST_LEDGER_FILE
+from Module.ExecutionModule.budget_guard import current_budget_guard
+from Module.ExecutionModule.execution_plan import get_deduplication_settings, build_execution_plan
 from UtilityFunctions import json_processing
 from Config.config import load_config, load
 from shutil import copy2
@@ -24,18 +31,38 @@ class ConfigManager:
         self._current_config_set = None
         self._current_filename = None
         self._current_processing_mode = 'text'  # Default to 'text'
+        # Kept across files so a new config set reuses the client (and its cache, rate limits and connections)
+        self._llm_client = None
 
     def set_current_file(self, filename):
         self._current_filename = filename
-        self._current_config = None  # Clear cached config
+        self._current_config = None  # Clear cached config; the LLM client is kept for the next config set
         self._current_config_set = None
         self._current_processing_mode = 'text' # Reset on new file
 
     def get_config_set(self):
         if self._current_config_set is None:
-            self._current_config_set = load_config(CONFIG_FILE)
+            self._load_config_set()
         return self._current_config_set
 
+    def open_run(self, run_name):
+        """
+        Reopen an existing run directory (a folder name under output.base_dir) instead of creating a new one,
+        e.g. to resume its executions after the app was restarted. Returns False if there is no such run.
+        """
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+            run_dir = Path(json.load(f)['output']['base_dir']) / secure_filename(run_name or '')
+        if not run_name or secure_filename(run_name) != run_name or not run_dir.is_dir():
+            return False
+        self._load_config_set(run_dir)
+        return True
+
+    def _load_config_set(self, output_dir=None):
+        # A running job still logs and records telemetry through its client, so it is not moved to a new run
+        reusable_client = self._llm_client if job_runner.active_job() is None else None
+        self._current_config_set = load_config(CONFIG_FILE, output_dir, llm_client=reusable_client)
+        self._llm_client = self._current_config_set[1]
+
     def get_output_dir(self):
         return self.get_config_set()[3].output_dir
 
@@ -81,6 +108,7 @@ def cleanup_temp_folder():
 
 
 atexit.register(cleanup_temp_folder)
+atexit.register(job_runner.shutdown)
 
 
 def allowed_file(filename):
@@ -498,9 +526,8 @@ def upload_samples():
         sampled_df = pd.DataFrame({'profile': samples})
         sampled_df.to_csv(output_dir / 'sample_space.csv', index=False)
 
-        sample_space = []
-        for id, sample in enumerate(samples):
-            sample_space.append([id + 1, sample, 1])
+        deduplicate = get_deduplication_settings(config)[0]
+        sample_space = Module.SampleGenerationModule.flow.format_uploaded_sample_space(samples, deduplicate)
 
         sample_space_size = sampled_df.size
         sample_profile_0 = sample_space[0]
@@ -698,7 +725,6 @@ def get_execution_metrics():
 
         # Get question segments
         question_segments_list, _ = Module.PreprocessingModule.flow.preprocess_survey_load(config, processed_data)
-        question_segments = len(question_segments_list) if question_segments_list else 1
 
         # Load sample space
         sampled_df_path = output_dir / 'sample_space.csv'
@@ -712,13 +738,17 @@ def get_execution_metrics():
             return jsonify({'error': 'Sample space is empty'}), 400
 
         # Format sample space
+        deduplicate, samples_per_profile, sampling = get_deduplication_settings(config)
         if not json_processing.get_json_nested_value(config, "user_preference.sample.upload"):
             sample_space, sample_space_size = Module.SampleGenerationModule.flow.format_sample_space(sampled_df)
         else:
-            sample_space = []
             samples = sampled_df.iloc[:, 0].tolist()
-            for id, sample in enumerate(samples):
-                sample_space.append([id + 1, sample, 1])
+            sample_space = Module.SampleGenerationModule.flow.format_uploaded_sample_space(samples, deduplicate)
+            sample_space_size = len(sample_space)
+
+        # In deduplicated mode the agent count is the number of runs in the execution plan
+        if deduplicate:
+            sample_space, _ = build_execution_plan(sample_space, samples_per_profile, sampling)
             sample_space_size = len(sample_space)
 
         if sample_space_size == 0:
@@ -750,6 +780,10 @@ def get_execution_metrics():
         if max_tokens == "not found" or not max_tokens:
             max_tokens = 256
 
+        # Render the questionnaire and its segments once; cost estimation reads the same compiled survey
+        compiled_survey = get_compiled_survey(processed_data, max_tokens, question_segments_list)
+        question_segments = compiled_survey.segment_count
+
         # Calculate metrics
         total_cost = cost_estimation(
             config_set,
@@ -784,20 +818,63 @@ def get_execution_metrics():
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
+@app.route('/api/execution/telemetry')
+def get_execution_telemetry():
+    """Latency, queue time, token and outcome percentiles of the recorded LLM calls, optionally for one execution (?execution=N)."""
+    try:
+        llm_client = config_manager.get_config_set()[1]
+        if llm_client.telemetry is None:
+            return jsonify({'success': False, 'error': 'Telemetry is disabled'}), 404
+
+        execution = request.args.get('execution')
+        if execution is not None and execution.isdigit():
+            execution = f"execution_{execution}"
+        return jsonify({'success': True, **llm_client.telemetry.summary(execution)})
+    except Exception as e:
+        print(f"Error reading telemetry: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/execution/cost')
+def get_execution_cost():
+    """Actual spend of the current run, live while it executes and from cost_ledger.json once it has ended."""
+    try:
+        ledger = current_cost_ledger()
+        if ledger is not None:
+            guard = current_budget_guard()
+            return jsonify({
+                'success': True,
+                'live': job_runner.active_job() is not None,
+                **ledger.snapshot(),
+                'budget': guard.snapshot() if guard is not None else None
+            })
+
+        ledger_file = config_manager.get_config_set()[3].output_dir / COST_LEDGER_FILE
+        if not ledger_file.exists():
+            return jsonify({'success': False, 'error': 'No execution has been run yet'}), 404
+        with open(ledger_file, 'r', encoding='utf-8') as f:
+            return jsonify({'success': True, 'live': False, **json.load(f)})
+    except Exception as e:
+        print(f"Error reading cost ledger: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/execution/start', methods=['POST'])
 def start_execution():
     try:
         # Get multi_modal setting from the in-memory config manager
         stored_mode = config_manager.get_processing_mode()
         multi_modal = request.json.get('multi_modal', stored_mode == 'multimodal')
+        # Resume continues the current executions from their journals instead of starting over.
+        # After a restart, 'run' names the earlier run directory to reopen and resume.
+        resume = request.json.get('resume', False)
+        run_name = request.json.get('run')
+        if resume and run_name and job_runner.active_job() is None and not config_manager.open_run(run_name):
+            return jsonify({'success': False, 'error': f'Run {run_name} not found'}), 404
 
         config_set = config_manager.get_config_set()
         config = config_set[0]
         output_dir = config_set[3].output_dir
-        # Reset stop related things
-        ExecutionState.reset()
-        with open(output_dir / "stop.json", 'w') as f:
-            json.dump({'stopped': False}, f)
 
         # Load necessary data
         with open(output_dir / 'processed_survey.json', 'r', encoding='utf-8') as f:
@@ -811,10 +888,10 @@ def start_execution():
         if not json_processing.get_json_nested_value(config, "user_preference.sample.upload"):
             sample_space, sample_space_size = Module.SampleGenerationModule.flow.format_sample_space(sampled_df)
         else:
-            sample_space = []
             samples = sampled_df.iloc[:, 0].tolist()
-            for id, sample in enumerate(samples):
-                sample_space.append([id + 1, sample, 1])
+            sample_space = Module.SampleGenerationModule.flow.format_uploaded_sample_space(
+                samples, get_deduplication_settings(config)[0]
+            )
 
         if not json_processing.get_json_nested_value(config, "user_preference.sample.upload"):
             with open(output_dir / "sample_dimensions.json", 'r') as file:
@@ -833,8 +910,7 @@ def start_execution():
         upload_mode = json_processing.get_json_nested_value(config, "user_preference.sample.upload")
         print(f"Execution settings - order: {execution_order}, segmentation: {segmentation}, upload: {upload_mode}")
 
-
-        try:
+        def run_execution():
             print("Starting questionnaire execution with parameters:")
             print(f"- Output dir: {output_dir}")
             print(f"- Sample space size: {len(sample_space)}")
@@ -851,10 +927,11 @@ def start_execution():
                 sample_dimensions,
                 segmentation,
                 upload_mode,
-                multi_modal
+                multi_modal,
+                resume
             )
             if ExecutionState.get_stop():
-                return jsonify({'success': True, 'stopped': True}), 200
+                return answers
 
             if not isinstance(answers, dict):
                 raise ValueError(f"Invalid answers format: {type(answers)}")
@@ -864,16 +941,34 @@ def start_execution():
             # Save results
             with open(output_dir / 'answers.json', 'w') as f:
                 json.dump(answers, f, indent=2)
+            # Deduplicated runs also need each agent's weight, the same for every execution (see prepare_execution)
+            deduplicate, samples_per_profile, sampling = get_deduplication_settings(config)
+            if deduplicate:
+                _, weights = build_execution_plan(sample_space, samples_per_profile, sampling)
+                with open(output_dir / 'weights.json', 'w') as f:
+                    json.dump(weights, f, indent=2)
+            else:
+                (output_dir / 'weights.json').unlink(missing_ok=True)
             print("Saved results")
 
-            return jsonify({'success': True})
+            return answers
+
+        def reset_stop_file():
+            with open(output_dir / "stop.json", 'w') as f:
+                json.dump({'stopped': False}, f)
 
-        except Exception as inner_e:
-            error_msg = f"Execution error: {str(inner_e)}"
-            print(error_msg)
-            print(f"Error type: {type(inner_e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
+        # The execution runs in the background job runner; the client follows it by job id.
+        # The runner resets the stop state only if no other job is active.
+        job = job_runner.submit(run_execution, f"Survey execution ({'resume' if resume else 'new'})", reset_stop_file)
+        if job is None:
+            active_job = job_runner.active_job()
+            return jsonify({
+                'success': False,
+                'error': 'Another execution is still running',
+                'job_id': active_job.job_id if active_job else None
+            }), 409
+
+        return jsonify({'success': True, 'job_id': job.job_id}), 202
 
     except Exception as e:
         error_msg = f"Error in start_execution: {str(e)}"
@@ -886,6 +981,42 @@ def start_execution():
         }), 500
 
 
+@app.route('/api/execution/jobs')
+def list_execution_jobs():
+    return jsonify({'success': True, 'jobs': job_runner.list()})
+
+
+@app.route('/api/execution/jobs/<job_id>')
+def get_execution_job(job_id):
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+
+@app.route('/api/execution/jobs/<job_id>/result')
+def get_execution_job_result(job_id):
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    if job.status not in (SUCCEEDED, STOPPED):
+        return jsonify({'success': False, 'status': job.status, 'error': job.error or f"Job is {job.status}"}), 409
+    return jsonify({
+        'success': True,
+        'status': job.status,
+        'stopped': job.status == STOPPED,
+        'answers': job.result
+    })
+
+
+@app.route('/api/execution/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_execution_job(job_id):
+    job = job_runner.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify({'success': True, **job.to_dict()})
+
+
 @app.route('/api/execution/stop', methods=['POST'])
 def stop_execution():
     try:
@@ -933,7 +1064,17 @@ def get_execution_progress(execution_num):
         output_dir = config_manager.get_config_set()[3].output_dir
         total_executions = get_sample_settings_dict()['executions']
 
-        # Get progress from current execution directory
+        # Executions that ran in this process are tracked in memory
+        snapshot = get_progress(f"execution_{execution_num}")
+        if snapshot is not None:
+            return jsonify({
+                'success': True,
+                **snapshot,
+                'current_execution': execution_num,
+                'total_executions': total_executions
+            })
+
+        # Otherwise fall back to the final state written when the execution ended
         execution_dir = output_dir / f"execution_{execution_num}"
         progress_file = execution_dir / 'progress.json'
 
@@ -971,6 +1112,37 @@ def get_execution_progress(execution_num):
         })
 
 
+SSE_KEEPALIVE_SECONDS = 15
+
+@app.route('/api/execution/events')
+def execution_events():
+    """
+    Server-Sent Events stream of execution progress: started, progress (agents done, tokens, ETA), segment,
+    error, answer, finished and stopped events. New subscribers first receive the current state of every execution.
+    """
+    events = queue.Queue()
+    callback = progress_bus.subscribe(events.put)
+
+    def stream():
+        try:
+            yield f"data: {json.dumps({'type': 'snapshot', 'executions': all_progress()})}\n\n"
+            while True:
+                try:
+                    event = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event, default=str)}\n\n"
+        finally:
+            progress_bus.unsubscribe(callback)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
 @app.route('/api/execution/download/<format>/<int:execution_num>')
 def download_results(format, execution_num):
     try:
@@ -981,11 +1153,32 @@ def download_results(format, execution_num):
         if not execution_dir.exists():
             return jsonify({'error': f'Execution {execution_num} not found'}), 404
 
+        # Deduplicated executions record how many profiles each agent stands for
+        weights_path = execution_dir / 'weights.json'
+        weights = None
+        if weights_path.exists():
+            with open(weights_path, 'r') as f:
+                weights = json.load(f)
+
         if format == 'json':
             json_path = execution_dir / 'answers.json'
             if not json_path.exists():
                 return jsonify({'error': 'Results file not found'}), 404
 
+            if weights is not None:
+                with open(json_path, 'r') as f:
+                    data = json.load(f)
+                weighted = {
+                    agent_id: {'weight': weights.get(agent_id, 1), 'answers': responses}
+                    for agent_id, responses in data.items()
+                }
+                return send_file(
+                    io.BytesIO(json.dumps(weighted, indent=2).encode('utf-8')),
+                    mimetype='application/json',
+                    as_attachment=True,
+                    download_name=f'survey_responses_execution_{execution_num}.json'
+                )
+
             return send_file(
                 json_path,
                 mimetype='application/json',
@@ -1006,6 +1199,8 @@ def download_results(format, execution_num):
             rows = []
             for agent_id, responses in data.items():
                 row = {'agent_id': agent_id}
+                if weights is not None:
+                    row['weight'] = weights.get(agent_id, 1)
                 for q_id, answer in responses.items():
                     if isinstance(answer, list):
                         answer = ' | '.join(str(a) for a in answer)
@@ -4,16 +4,26 @@ import Module.ExecutionModule.flow
 from Config.config import load_config, load
 from Module.ExecutionModule.cost_estimation import cost_estimation
 from UtilityFunctions import json_processing
+import argparse
 
 if __name__ == "__main__":
+    # A run that crashed or was stopped is continued from its execution journals with
+    #   python main_backend.py --resume-run Data/Output/<run>
+    parser = argparse.ArgumentParser(description="Preprocess, sample and execute a survey")
+    parser.add_argument("--config", default="./Config/config.json")
+    parser.add_argument("--resume-run", default=None, help="Output directory of an earlier run to resume; its survey and samples are reused")
+    args = parser.parse_args()
+    resume = args.resume_run is not None
+
     # Setup
-    config_set = load_config("./Config/config.json")
+    config_set = load_config(args.config, args.resume_run)
     config, llm_client, logger, output_manager = config_set
+    run_path = args.resume_run if resume else './Data/Output/debug/'
 
     ################################
     # I. Survey preprocessing
     # I-a. Preprocessing
-    if json_processing.get_json_nested_value(config, "debug_switch.preprocess"):
+    if json_processing.get_json_nested_value(config, "debug_switch.preprocess") and not resume:
         # Determine processing mode based on file extension
         survey_path = json_processing.get_json_nested_value(config, "user_preference.survey_path")
         file_extension = survey_path.lower().split('.')[-1] if '.' in survey_path else ''
@@ -24,20 +34,20 @@ if __name__ == "__main__":
         else:
             # Other files use text processing
             processed_data, question_segments, is_dag = Module.PreprocessingModule.flow.preprocess_survey(config_set, survey_path)
-    else: processed_data, question_segments, is_dag = load('preprocess', config)
+    else: processed_data, question_segments, is_dag = load('preprocess', config, run_path)
 
     # I-b. DAG check
     logger.info(f"Survey size: {len(processed_data)}")
 
     # I-c. Model calibration
-    if json_processing.get_json_nested_value(config, "user_preference.model_calibration.enable"):
+    if json_processing.get_json_nested_value(config, "user_preference.model_calibration.enable") and not resume:
         Module.PreprocessingModule.flow.preprocess_survey_model_calibration(config_set, processed_data)
 
-    processed_data, question_segments, is_dag = load('preprocess', config)
+    processed_data, question_segments, is_dag = load('preprocess', config, run_path)
 
     ################################
     # II. Sample space generation
-    if json_processing.get_json_nested_value(config, "debug_switch.samplespace"):
+    if json_processing.get_json_nested_value(config, "debug_switch.samplespace") and not resume:
         # II-a. Sample dimensions generation
         sample_dimensions = Module.SampleGenerationModule.flow.generate_sample_dimension(config_set, processed_data)
 
@@ -45,7 +55,7 @@ if __name__ == "__main__":
 
         # II-c. Sample generation
         sampled_df = Module.SampleGenerationModule.flow.generate_sample_space(config_set)
-    else: sample_dimensions, sampled_df = load('samplespace', config)
+    else: sample_dimensions, sampled_df = load('samplespace', config, run_path)
 
     sample_space, sample_space_size = Module.SampleGenerationModule.flow.format_sample_space(sampled_df)
     sample_profile_0 = Module.SampleGenerationModule.flow.format_single_profile(sample_space[0], sample_dimensions)
@@ -66,7 +76,7 @@ if __name__ == "__main__":
     execution_order = json_processing.get_json_nested_value(config, "user_preference.execution.order")
 
     if not json_processing.get_json_nested_value(config, "debug_switch.execution"): sample_space_size = 2
-    answers, errors = Module.ExecutionModule.flow.questionnaire_execute_iterator(config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, json_processing.get_json_nested_value(config, "user_preference.execution.segmentation"))
+    answers, errors = Module.ExecutionModule.flow.questionnaire_execute_iterator(config_set, processed_data, question_segments, execution_order, sample_space, sample_space_size, sample_dimensions, json_processing.get_json_nested_value(config, "user_preference.execution.segmentation"), resume=resume)
 
     ################################
     # IV. Results presentation
@@ -1,8 +1,51 @@
-let progressPollingInterval;
+let progressSource;
 let currentExecutionNum = 1;
 let totalExecutions = 1;
 let completedExecutions = new Set();
 let executionFinished = false;
+let resumeAvailable = false;
+let jobPollInterval;
+
+function stopFollowingJob() {
+    if (jobPollInterval) {
+        clearInterval(jobPollInterval);
+        jobPollInterval = null;
+    }
+}
+
+// The execution runs as a background job; poll its status until it ends
+function followJob(jobId, onDone, onError) {
+    stopFollowingJob();
+    jobPollInterval = setInterval(() => {
+        fetch(`/api/execution/jobs/${jobId}`)
+            .then(response => response.json())
+            .then(job => {
+                if (!job.success) {
+                    throw new Error(job.error || 'Error checking execution job');
+                }
+                if (job.status === 'queued' || job.status === 'running') {
+                    return;
+                }
+                stopFollowingJob();
+                if (job.status === 'failed') {
+                    onError(new Error(job.error || 'Execution failed'));
+                } else {
+                    onDone(job);
+                }
+            })
+            .catch(error => {
+                stopFollowingJob();
+                onError(error);
+            });
+    }, 1000);
+}
+
+function closeProgressStream() {
+    if (progressSource) {
+        progressSource.close();
+        progressSource = null;
+    }
+}
 
 document.addEventListener('DOMContentLoaded', function () {
     const estimatedCostElem = document.getElementById('estimatedCost');
@@ -47,7 +90,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
     //stopping logic
     stopButton.addEventListener('click', function () {
-        clearInterval(progressPollingInterval);
+        closeProgressStream();
         stopModal.style.display = 'block';
         stopButton.disabled = true;
         const stopMessage = document.querySelector('#stopMessage');
@@ -83,7 +126,7 @@ document.addEventListener('DOMContentLoaded', function () {
                             }
                             if (executionFinished) {
                                 executionFinished = false;
-                                /* progress polling completes the last execution. However, the polling is cleared when clicking the button.
+                                /* progress events complete the last execution. However, the event stream is closed when clicking the button.
                                    in this if statement we know that the last execution has been completed for sure. So we should add it to the set
                                    and reload the results display accordingly.
                                 * */
@@ -123,11 +166,93 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     });
 
-    // Start execution handler
-    startButton.addEventListener('click', function () {
+    function executionNumber(execution) {
+        return parseInt(String(execution).replace('execution_', '')) || 1;
+    }
+
+    function formatEta(seconds) {
+        if (seconds === null || seconds === undefined) {
+            return 'estimating';
+        }
+        const minutes = Math.floor(seconds / 60);
+        return minutes > 0 ? `${minutes}m ${Math.round(seconds % 60)}s` : `${Math.round(seconds)}s`;
+    }
+
+    function renderProgress(state) {
         const progressBar = document.querySelector('.progress-bar-fill');
         const progressText = document.querySelector('.progress-text');
+        const progressDetails = document.getElementById('progressDetails');
+
+        document.getElementById('currentExecution').textContent = executionNumber(state.execution);
+        progressBar.style.width = `${state.progress}%`;
+        progressText.textContent = `${Math.round(state.progress)}%`;
+        progressDetails.textContent =
+            `${state.agents_done} of ${state.total_agents} agents · ${state.segments_done} segments · ` +
+            `${state.tokens.toLocaleString()} tokens · ${state.errors} errors · ETA ${formatEta(state.eta_seconds)}`;
+    }
+
+    // Progress is pushed by the server as Server-Sent Events, one state per execution
+    function openProgressStream() {
+        closeProgressStream();
+        const executions = {};
+        let connected = false;
+
+        progressSource = new EventSource('/api/execution/events');
+        progressSource.onmessage = function (message) {
+            const event = JSON.parse(message.data);
+
+            if (event.type === 'snapshot') {
+                // The first snapshot can still hold finished executions of the previous run; after a reconnect it is the current state
+                event.executions
+                    .filter(state => connected || state.status === 'running')
+                    .forEach(state => executions[state.execution] = state);
+                connected = true;
+            } else if (['started', 'progress', 'finished', 'stopped'].includes(event.type)) {
+                executions[event.execution] = event;
+            } else if (event.type === 'budget') {
+                if (event.action === 'stop') {
+                    showError('Budget ceiling reached, execution stopped. Start again to resume.');
+                }
+                return;
+            } else {
+                return;
+            }
+
+            const states = Object.values(executions).sort((a, b) => executionNumber(a.execution) - executionNumber(b.execution));
+            if (states.length === 0) {
+                return;
+            }
+            states.filter(state => state.status === 'finished')
+                .forEach(state => completedExecutions.add(executionNumber(state.execution)));
+
+            const running = states.find(state => state.status === 'running');
+            const shown = running || states[states.length - 1];
+            currentExecutionNum = executionNumber(shown.execution);
+            renderProgress(shown);
+            updateExecutionDisplay();
 
+            if (states.some(state => state.status === 'stopped')) {
+                closeProgressStream();
+            } else if (completedExecutions.size >= totalExecutions) {
+                closeProgressStream();
+                showResults();
+                startButton.disabled = false;
+                stopButton.disabled = true;
+            }
+        };
+        progressSource.onerror = function () {
+            // EventSource reconnects on its own unless the server refused the stream
+            if (progressSource && progressSource.readyState === EventSource.CLOSED) {
+                closeProgressStream();
+                progressIndicator.style.display = 'none';
+                startButton.disabled = false;
+                showError('Error checking progress');
+            }
+        };
+    }
+
+    // Start execution handler
+    startButton.addEventListener('click', function () {
 
         completedExecutions.clear()
         progressIndicator.style.display = 'block';
@@ -139,7 +264,11 @@ document.addEventListener('DOMContentLoaded', function () {
 
         // Determine multi_modal based on current file's processing mode
         // This will be handled by the backend based on stored processing mode
-        const requestBody = {};
+        // After a stop, starting again resumes from the agents already journaled
+        const requestBody = { resume: resumeAvailable };
+        resumeAvailable = false;
+
+        openProgressStream();
 
         fetch('/api/execution/start', {
             method: 'POST',
@@ -153,8 +282,12 @@ document.addEventListener('DOMContentLoaded', function () {
                 if (!data.success) {
                     throw new Error(data.error || 'Execution failed');
                 }
+                return new Promise((resolve, reject) => followJob(data.job_id, resolve, reject));
+            })
+            .then(job => {
                 stopButton.disabled = true;
-                if (data.hasOwnProperty("stopped") && data.stopped) {
+                if (job.status === 'stopped' || job.status === 'cancelled') {
+                    resumeAvailable = true;
                     return;
                 } else {
                     executionFinished = true;
@@ -162,57 +295,11 @@ document.addEventListener('DOMContentLoaded', function () {
                 document.getElementById('resultsSection').style.display = 'block';
             })
             .catch(error => {
+                closeProgressStream();
                 document.getElementById('progressIndicator').style.display = 'none';
                 startButton.disabled = false;
                 showError(error.message || 'Error during execution');
             });
-
-        progressPollingInterval = setInterval(() => {
-            fetch(`/api/execution/progress/${currentExecutionNum}`)
-                .then(response => response.json())
-                .then(data => {
-                    if (!data.success) {
-                        if (data.error) {
-                            clearInterval(progressPollingInterval);
-                            showError(data.error);
-                            startButton.disabled = false;
-                        }
-                        return;
-                    }
-
-                    const progress = data.progress;
-                    const executionNum = data.current_execution || 1;
-                    const totalExecs = data.total_executions || totalExecutions;
-
-                    document.getElementById('currentExecution').textContent = executionNum;
-                    document.getElementById('totalExecutions').textContent = totalExecs;
-
-                    progressBar.style.width = `${progress}%`;
-                    progressText.textContent = `${Math.round(progress)}%`;
-
-                    if (progress >= 100) {
-                        completedExecutions.add(executionNum);
-
-                        if (currentExecutionNum < totalExecs) {
-                            currentExecutionNum = executionNum + 1;
-                            updateExecutionDisplay();
-                        } else {
-                            clearInterval(progressPollingInterval);
-                            showResults();
-                            progressIndicator.style.display = 'none';
-                            startButton.disabled = false;
-                            stopButton.disabled = true;
-                        }
-
-                    }
-                })
-                .catch(error => {
-                    clearInterval(progressPollingInterval);
-                    progressIndicator.style.display = 'none';
-                    startButton.disabled = false;
-                    showError('Error checking progress');
-                });
-        }, 1000);
     });
 
     // Load metrics
@@ -0,0 +1,82 @@
+import argparse
+import json
+from pathlib import Path
+
+import pandas as pd
+
+import Module.PreprocessingModule.flow
+import Module.SampleGenerationModule.flow
+from Config.config import load_config
+from Module.ExecutionModule.execution_plan import get_deduplication_settings
+from Module.ExecutionModule.work_queue import WorkQueue, enqueue_executions, run_worker, merge_execution, queued_executions
+from UtilityFunctions import json_processing
+
+
+def load_execution_inputs(config, output_dir):
+    """Survey, sample space and dimensions of a run, read from its output directory as /api/execution/start does."""
+    with open(output_dir / 'processed_survey.json', 'r', encoding='utf-8') as f:
+        processed_data = json.load(f)
+
+    sampled_df = pd.read_csv(output_dir / 'sample_space.csv')
+    upload = json_processing.get_json_nested_value(config, "user_preference.sample.upload") is True
+    if not upload:
+        sample_space, _ = Module.SampleGenerationModule.flow.format_sample_space(sampled_df)
+        with open(output_dir / 'sample_dimensions.json', 'r') as f:
+            sample_dimensions = json.load(f)
+    else:
+        samples = sampled_df.iloc[:, 0].tolist()
+        sample_space = Module.SampleGenerationModule.flow.format_uploaded_sample_space(samples, get_deduplication_settings(config)[0])
+        sample_dimensions = {}
+
+    try:
+        with open(output_dir / 'sample_settings.json', 'r') as f:
+            num_executions = int(json.load(f).get("executions", 1))
+    except (FileNotFoundError, json.JSONDecodeError):
+        num_executions = 1
+
+    return processed_data, sample_space, sample_dimensions, upload, num_executions
+
+if __name__ == "__main__":
+    # Several workers (processes or machines sharing the run directory) can drain one run:
+    #   python worker.py enqueue --run-dir Data/Output/<run>
+    #   python worker.py work --run-dir Data/Output/<run>     (start as many as needed)
+    #   python worker.py merge --run-dir Data/Output/<run>
+    parser = argparse.ArgumentParser(description="Work queue executor for questionnaire executions")
+    parser.add_argument("command", choices=["enqueue", "work", "merge", "status"])
+    parser.add_argument("--run-dir", required=True, help="Output directory of the run, e.g. Data/Output/<timestamp>_survey")
+    parser.add_argument("--config", default="./Config/config.json")
+    parser.add_argument("--resume", action="store_true", help="enqueue: keep agents already completed, by workers or in the executions' journals")
+    parser.add_argument("--multi-modal", action="store_true", help="enqueue: answer from the uploaded survey file")
+    parser.add_argument("--worker-id", default=None, help="work: defaults to <hostname>-<pid>")
+    args = parser.parse_args()
+
+    run_dir = Path(args.run_dir)
+    config_set = load_config(args.config, run_dir)
+    config, llm_client, logger, output_manager = config_set
+
+    if args.command == "enqueue":
+        processed_data, sample_space, sample_dimensions, upload, num_executions = load_execution_inputs(config, run_dir)
+        with open(run_dir / "stop.json", 'w') as f:
+            json.dump({'stopped': False}, f)
+        enqueue_executions(
+            config_set, processed_data,
+            json_processing.get_json_nested_value(config, "user_preference.execution.order"),
+            sample_space, len(sample_space), sample_dimensions, num_executions,
+            json_processing.get_json_nested_value(config, "user_preference.execution.segmentation") is True,
+            upload, args.multi_modal, args.resume
+        )
+
+    elif args.command == "work":
+        completed = run_worker(config_set, args.worker_id)
+        logger.info(f"Worker finished after {completed} agents")
+
+    elif args.command == "merge":
+        for execution_dir in queued_executions(run_dir):
+            if merge_execution(config_set, execution_dir) is not None:
+                logger.info(f"{execution_dir.name}: merged answers.json")
+
+    else:
+        for execution_dir in queued_executions(run_dir):
+            queue = WorkQueue(execution_dir)
+            print(f"{execution_dir.name}: {queue.counts()}")
+            queue.close()